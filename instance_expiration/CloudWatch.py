@@ -14,6 +14,7 @@ AWS Cloud Development Kit (CDK) construct for CloudWatch resources for the stack
 from aws_cdk import (
   aws_cloudwatch,
   aws_logs,
+  Duration,
   Stack,
 )
 
@@ -26,6 +27,40 @@ from constructs import Construct
 
 
 
+########################################################################################################################
+# Globals
+########################################################################################################################
+
+# Alarm when the 99th percentile of expiration lag (the time from an EC2 instance's expiration to the action on it)
+# exceeds this many seconds, over LAG_ALARM_PERIODS consecutive periods. Expirations are normally acted on within a
+# couple of minutes (plus the CheckGraceWindow); lag beyond this points at missed checks caught by the backup schedule.
+LAG_ALARM_SECONDS = 600
+LAG_ALARM_PERIODS = 3
+ALARM_PERIOD = Duration.minutes(5)
+
+# Expiration lag service level objective: the 99th percentile of the lag of actions found by the next check schedule,
+# less the CheckGraceWindow (by which checks are deliberately delayed), is within this many seconds.
+LAG_SLO_SECONDS = 120
+LAG_SLO_PERCENTILE = 99
+
+# Values of the Trigger dimension of the ExpirationLag metric (see OnActed in Lambda.py), and their graph colors.
+LAG_TRIGGERS = {
+  'NextSchedule': Color.GREEN,
+  'RateSchedule': Color.ORANGE,
+  'Tag': Color.BLUE,
+  'Start': Color.PURPLE,
+  'ImminentWait': Color.GREY,
+  'Continuation': Color.BROWN,
+}
+
+# Values of the Action dimension of the ExpirationLag metric, and their graph colors.
+LAG_ACTIONS = {
+  'STOP': Color.GREY,
+  'TERM': Color.BROWN,
+}
+
+
+
 ########################################################################################################################
 # Main Class
 ########################################################################################################################
@@ -38,14 +73,16 @@ class CloudWatch(Construct):
 
 
   def __init__(self, scope: Construct, construct_id: str,
-               ix_lambda, ix_dlq, ix_queue, ix_sched_group, ix_tag_rule, ix_start_rule, **kwargs) -> None:
+               ix_lambda, ix_dlq, ix_queue, ix_sched_group, ix_tag_rule, ix_start_rule, ix_check_grace_window,
+               **kwargs) -> None:
     """
-    :param ix_lambda:        aws_cdk.aws_lambda.Function
-    :param ix_dlq:           aws_cdk.aws_sqs.Queue
-    :param ix_queue:         aws_cdk.aws_sqs.Queue
-    :param ix_sched_group:   Schedule group name (string)
-    :param ix_tag_rule:      aws_cdk.aws_events.Rule
-    :param ix_start_rule:    aws_cdk.aws_events.Rule
+    :param ix_lambda:               aws_cdk.aws_lambda.Function
+    :param ix_dlq:                  aws_cdk.aws_sqs.Queue
+    :param ix_queue:                aws_cdk.aws_sqs.Queue
+    :param ix_sched_group:          Schedule group name (string)
+    :param ix_tag_rule:             aws_cdk.aws_events.Rule
+    :param ix_start_rule:           aws_cdk.aws_events.Rule
+    :param ix_check_grace_window:   Check grace window, in seconds (string, or a token for the CFN parameter)
     """
 
     super().__init__(scope, construct_id)
@@ -173,6 +210,22 @@ class CloudWatch(Construct):
       )
     )
 
+    ix_cw_dashboard.add_widgets(
+      aws_cloudwatch.LogQueryWidget(
+        title = 'Lambda API Calls',
+        width = 24,
+        log_group_names = [ix_lambda.log_group.log_group_name],
+        view = aws_cloudwatch.LogQueryVisualizationType.TABLE,
+        query_lines = [
+          'fields @timestamp, @message',
+          'filter @message like "API calls: "',
+          'parse @message "API calls: * in *s;" as Calls, Seconds',
+          'sort Seconds desc',
+          'limit 100',
+        ],
+      )
+    )
+
     ix_cw_dashboard.add_widgets(
       aws_cloudwatch.LogQueryWidget(
         title = 'Lambda Memory Used (MB)',
@@ -206,6 +259,137 @@ class CloudWatch(Construct):
       )
     )
 
+    #
+    # Application Metrics (EMF records written by the Lambda; see Metrics.py)
+    #
+
+    ix_lag_alarm = aws_cloudwatch.Alarm(self, "ExpirationLagAlarm",
+      alarm_description = "Expiration lag p99 above " + str(LAG_ALARM_SECONDS) + " seconds.",
+      metric = self.AppMetric('ExpirationLag', Stats.percentile(99), Color.RED),
+      threshold = LAG_ALARM_SECONDS,
+      evaluation_periods = LAG_ALARM_PERIODS,
+      comparison_operator = aws_cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+      treat_missing_data = aws_cloudwatch.TreatMissingData.NOT_BREACHING,
+    )
+
+    ix_slo_alarm = aws_cloudwatch.Alarm(self, "ExpirationLagSloAlarm",
+      alarm_description = "Expiration lag SLO: next schedule check lag p" + str(LAG_SLO_PERCENTILE) + ", less the "
+                          "check grace window, above " + str(LAG_SLO_SECONDS) + " seconds.",
+      metric = aws_cloudwatch.MathExpression(
+        label = 'NextSchedule p' + str(LAG_SLO_PERCENTILE) + ' less grace window',
+        expression = "lag - " + ix_check_grace_window,
+        using_metrics = {
+          'lag': self.AppMetric('ExpirationLag', Stats.percentile(LAG_SLO_PERCENTILE), Color.RED,
+                                Trigger = 'NextSchedule'),
+        },
+        period = ALARM_PERIOD,
+      ),
+      threshold = LAG_SLO_SECONDS,
+      evaluation_periods = LAG_ALARM_PERIODS,
+      comparison_operator = aws_cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+      treat_missing_data = aws_cloudwatch.TreatMissingData.NOT_BREACHING,
+    )
+
+    ix_reject_alarm = aws_cloudwatch.Alarm(self, "VerificationRejectsAlarm",
+      alarm_description = "Actions aborted by the Lambda function verifier.",
+      metric = self.AppMetric('VerificationRejects', Stats.SUM, Color.RED),
+      threshold = 0,
+      evaluation_periods = 1,
+      comparison_operator = aws_cloudwatch.ComparisonOperator.GREATER_THAN_THRESHOLD,
+      treat_missing_data = aws_cloudwatch.TreatMissingData.NOT_BREACHING,
+    )
+
+    ix_cw_dashboard.add_widgets(
+      aws_cloudwatch.AlarmStatusWidget(
+        title = "App Alarms",
+        width = 24,
+        height = 3,
+        alarms = [ix_lag_alarm, ix_slo_alarm, ix_reject_alarm],
+      )
+    )
+
+    ix_cw_dashboard.add_widgets(
+      aws_cloudwatch.GraphWidget(
+        title = "App Instances",
+        width = 24,
+        left = [
+          self.AppMetric('InstancesDue', Stats.SUM, Color.BLUE),
+          self.AppMetric('StopActions', Stats.SUM, Color.GREY),
+          self.AppMetric('TerminateActions', Stats.SUM, Color.BROWN),
+          self.AppMetric('VerificationRejects', Stats.SUM, Color.RED),
+        ],
+        right = [
+          self.AppMetric('InstancesScanned', Stats.SUM, Color.GREEN),
+        ],
+      )
+    )
+
+    ix_cw_dashboard.add_widgets(
+      aws_cloudwatch.GraphWidget(
+        title = "App Expiration Lag (seconds)",
+        width = 24,
+        left = [
+          self.AppMetric('ExpirationLag', Stats.percentile(50), Color.GREEN),
+          self.AppMetric('ExpirationLag', Stats.percentile(90), Color.ORANGE),
+          self.AppMetric('ExpirationLag', Stats.percentile(99), Color.RED),
+          self.AppMetric('ExpirationLag', Stats.MAXIMUM, Color.PURPLE),
+        ],
+        left_annotations = [
+          aws_cloudwatch.HorizontalAnnotation(value = LAG_ALARM_SECONDS, label = 'p99 alarm', color = Color.RED),
+        ],
+      )
+    )
+
+    ix_cw_dashboard.add_widgets(
+      aws_cloudwatch.GraphWidget(
+        title = "App Expiration Lag p50 by Trigger (seconds)",
+        width = 12,
+        left = [
+          self.AppMetric('ExpirationLag', Stats.percentile(50), color, label = trigger, Trigger = trigger)
+          for trigger, color in LAG_TRIGGERS.items()
+        ],
+      ),
+      aws_cloudwatch.GraphWidget(
+        title = "App Expiration Lag p99 by Trigger (seconds)",
+        width = 12,
+        left = [
+          self.AppMetric('ExpirationLag', Stats.percentile(99), color, label = trigger, Trigger = trigger)
+          for trigger, color in LAG_TRIGGERS.items()
+        ],
+        left_annotations = [
+          aws_cloudwatch.HorizontalAnnotation(value = LAG_SLO_SECONDS, label = 'SLO (less grace window)',
+                                              color = Color.RED),
+        ],
+      ),
+    )
+
+    ix_cw_dashboard.add_widgets(
+      aws_cloudwatch.GraphWidget(
+        title = "App Expiration Lag by Action (seconds)",
+        width = 24,
+        left = [
+          self.AppMetric('ExpirationLag', Stats.percentile(p), color, label = action + ' p' + str(p), Action = action)
+          for action, color in LAG_ACTIONS.items()
+          for p in (50, 99)
+        ],
+      )
+    )
+
+    ix_cw_dashboard.add_widgets(
+      aws_cloudwatch.GraphWidget(
+        title = "App Phase Durations (ms)",
+        width = 24,
+        stacked = True,
+        left = [
+          self.AppMetric('ScanDuration', Stats.SUM, Color.GREEN),
+          self.AppMetric('VerifyDuration', Stats.SUM, Color.BLUE),
+          self.AppMetric('ActDuration', Stats.SUM, Color.ORANGE),
+          self.AppMetric('EmitDuration', Stats.SUM, Color.PINK),
+          self.AppMetric('ScheduleDuration', Stats.SUM, Color.PURPLE),
+        ],
+      )
+    )
+
     #
     # Application Log Metrics
     #
@@ -215,8 +399,6 @@ class CloudWatch(Construct):
         title = "App Log Metrics",
         width = 24,
         left = [
-          self.AppLogMetric('StopActions', '"Stopped EC2 instance: "', Stats.SUM, Color.GREY),
-          self.AppLogMetric('TerminateActions', '"Terminated EC2 instance: "', Stats.SUM, Color.BROWN),
           self.AppLogMetric('Warnings', '"[WARNING]"', Stats.SUM, Color.ORANGE),
           self.AppLogMetric('Errors', '"[ERROR]"', Stats.SUM, Color.RED),
         ]
@@ -296,6 +478,26 @@ class CloudWatch(Construct):
 
 
 
+  def AppMetric(self, name, statistic, color, label = None, **dimensions):
+    """
+    Construct and return an application metric, as written by the Lambda in EMF records, optionally for the given
+    dimension values (ex: Trigger = 'Tag').
+    """
+
+    m = aws_cloudwatch.Metric(
+      namespace = Stack.of(self).stack_name,
+      metric_name = name,
+      statistic = statistic,
+      color = color,
+      label = label,
+      period = ALARM_PERIOD,
+      dimensions_map = dimensions or None,
+    )
+
+    return m
+
+
+
   def AppLogMetric(self, name, pattern, statistic, color):
     """
     Construct and return an Amazon CloudWatch log metric.
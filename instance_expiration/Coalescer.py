@@ -0,0 +1,178 @@
+"""
+AWS Cloud Development Kit (CDK) construct for coalescing bursts of events before they reach the Instance Expiration
+lambda's queue.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+import os
+
+from aws_cdk import (
+  aws_iam,
+  aws_lambda,
+  aws_lambda_event_sources,
+  aws_logs,
+  aws_sqs,
+  Duration,
+)
+
+import cdk_nag
+from constructs import Construct
+
+
+
+########################################################################################################################
+# Main Class
+########################################################################################################################
+
+class Coalescer(Construct):
+  """
+  Creates a standard queue that collects events over a batching window, and a Lambda that forwards each batch to the
+  (FIFO) queue of the Instance Expiration lambda as a few coalesced messages.
+  """
+
+  @property
+  def Queue(self):
+    return self._queue
+
+
+
+  def __init__(self, scope: Construct, construct_id: str,
+               ix_queue, ix_message_group_id, window, shard_count, **kwargs) -> None:
+    """
+    :param ix_queue:              aws_cdk.aws_sqs.Queue (FIFO) of the Instance Expiration lambda
+    :param ix_message_group_id:   Message group id for messages sent to ix_queue (string)
+    :param window:                Batching window, in seconds (number, 1-300)
+    :param shard_count:           Number of shards (string)
+    """
+
+    super().__init__(scope, construct_id)
+
+    #
+    # Lambda: Forwards batches of events as coalesced messages.
+    #
+
+    # Lambda execution role
+    self._lambda_role = aws_iam.Role(self, "LambdaIamRole",
+      assumed_by = aws_iam.ServicePrincipal("lambda.amazonaws.com"),
+      managed_policies = [
+        aws_iam.ManagedPolicy.from_aws_managed_policy_name("service-role/AWSLambdaBasicExecutionRole")
+      ]
+    )
+
+    # Lambda function (same code asset as the Instance Expiration lambda, different handler)
+    self._lambda = aws_lambda.Function(self, "Lambda",
+      architecture = aws_lambda.Architecture.ARM_64,
+      runtime = aws_lambda.Runtime.PYTHON_3_13,
+      code = aws_lambda.Code.from_asset(os.path.join("lambda", "InstanceExpiration")),
+      handler = "Coalesce.handler",
+      role = self._lambda_role,
+      memory_size = 256,
+      timeout = Duration.seconds(60),
+      log_retention = aws_logs.RetentionDays.THREE_MONTHS,
+      environment= {
+        "IX_QUEUE_URL": ix_queue.queue_url,
+        "IX_SQS_MESSAGE_ID": ix_message_group_id,
+        "IX_SHARD_COUNT": shard_count,
+      }
+    )
+
+    ix_queue.grant_send_messages(self._lambda)
+
+    #
+    # Amazon SQS Queue: Events --> Queue --> Lambda, batched over the window.
+    #
+
+    # Dead Letter Queue
+    self._dlq = aws_sqs.Queue(self, "DeadLetterQueue",
+      enforce_ssl = True,
+      encryption = aws_sqs.QueueEncryption.SQS_MANAGED,
+      retention_period = Duration.days(7)
+    )
+
+    # Queue
+    self._queue = aws_sqs.Queue(self, "Queue",
+      enforce_ssl = True,
+      encryption = aws_sqs.QueueEncryption.SQS_MANAGED,
+      visibility_timeout = Duration.seconds(6 * 60 + 300),   # Per AWS guidance: 6x Lambda timeout, plus the window
+      dead_letter_queue = aws_sqs.DeadLetterQueue(
+        queue = self._dlq,
+        max_receive_count = 3,
+      )
+    )
+
+    # Queue --> Lambda
+    self._lambda.add_event_source(
+      aws_lambda_event_sources.SqsEventSource(
+        self._queue,
+        batch_size = 1000,                              # Lambda also cuts a batch at its 6 MB payload limit
+        max_batching_window = Duration.seconds(window),
+      )
+    )
+
+    #
+    # cdk-nag Suppressions
+    #
+
+    cdk_nag.NagSuppressions.add_resource_suppressions(
+      construct = self._lambda,
+      suppressions = [
+        {
+          'id':
+            'AwsSolutions-L1',
+          'reason':
+            'Matches the Instance Expiration lambda, which documents why its runtime is pinned.'
+        },
+      ],
+    )
+
+    cdk_nag.NagSuppressions.add_resource_suppressions(
+      construct = self._lambda_role,
+      apply_to_children = True,
+      suppressions = [
+        {
+          'id':
+            'AwsSolutions-IAM4',
+          'applies_to':
+            ['Policy::arn:<AWS::Partition>:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole'],
+          'reason':
+            'Using the standard managed policy for a Lambda function to execute.'
+        },
+      ],
+    )
+
+
+
+  def RuleTarget(self, rule):
+    """
+    Allow an EventBridge rule to send to the queue, and build the rule target for it. The target is returned rather
+    than added, so the caller can choose between it and the rule's existing targets with a condition.
+
+    :param rule:    aws_cdk.aws_events.Rule
+    :return:        Rule target (CloudFormation 'AWS::Events::Rule Target', as a dict)
+    """
+
+    self._queue.add_to_resource_policy(
+      aws_iam.PolicyStatement(
+        principals = [aws_iam.ServicePrincipal("events.amazonaws.com")],
+        actions = ["sqs:SendMessage", "sqs:GetQueueAttributes", "sqs:GetQueueUrl"],
+        resources = [self._queue.queue_arn],
+        conditions = {
+          "ArnEquals": {
+            "aws:SourceArn": rule.rule_arn,
+          }
+        },
+      )
+    )
+
+    return {
+      "Id": "Coalescer",
+      "Arn": self._queue.queue_arn,
+    }
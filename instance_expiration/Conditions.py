@@ -44,6 +44,22 @@ class Conditions:
   def CloudWatchEnabled(self):
     return self._cloudwatch_enabled
 
+  @property
+  def CoalescingEnabled(self):
+    return self._coalescing_enabled
+
+  @property
+  def DirectActionsEnabled(self):
+    return self._direct_actions_enabled
+
+  @property
+  def SnapStartEnabled(self):
+    return self._snap_start_enabled
+
+  @property
+  def TracingEnabled(self):
+    return self._tracing_enabled
+
 
 
   def __init__(self, stack, params) -> None:
@@ -83,3 +99,40 @@ class Conditions:
         "Enable",
       )
     )
+
+    self._coalescing_enabled = aws_cdk.CfnCondition(stack, "CondCoalescingEnabled",
+      expression = aws_cdk.Fn.condition_not(
+        aws_cdk.Fn.condition_equals(
+          params.CoalesceWindow,
+          "0",
+        )
+      )
+    )
+
+    # Direct action schedules are kept alongside the expiration index, so need incremental checks.
+    self._direct_actions_enabled = aws_cdk.CfnCondition(stack, "CondDirectActionsEnabled",
+      expression = aws_cdk.Fn.condition_and(
+        aws_cdk.Fn.condition_equals(
+          params.DirectActions,
+          "Enable",
+        ),
+        aws_cdk.Fn.condition_equals(
+          params.IncrementalChecks,
+          "Enable",
+        ),
+      )
+    )
+
+    self._snap_start_enabled = aws_cdk.CfnCondition(stack, "CondSnapStartEnabled",
+      expression = aws_cdk.Fn.condition_equals(
+        params.SnapStart,
+        "Enable",
+      )
+    )
+
+    self._tracing_enabled = aws_cdk.CfnCondition(stack, "CondTracingEnabled",
+      expression = aws_cdk.Fn.condition_equals(
+        params.Tracing,
+        "Enable",
+      )
+    )
@@ -18,6 +18,54 @@ from aws_cdk import (
 
 
 
+########################################################################################################################
+# Functions
+########################################################################################################################
+
+def ExpirationTagStatements(scope, params, id_prefix, action = None):
+  """
+  Policy statements to stop and terminate EC2 instances, only EC2 instances with at least one expiration tag.
+
+  :param scope:       Construct scope for the statements' condition values.
+  :param id_prefix:   Construct id prefix for the statements' condition values (unique within the scope).
+  :param action:      'stop' or 'terminate' to allow only that action, only on EC2 instances with one of its own
+                      expiration tags; or 'None' for both actions on EC2 instances with any expiration tag.
+  :return:            List of aws_cdk.aws_iam.PolicyStatement
+  """
+
+  api_actions = {
+    'stop': "ec2:StopInstances",
+    'terminate': "ec2:TerminateInstances",
+  }
+
+  expiration_tag_postfixes = [
+    postfix
+    for postfix in [
+      'stop-after-duration',
+      'stop-after-datetime',
+      'terminate-after-duration',
+      'terminate-after-datetime',
+    ]
+    if action is None or postfix.startswith(action + '-')
+  ]
+
+  return [
+    aws_iam.PolicyStatement(
+      actions = list(api_actions.values()) if action is None else [api_actions[action]],
+      conditions = {
+        "Null": aws_cdk.CfnJson(scope, id_prefix + postfix,
+          value = {
+            "ec2:ResourceTag/" + params.TagPrefix + ':' + postfix: "false",
+          }
+        )
+      },
+      resources = ['*'],
+    )
+    for postfix in expiration_tag_postfixes
+  ]
+
+
+
 ########################################################################################################################
 # Main Class
 ########################################################################################################################
@@ -28,7 +76,8 @@ class LambdaPolicies:
   """
 
   def __init__(self, stack, params, conditions, ix_lambda_role,
-    ix_next_schedule_arn_param, ix_next_schedule, ix_scheduler_role, ix_event_bus):
+    ix_next_schedule_arn_param, ix_next_schedule, ix_scheduler_role, ix_event_bus, ix_index_table,
+    ix_schedule_group, ix_queue, ix_direct_action_roles):
 
     #
     # Basic Policy
@@ -55,40 +104,56 @@ class LambdaPolicies:
           ],
           resources = [ix_next_schedule.schedule_arn],
         ),
+        aws_iam.PolicyStatement(
+          actions = [
+            "scheduler:GetSchedule",
+            "scheduler:UpdateSchedule",
+            "scheduler:CreateSchedule",
+          ],
+          resources = [
+            aws_cdk.Arn.format(
+              stack = stack,
+              components = aws_cdk.ArnComponents(
+                service = "scheduler",
+                resource = "schedule",
+                resource_name = ix_schedule_group.group_name + "/NextShard-*",
+              )
+            )
+          ],
+        ),
+        aws_iam.PolicyStatement(
+          actions = [
+            "sqs:SendMessage",
+          ],
+          resources = [ix_queue.queue_arn],
+        ),
         aws_iam.PolicyStatement(
           actions = [
             "iam:PassRole",
           ],
           resources = [ix_scheduler_role.role_arn],
         ),
+        aws_iam.PolicyStatement(
+          actions = [
+            "dynamodb:GetItem",
+            "dynamodb:BatchGetItem",
+            "dynamodb:PutItem",
+            "dynamodb:DeleteItem",
+            "dynamodb:BatchWriteItem",
+            "dynamodb:Query",
+          ],
+          resources = [
+            ix_index_table.table_arn,
+            ix_index_table.table_arn + "/index/*",
+          ],
+        ),
       ]
     )
 
     # Stop and terminate EC2 instances (only EC2 instances with at least one expiration tag).
-    expiration_tag_postfixes = [
-      'stop-after-duration',
-      'stop-after-datetime',
-      'terminate-after-duration',
-      'terminate-after-datetime',
-    ]
-
-    for postfix in expiration_tag_postfixes:
-      ix_lambda_policy.add_statements(
-        aws_iam.PolicyStatement(
-          actions = [
-            "ec2:StopInstances",
-            "ec2:TerminateInstances",
-          ],
-          conditions = {
-            "Null": aws_cdk.CfnJson(stack, "LambdaIamPolicy-" + postfix,
-              value = {
-                "ec2:ResourceTag/" + params.TagPrefix + ':' + postfix: "false",
-              }
-            )
-          },
-          resources = ['*'],
-        )
-      )
+    ix_lambda_policy.add_statements(
+      *ExpirationTagStatements(stack, params, "LambdaIamPolicy-")
+    )
 
     # Attach the basics policy to the role.
     ix_lambda_role.attach_inline_policy(
@@ -122,3 +187,68 @@ class LambdaPolicies:
     ix_lambda_role.attach_inline_policy(
       ix_lambda_policy_events
     )
+
+    #
+    # Direct Actions Policy
+    #
+
+    ix_lambda_policy_direct_actions = aws_iam.Policy(stack, "LambdaIamPolicyDirectActions",
+      statements = [
+        aws_iam.PolicyStatement(
+          actions = [
+            "scheduler:GetSchedule",
+            "scheduler:CreateSchedule",
+            "scheduler:UpdateSchedule",
+            "scheduler:DeleteSchedule",
+          ],
+          resources = [
+            aws_cdk.Arn.format(
+              stack = stack,
+              components = aws_cdk.ArnComponents(
+                service = "scheduler",
+                resource = "schedule",
+                resource_name = ix_schedule_group.group_name + "/Expire-*",
+              )
+            )
+          ],
+        ),
+        aws_iam.PolicyStatement(
+          actions = [
+            "iam:PassRole",
+          ],
+          resources = [role.role_arn for role in ix_direct_action_roles],
+        ),
+      ]
+    )
+
+    # Conditional on the DirectActions parameter.
+    ix_lambda_policy_direct_actions.node.default_child.cfn_options.condition = conditions.DirectActionsEnabled
+
+    # Attach the direct actions policy to the role.
+    ix_lambda_role.attach_inline_policy(
+      ix_lambda_policy_direct_actions
+    )
+
+    #
+    # Tracing Policy
+    #
+
+    ix_lambda_policy_tracing = aws_iam.Policy(stack, "LambdaIamPolicyTracing",
+      statements = [
+        aws_iam.PolicyStatement(
+          actions = [
+            "xray:PutTraceSegments",
+            "xray:PutTelemetryRecords",
+          ],
+          resources = ["*"],
+        ),
+      ]
+    )
+
+    # Conditional on the Tracing parameter.
+    ix_lambda_policy_tracing.node.default_child.cfn_options.condition = conditions.TracingEnabled
+
+    # Attach the tracing policy to the role.
+    ix_lambda_role.attach_inline_policy(
+      ix_lambda_policy_tracing
+    )
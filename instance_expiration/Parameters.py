@@ -52,6 +52,46 @@ class Parameters:
   def CloudWatch(self):
     return self._cloudwatch.value_as_string
 
+  @property
+  def IncrementalChecks(self):
+    return self._incremental_checks.value_as_string
+
+  @property
+  def ActionConcurrency(self):
+    return self._action_concurrency.value_as_string
+
+  @property
+  def ActionRateShare(self):
+    return self._action_rate_share.value_as_string
+
+  @property
+  def CoalesceWindow(self):
+    return self._coalesce_window.value_as_number
+
+  @property
+  def ShardCount(self):
+    return self._shard_count.value_as_string
+
+  @property
+  def DirectActions(self):
+    return self._direct_actions.value_as_string
+
+  @property
+  def CheckGraceWindow(self):
+    return self._check_grace_window.value_as_string
+
+  @property
+  def ImminentWait(self):
+    return self._imminent_wait.value_as_string
+
+  @property
+  def SnapStart(self):
+    return self._snap_start.value_as_string
+
+  @property
+  def Tracing(self):
+    return self._tracing.value_as_string
+
 
 
   def __init__(self, stack) -> None:
@@ -102,3 +142,84 @@ class Parameters:
       allowed_values = ["Enable", "Disable"],
       description = "Enable or disable CloudWatch dashboard and alarms."
     )
+
+    self._incremental_checks = aws_cdk.CfnParameter(stack, "IncrementalChecks",
+      type = "String",
+      default = "Enable",
+      allowed_values = ["Enable", "Disable"],
+      description = "Enable or disable incremental checks using an expiration index instead of full scans."
+    )
+
+    self._action_concurrency = aws_cdk.CfnParameter(stack, "ActionConcurrency",
+      type = "Number",
+      default = "4",
+      min_value = 1,
+      max_value = 16,
+      description = "Maximum number of concurrent EC2 API calls when acting on expired EC2 instances."
+    )
+
+    self._action_rate_share = aws_cdk.CfnParameter(stack, "ActionRateShare",
+      type = "Number",
+      default = "50",
+      min_value = 1,
+      max_value = 100,
+      description = "Percent of the account's EC2 StopInstances/TerminateInstances throttling limits used when acting "
+                    "on expired EC2 instances, leaving the rest to other callers in the account and Region."
+    )
+
+    self._coalesce_window = aws_cdk.CfnParameter(stack, "CoalesceWindow",
+      type = "Number",
+      default = "0",
+      min_value = 0,
+      max_value = 300,
+      description = "Seconds to coalesce bursts of EC2 tag change and start events into one check (0 to disable)."
+    )
+
+    self._shard_count = aws_cdk.CfnParameter(stack, "ShardCount",
+      type = "Number",
+      default = "1",
+      min_value = 1,
+      max_value = 16,
+      description = "Number of shards of EC2 instances, checked in parallel (1 to disable sharding)."
+    )
+
+    self._direct_actions = aws_cdk.CfnParameter(stack, "DirectActions",
+      type = "String",
+      default = "Disable",
+      allowed_values = ["Enable", "Disable"],
+      description = "Enable or disable per-instance schedules that stop/terminate EC2 instances directly (requires "
+                    "IncrementalChecks)."
+    )
+
+    self._check_grace_window = aws_cdk.CfnParameter(stack, "CheckGraceWindow",
+      type = "Number",
+      default = "0",
+      min_value = 0,
+      max_value = 900,
+      description = "Seconds to delay each check past the next expiration, so that expirations within the window are "
+                    "handled by one check (0 to disable)."
+    )
+
+    self._imminent_wait = aws_cdk.CfnParameter(stack, "ImminentWait",
+      type = "Number",
+      default = "0",
+      min_value = 0,
+      max_value = 60,
+      description = "Max seconds a check waits for an imminent expiration, rather than scheduling another check "
+                    "(0 to disable)."
+    )
+
+    self._snap_start = aws_cdk.CfnParameter(stack, "SnapStart",
+      type = "String",
+      default = "Disable",
+      allowed_values = ["Enable", "Disable"],
+      description = "Enable or disable Lambda SnapStart (a published version and alias of the Lambda, invoked by the "
+                    "queue)."
+    )
+
+    self._tracing = aws_cdk.CfnParameter(stack, "Tracing",
+      type = "String",
+      default = "Disable",
+      allowed_values = ["Enable", "Disable"],
+      description = "Enable or disable AWS X-Ray active tracing of the Lambda, with a subsegment per check phase."
+    )
@@ -16,6 +16,7 @@ import datetime
 
 import aws_cdk
 from aws_cdk import (
+  aws_dynamodb,
   aws_events,
   aws_events_targets,
   aws_iam,
@@ -43,9 +44,10 @@ except ImportError as err:
 import cdk_nag
 from constructs import Construct
 from instance_expiration.CloudWatch import CloudWatch
+from instance_expiration.Coalescer import Coalescer
 from instance_expiration.Parameters import Parameters
 from instance_expiration.Conditions import Conditions
-from instance_expiration.LambdaPolicies import LambdaPolicies
+from instance_expiration.LambdaPolicies import LambdaPolicies, ExpirationTagStatements
 from instance_expiration.CdkConditionAspect import CdkConditionAspect
 
 
@@ -87,6 +89,24 @@ class Stack(Stack):
       topic_arn = f"arn:aws:sns:{self.region}:{self.account}:{params.SnsTopicName}",
     )
 
+    #
+    # Amazon DynamoDB Table: Expiration index of in-scope EC2 instances, ordered by expiration date/time.
+    #
+
+    ix_index_table = aws_dynamodb.Table(self, "ExpirationIndex",
+      partition_key = aws_dynamodb.Attribute(name = "InstanceId", type = aws_dynamodb.AttributeType.STRING),
+      billing_mode = aws_dynamodb.BillingMode.PAY_PER_REQUEST,
+      encryption = aws_dynamodb.TableEncryption.AWS_MANAGED,
+      removal_policy = aws_cdk.RemovalPolicy.DESTROY,     # Derived data; rebuilt by the next full scan
+    )
+
+    ix_index_table.add_global_secondary_index(
+      index_name = "ExpireAtIndex",                       # Must match DynamoDbExpirationIndex.GSI_NAME in the Lambda
+      partition_key = aws_dynamodb.Attribute(name = "Shard", type = aws_dynamodb.AttributeType.STRING),
+      sort_key = aws_dynamodb.Attribute(name = "ExpireAt", type = aws_dynamodb.AttributeType.STRING),
+      projection_type = aws_dynamodb.ProjectionType.ALL,
+    )
+
     #
     # Instance Expiration Lambda: Checks for EC2 instances to stop/terminate and schedules its own next check.
     #
@@ -116,9 +136,24 @@ class Stack(Stack):
         "IX_TERM_ACTION": params.TermAction,
         "IX_EVENT_BUS_NAME": params.EventBusName,
         "IX_SSM_PARAM_NEXT_SCHEDULE_ARN": IX_SSM_PARAM_NEXT_SCHEDULE_ARN,
+        "IX_INCREMENTAL_CHECKS": params.IncrementalChecks,
+        "IX_INDEX_TABLE_NAME": ix_index_table.table_name,
+        "IX_ACTION_CONCURRENCY": params.ActionConcurrency,
+        "IX_ACTION_RATE_SHARE": params.ActionRateShare,
+        "IX_SHARD_COUNT": params.ShardCount,
+        "IX_CHECK_GRACE_WINDOW": params.CheckGraceWindow,
+        "IX_IMMINENT_WAIT": params.ImminentWait,
+        "IX_SQS_MESSAGE_ID": IX_SQS_MESSAGE_ID,
+        "IX_METRICS": params.CloudWatch,                # EMF metrics, shown by the CloudWatch dashboard
+        "IX_TRACING": params.Tracing,
       }
     )
 
+    # Tracing: X-Ray active tracing of invocations, with the Lambda adding a subsegment per check phase.
+    ix_lambda.node.default_child.add_property_override("TracingConfig",
+      aws_cdk.Fn.condition_if(conditions.TracingEnabled.logical_id, {"Mode": "Active"}, aws_cdk.Aws.NO_VALUE)
+    )
+
     #
     # Amazon Simple Queue Service (SQS) Queue: Events --> Queue --> Lambda
     #
@@ -145,15 +180,43 @@ class Stack(Stack):
       )
     )
 
+    # Lambda forwards triggers to the message groups of shards (see ShardCount).
+    ix_lambda.add_environment("IX_QUEUE_URL", ix_queue.queue_url)
+
     # Queue --> Lambda
     ix_lambda.add_event_source(
       aws_lambda_event_sources.SqsEventSource(
         ix_queue,
         batch_size = 10,                                # Max number of events per Lambda invocation (max 10 for FIFO)
+        report_batch_item_failures = True,              # Only redeliver failed records (see Lambda handler)
         #max_batching_window = Duration.seconds(5),     # Not allowed for FIFO queues
       )
     )
 
+    # SnapStart: applies to published versions only, so publish one (anew whenever the function changes) behind an
+    # alias, and point the queue's event source mapping at the alias instead of the unpublished function.
+    ix_lambda.node.default_child.add_property_override("SnapStart",
+      aws_cdk.Fn.condition_if(
+        conditions.SnapStartEnabled.logical_id, {"ApplyOn": "PublishedVersions"}, aws_cdk.Aws.NO_VALUE
+      )
+    )
+
+    ix_lambda_alias = aws_lambda.Alias(self, "LambdaAlias",
+      alias_name = "live",
+      version = ix_lambda.current_version,
+    )
+
+    ix_lambda.current_version.node.default_child.cfn_options.condition = conditions.SnapStartEnabled
+    ix_lambda_alias.node.default_child.cfn_options.condition = conditions.SnapStartEnabled
+
+    for ix_esm in ix_lambda.node.find_all():
+      if isinstance(ix_esm, aws_lambda.CfnEventSourceMapping):
+        ix_esm.add_property_override("FunctionName",
+          aws_cdk.Fn.condition_if(
+            conditions.SnapStartEnabled.logical_id, ix_lambda_alias.function_arn, ix_lambda.function_name
+          )
+        )
+
     #
     # Amazon EventBridge Schedulers: Used to schedule invocations of the Lambda.
     #
@@ -177,12 +240,51 @@ class Stack(Stack):
       message_group_id = IX_SQS_MESSAGE_ID,             # Any unique value, for event serialization
     )
 
-    # Schedule group (just to be tidy)
+    # Schedule group (just to be tidy; also holds the next check schedules of shards, created by the Lambda)
     ix_schedule_group = aws_scheduler_alpha.Group(self, "ScheduleGroup",
       group_name = self.stack_name,
       removal_policy = aws_cdk.RemovalPolicy.DESTROY,
     )
 
+    ix_lambda.add_environment("IX_SCHEDULE_GROUP_NAME", ix_schedule_group.group_name)
+
+    # Scheduler roles for the direct action schedules, created by the Lambda in the group: one per action, which can
+    # only take that action, only on EC2 instances with one of that action's expiration tags. A schedule left over from
+    # before its EC2 instance was retagged to the other action (or untagged) is then denied.
+    ix_direct_action_roles = {}
+
+    for action, env_name, role_id in (
+      ('stop', "IX_DIRECT_STOP_ROLE_ARN", "DirectStopRole"),
+      ('terminate', "IX_DIRECT_TERM_ROLE_ARN", "DirectTerminateRole"),
+    ):
+
+      role = aws_iam.Role(self, role_id,
+        assumed_by = aws_iam.ServicePrincipal(
+          service = "scheduler.amazonaws.com",
+          conditions = {
+            "StringEquals": {
+              "aws:SourceAccount": self.account,
+            }
+          }
+        )
+      )
+
+      for statement in ExpirationTagStatements(role, params, "Policy-", action):
+        role.add_to_policy(statement)
+
+      # Conditionalize the role, its policy and their condition values on the related CFN template parameter.
+      aws_cdk.Aspects.of(role).add(CdkConditionAspect(conditions.DirectActionsEnabled))
+
+      ix_lambda.add_environment(env_name,
+        aws_cdk.Fn.condition_if(conditions.DirectActionsEnabled.logical_id, role.role_arn, "").to_string()
+      )
+
+      ix_direct_action_roles[action] = role
+
+    ix_lambda.add_environment("IX_DIRECT_ACTIONS",
+      aws_cdk.Fn.condition_if(conditions.DirectActionsEnabled.logical_id, "Enable", "Disable").to_string()
+    )
+
     # Schedule for the next asynchronous check; Lambda will subsequently schedule its own future checks.
     ix_next_schedule = aws_scheduler_alpha.Schedule(self, "NextSchedule",
       # NOTE: AWS CFN bug prevents retrieving ARN of scheduler in a group.
@@ -258,6 +360,31 @@ class Stack(Stack):
       )
     )
 
+    #
+    # Coalescer: Optionally collect tag change and start events over a window, then forward them to the queue as a few
+    # coalesced messages, so a burst (ex: retagging thousands of EC2 instances) becomes one check.
+    #
+
+    ix_coalescer = Coalescer(self, "Coalescer",
+      ix_queue = ix_queue,
+      ix_message_group_id = IX_SQS_MESSAGE_ID,
+      window = params.CoalesceWindow,
+      shard_count = params.ShardCount,
+    )
+
+    # Conditionalize the entire coalescer on the related CFN template parameter.
+    aws_cdk.Aspects.of(ix_coalescer).add(CdkConditionAspect(conditions.CoalescingEnabled))
+
+    # Rule targets are the coalescer when enabled; otherwise the queue directly (as added above, which also granted the
+    # rules access to the queue). Plain CloudFormation keys, as CDK does not convert struct property names inside an
+    # Fn::If.
+    for rule in (ix_tag_rule, ix_start_rule):
+      rule.node.default_child.targets = aws_cdk.Fn.condition_if(
+        conditions.CoalescingEnabled.logical_id,
+        [ix_coalescer.RuleTarget(rule)],
+        [{"Id": "Target0", "Arn": ix_queue.queue_arn, "SqsParameters": {"MessageGroupId": IX_SQS_MESSAGE_ID}}],
+      )
+
     #
     # Amazon EventBridge Rule: Subscribe to action events
     #
@@ -314,7 +441,8 @@ class Stack(Stack):
     #
 
     ix_lambda_policies = LambdaPolicies(self, params, conditions, ix_lambda_role,
-      ix_next_schedule_arn_param, ix_next_schedule, ix_scheduler_role, ix_event_bus)
+      ix_next_schedule_arn_param, ix_next_schedule, ix_scheduler_role, ix_event_bus, ix_index_table,
+      ix_schedule_group, ix_queue, list(ix_direct_action_roles.values()))
 
     #
     # IAM Policy: Deny expiration tag changes
@@ -362,6 +490,7 @@ class Stack(Stack):
       ix_sched_group = "default",
       ix_tag_rule = ix_tag_rule,
       ix_start_rule = ix_start_rule,
+      ix_check_grace_window = params.CheckGraceWindow,
     )
 
     # Conditionalize the entire dashboard on the related CFN template parameter.
@@ -414,6 +543,86 @@ class Stack(Stack):
             'Project must be able to ec2:DescribeInstances to find EC2 instances with expiration '
             'tags to enforce, and the ec2:DescribeInstances action cannot be conditionalized.'
         },
+        {
+          'id':
+            'AwsSolutions-IAM5',
+          'applies_to':
+            [{'regex': '/^Resource::<ExpirationIndex[A-Z0-9]+\\.Arn>\\/index\\/\\*$/g'}],
+          'reason':
+            'Project must be able to query the global secondary index of its own expiration index table.'
+        },
+        {
+          'id':
+            'AwsSolutions-IAM5',
+          'applies_to':
+            [{'regex': '/^Resource::arn:<AWS::Partition>:scheduler:<AWS::Region>:<AWS::AccountId>:schedule\\/'
+                       '.+\\/NextShard-\\*$/g'}],
+          'reason':
+            'Project must be able to create and update the next check schedules of its shards, whose number is a '
+            'stack parameter, within its own schedule group.'
+        },
+      ],
+    )
+
+    cdk_nag.NagSuppressions.add_resource_suppressions_by_path(
+      stack = self,
+      path = f"/{self.stack_name}/LambdaIamPolicyTracing/Resource",
+      suppressions = [
+        {
+          'id':
+            'AwsSolutions-IAM5',
+          'applies_to':
+            ['Resource::*'],
+          'reason':
+            'AWS X-Ray PutTraceSegments and PutTelemetryRecords do not support resource-level permissions.'
+        },
+      ],
+    )
+
+    cdk_nag.NagSuppressions.add_resource_suppressions_by_path(
+      stack = self,
+      path = f"/{self.stack_name}/LambdaIamPolicyDirectActions/Resource",
+      suppressions = [
+        {
+          'id':
+            'AwsSolutions-IAM5',
+          'applies_to':
+            [{'regex': '/^Resource::arn:<AWS::Partition>:scheduler:<AWS::Region>:<AWS::AccountId>:schedule\\/'
+                       '.+\\/Expire-\\*$/g'}],
+          'reason':
+            'Project must be able to create, update and delete the direct action schedules of EC2 instances, one per '
+            'EC2 instance with an expiration, within its own schedule group.'
+        },
+      ],
+    )
+
+    for role_id in ("DirectStopRole", "DirectTerminateRole"):
+      cdk_nag.NagSuppressions.add_resource_suppressions_by_path(
+        stack = self,
+        path = f"/{self.stack_name}/{role_id}/DefaultPolicy/Resource",
+        suppressions = [
+          {
+            'id':
+              'AwsSolutions-IAM5',
+            'applies_to':
+              ['Resource::*'],
+            'reason':
+              'Direct action schedules must be able to act on any EC2 instance with an expiration tag of their '
+              'action, and are conditioned on those tags.'
+          },
+        ],
+      )
+
+    cdk_nag.NagSuppressions.add_resource_suppressions(
+      construct = ix_index_table,
+      suppressions = [
+        {
+          'id':
+            'AwsSolutions-DDB3',
+          'reason':
+            'The expiration index is derived data, fully rebuilt from the EC2 instances by the next backup check, so '
+            'point-in-time recovery adds cost without benefit.'
+        },
       ],
     )
 
@@ -0,0 +1,114 @@
+"""
+Concurrent execution helpers for the action phase of the Instance Expiration lambda.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+import time
+import threading
+import concurrent.futures
+
+
+
+########################################################################################################################
+# Classes
+########################################################################################################################
+
+class TokenBucket:
+  """
+  Thread-safe token bucket rate limiter, mirroring how the EC2 API throttles requests: a bucket of 'capacity' tokens
+  (the allowed burst) refilled at 'rate' tokens per second. Taking more tokens than the capacity waits for a full
+  bucket and leaves it in debt, so the rate still holds.
+  """
+
+  def __init__(self, rate, capacity):
+    """
+    :param rate:        Refill rate, in tokens per second.
+    :param capacity:    Maximum tokens held (burst size).
+    """
+
+    self._rate = float(rate)
+    self._capacity = float(capacity)
+    self._tokens = float(capacity)
+    self._updated = time.monotonic()
+    self._lock = threading.Lock()
+
+
+
+  def Acquire(self, tokens = 1):
+    """
+    Take tokens from the bucket, blocking until enough are available.
+
+    :param tokens:      Number of tokens to take.
+    """
+
+    while True:
+
+      with self._lock:
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+        needed = min(tokens, self._capacity)
+
+        if self._tokens >= needed:
+          self._tokens -= tokens
+          return
+
+        wait = (needed - self._tokens) / self._rate
+
+      time.sleep(wait)
+
+
+
+class ActionExecutor:
+  """
+  Bounded thread pool for running independent API calls (which share the module's thread-safe boto3 clients)
+  concurrently. With a maximum of one call in flight, calls run sequentially on the calling thread.
+  """
+
+  @property
+  def MaxInFlight(self):
+    return self._max_in_flight
+
+
+
+  def __init__(self, max_in_flight):
+    """
+    :param max_in_flight:   Maximum number of calls running at once.
+    """
+
+    self._max_in_flight = max(1, int(max_in_flight))
+
+    if self._max_in_flight > 1:
+      self._pool = concurrent.futures.ThreadPoolExecutor(
+        max_workers = self._max_in_flight,
+        thread_name_prefix = 'ix-action',
+      )
+    else:
+      self._pool = None
+
+
+
+  def Map(self, fn, items):
+    """
+    Call a function for each item, concurrently up to the maximum in flight.
+
+    :param fn:          Function of one argument. Should handle its own exceptions; any it raises are re-raised here.
+    :param items:       Iterable of arguments.
+    :return:            List of results, in the same order as the items.
+    """
+
+    items = list(items)
+
+    if self._pool is None or len(items) <= 1:
+      return [fn(i) for i in items]
+    else:
+      return list(self._pool.map(fn, items))
@@ -0,0 +1,203 @@
+"""
+Per-operation accounting of the AWS API calls made by the Instance Expiration lambdas, via botocore event hooks.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+import time
+import threading
+import botocore.retries.standard
+
+
+
+########################################################################################################################
+# Globals
+########################################################################################################################
+
+# Keys of the botocore request context under which a call's operation model, start time, attempts so far and throttled
+# attempts are kept, from its before-call event to its after-call (or after-call-error) event.
+CONTEXT_MODEL = 'ix_call_model'
+CONTEXT_START = 'ix_call_start'
+CONTEXT_ATTEMPTS = 'ix_call_attempts'
+CONTEXT_THROTTLES = 'ix_call_throttles'
+
+# Same throttling error detection as botocore's standard and adaptive retry modes.
+THROTTLING = botocore.retries.standard.ThrottlingErrorDetector(botocore.retries.standard.RetryEventAdapter())
+
+
+
+########################################################################################################################
+# Classes
+########################################################################################################################
+
+class ApiCallStats:
+  """
+  Totals for one operation (ex: 'ec2:DescribeInstances').
+  """
+
+  def __init__(self):
+
+    self.Calls = 0
+    self.Errors = 0
+    self.Seconds = 0.0
+    self.Retries = 0
+    self.Throttles = 0
+
+
+
+  def __str__(self):
+
+    s = f'{self.Calls} in {self.Seconds:.2f}s'
+
+    if self.Retries:
+      s += f', {self.Retries} retries'
+    if self.Throttles:
+      s += f', {self.Throttles} throttled'
+    if self.Errors:
+      s += f', {self.Errors} failed'
+
+    return s
+
+
+
+########################################################################################################################
+# Main Class
+########################################################################################################################
+
+class ApiCallAccounting:
+  """
+  Records the count, latency (including retries), retries and throttled responses of each API operation called by
+  registered clients. Thread-safe, as calls are made from ActionExecutor threads.
+  """
+
+  @property
+  def Calls(self):
+    """
+    :return:    Number of calls recorded, all operations.
+    """
+
+    with self._lock:
+      return sum(s.Calls for s in self._stats.values())
+
+
+
+  @property
+  def Stats(self):
+    """
+    :return:    Dict of ApiCallStats by 'service:Operation'.
+    """
+
+    with self._lock:
+      return dict(self._stats)
+
+
+
+  def __init__(self):
+
+    self._stats = {}
+    self._lock = threading.Lock()
+
+
+
+  def Register(self, client):
+    """
+    Hook this accounting into a boto3 client's events.
+
+    :param client:      boto3 client.
+    """
+
+    events = client.meta.events
+
+    events.register('before-call', self._BeforeCall)
+    events.register('needs-retry', self._NeedsRetry)
+    events.register('after-call', self._AfterCall)
+    events.register('after-call-error', self._AfterCallError)
+
+
+
+  def Reset(self):
+    """
+    Drop all totals (ex: at the start of an invocation).
+    """
+
+    with self._lock:
+      self._stats = {}
+
+
+
+  def Summary(self):
+    """
+    :return:    One line summary of all operations, most time consuming first.
+    """
+
+    stats = self.Stats
+
+    if not stats:
+      return 'none'
+
+    calls = sum(s.Calls for s in stats.values())
+    seconds = sum(s.Seconds for s in stats.values())
+
+    ops = sorted(stats.items(), key = lambda kv: kv[1].Seconds, reverse = True)
+
+    return f'{calls} in {seconds:.2f}s; ' + '; '.join(f'{op} {s}' for op, s in ops)
+
+
+
+  def _BeforeCall(self, model, context, **kwargs):
+
+    context[CONTEXT_MODEL] = model
+    context[CONTEXT_START] = time.monotonic()
+    context[CONTEXT_ATTEMPTS] = 0
+    context[CONTEXT_THROTTLES] = 0
+
+
+
+  def _NeedsRetry(self, attempts, request_dict, **kwargs):
+
+    # Emitted after every attempt, whether or not it will be retried.
+    context = request_dict.get('context', {})
+    context[CONTEXT_ATTEMPTS] = attempts
+
+    if THROTTLING.is_throttling_error(attempts = attempts, request_dict = request_dict, **kwargs):
+      context[CONTEXT_THROTTLES] = context.get(CONTEXT_THROTTLES, 0) + 1
+
+
+
+  def _AfterCall(self, context, http_response, **kwargs):
+
+    self._Record(context, http_response.status_code >= 300)
+
+
+
+  def _AfterCallError(self, context, **kwargs):
+
+    self._Record(context, True)
+
+
+
+  def _Record(self, context, failed):
+
+    model = context.pop(CONTEXT_MODEL, None)
+
+    if model is None:
+      return
+
+    op = model.service_model.endpoint_prefix + ':' + model.name
+
+    with self._lock:
+
+      stats = self._stats.setdefault(op, ApiCallStats())
+
+      stats.Calls += 1
+      stats.Errors += int(failed)
+      stats.Seconds += time.monotonic() - context[CONTEXT_START]
+      stats.Retries += max(0, context.get(CONTEXT_ATTEMPTS, 0) - 1)
+      stats.Throttles += context.get(CONTEXT_THROTTLES, 0)
@@ -0,0 +1,24 @@
+"""
+Batching helpers for use by the Instance Expiration lambdas.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Functions
+########################################################################################################################
+
+def Chunks(some_list, size):
+  """
+  Split a list into consecutive chunks (ex: to fit the maximum number of items of an API call).
+
+  :param some_list:   Any list.
+  :param size:        Maximum number of elements per chunk.
+  :return:            Generator of lists, each with at most 'size' elements.
+  """
+
+  for i in range(0, len(some_list), size):
+    yield some_list[i:i + size]
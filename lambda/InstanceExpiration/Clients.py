@@ -0,0 +1,135 @@
+"""
+Lazily created, shared boto3 clients for use by the Instance Expiration lambdas.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+import threading
+import boto3
+import botocore.config
+import botocore.loaders
+import botocore.session
+
+from ApiCalls import ApiCallAccounting
+
+
+
+########################################################################################################################
+# Globals
+########################################################################################################################
+
+# Shared by all clients: enough pooled connections for the maximum ActionConcurrency (16) plus headroom, connections
+# kept alive between the calls of an invocation, and adaptive retries (client side rate limiting on throttles).
+CONFIG = botocore.config.Config(
+  max_pool_connections = 32,
+  tcp_keepalive = True,
+  retries = {
+    'mode': 'adaptive',
+    'max_attempts': 5,
+  },
+)
+
+# Loader of the service models, shared by every session (see NewSession), so models already loaded (ex: before a
+# SnapStart snapshot) are reused by the clients of a new session.
+LOADER = botocore.loaders.create_loader()
+
+CLIENTS = []
+LOCK = threading.Lock()
+
+# Per-operation count, latency and retries of the calls made by all clients (see ApiCallAccounting).
+ACCOUNTING = ApiCallAccounting()
+
+
+
+########################################################################################################################
+# Functions
+########################################################################################################################
+
+def NewSession():
+  """
+  :return:    A new boto3 session, with its own credentials, using the shared loader (see LOADER).
+  """
+
+  session = botocore.session.get_session()
+  session.register_component('data_loader', LOADER)
+
+  return boto3.session.Session(botocore_session = session)
+
+
+
+def Reset():
+  """
+  Drop every client, along with the session's credentials, so the next use of each client creates it anew from a new
+  session.
+  """
+
+  global SESSION
+
+  with LOCK:
+
+    SESSION = NewSession()
+
+    for client in CLIENTS:
+      client._client = None
+
+
+
+# Session all clients are created from (replaced by Reset), with a lock around it and CLIENTS, as a boto3 session is not
+# thread-safe.
+SESSION = NewSession()
+
+
+
+########################################################################################################################
+# Main Class
+########################################################################################################################
+
+class LazyClient:
+  """
+  Stands in for a boto3 client, which is created on first use and then shared. Creating a client loads its service
+  model, so an invocation only pays for the services it calls. Thread-safe, as the first use may be from an
+  ActionExecutor thread.
+  """
+
+  @property
+  def Client(self):
+    """
+    :return:    The boto3 client, created if need be.
+    """
+
+    if self._client is None:
+      with LOCK:
+        if self._client is None:
+          client = SESSION.client(self._service_name, config = CONFIG)
+          ACCOUNTING.Register(client)
+          self._client = client
+
+    return self._client
+
+
+
+  def __init__(self, service_name):
+    """
+    :param service_name:    Boto3 service name (ex: 'ec2').
+    """
+
+    self._service_name = service_name
+    self._client = None
+
+    CLIENTS.append(self)
+
+
+
+  def __getattr__(self, name):
+    """
+    :return:    The attribute (API method, 'exceptions', ...) of the boto3 client.
+    """
+
+    return getattr(self.Client, name)
@@ -0,0 +1,118 @@
+"""
+AWS Lambda to coalesce bursts of Instance Expiration lambda triggers (EC2 instance tag changes and starts) into a few
+messages, each naming many EC2 instances.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+import os
+import logging
+
+from Trigger import Trigger
+from TriggerKind import TriggerKind
+from Clients import LazyClient
+from Sharding import ShardOf, Shards, ShardMessageGroupId
+from Batching import Chunks
+
+
+
+########################################################################################################################
+# Globals
+########################################################################################################################
+
+# Logging
+LOG = logging.getLogger()
+LOG.setLevel(logging.INFO)
+#LOG.setLevel(logging.DEBUG)
+
+# Boto clients (created on first use; see LazyClient)
+aws_sqs = LazyClient('sqs')
+
+# Environment
+IX_QUEUE_URL = os.environ['IX_QUEUE_URL']
+IX_SQS_MESSAGE_ID = os.environ['IX_SQS_MESSAGE_ID']
+IX_SHARD_COUNT = int(os.environ['IX_SHARD_COUNT'])
+
+# Other globals
+MAX_COALESCED_IDS = 4000                # About 100 KB of EC2 instance ids, well within the 256 KB SQS message limit
+
+
+
+########################################################################################################################
+# Functions
+########################################################################################################################
+
+def SendMessage(body, deduplication_id, message_group_id = IX_SQS_MESSAGE_ID):
+  """
+  Send a message to the (FIFO) queue of the Instance Expiration lambda.
+
+  :param body:                Message body (string).
+  :param deduplication_id:    Unique per message. Content based deduplication would drop a repeat of the same EC2
+                              instance ids within the deduplication interval, and with it the latest change.
+  :param message_group_id:    SQS message group id (the ingest message group, or that of a shard).
+  """
+
+  aws_sqs.send_message(
+    QueueUrl = IX_QUEUE_URL,
+    MessageBody = body,
+    MessageGroupId = message_group_id,
+    MessageDeduplicationId = deduplication_id,
+  )
+
+
+
+########################################################################################################################
+# Handler
+########################################################################################################################
+
+def handler(event, context):
+  """
+  Forward a batch of triggers, as collected by the SQS event source over its batching window, as one coalesced message
+  per MAX_COALESCED_IDS EC2 instances. The coalesced messages name only the EC2 instances, not their tags, so the
+  Instance Expiration lambda describes them and evaluates the latest change whatever order the triggers arrived in.
+  When sharded, each shard's EC2 instances are sent straight to the shard's message group.
+
+  Exceptions are raised so the whole batch is redelivered; repeated checks of the same EC2 instances are harmless.
+  """
+
+  records = event.get('Records') or []
+  triggers = Trigger.FromEvent(event)
+
+  instance_ids = sorted({i for t in triggers if t.IsInstanceScoped for i in t.InstanceIds})
+
+  # EC2 instances named only by start events are listed apart, so actions on them are attributed to the starts.
+  tagged = {i for t in triggers if t.IsInstanceScoped and t.Kind == TriggerKind.TAG for i in t.InstanceIds}
+  started = set(instance_ids) - tagged
+
+  LOG.info('Coalescing %d trigger(s) naming %d EC2 instance(s).', len(triggers), len(instance_ids))
+
+  if IX_SHARD_COUNT > 1:
+    groups = {s: [i for i in instance_ids if ShardOf(i, IX_SHARD_COUNT) == s] for s in Shards(IX_SHARD_COUNT)}
+  else:
+    groups = {None: instance_ids}
+
+  for shard, ids in groups.items():
+    for n, chunk in enumerate(Chunks(ids, MAX_COALESCED_IDS)):
+      SendMessage(
+        Trigger.CoalescedBody(
+          context.invoked_function_arn,
+          [i for i in chunk if i not in started],
+          shard = shard,
+          started_ids = [i for i in chunk if i in started],
+        ),
+        context.aws_request_id + '-' + str(shard) + '-' + str(n),
+        IX_SQS_MESSAGE_ID if shard is None else ShardMessageGroupId(IX_SQS_MESSAGE_ID, shard),
+      )
+
+  # Anything else is passed through as is (the Instance Expiration lambda checks all EC2 instances for it).
+  for rec, t in zip(records, triggers):
+    if not t.IsInstanceScoped:
+      LOG.warning('Passing through unrecognized trigger: %s', rec.get('body'))
+      SendMessage(rec['body'], context.aws_request_id + '-' + rec['messageId'])
@@ -0,0 +1,276 @@
+"""
+Direct actions for use by the Instance Expiration lambda: one-time Amazon EventBridge Scheduler schedules that call the
+EC2 StopInstances/TerminateInstances API directly (universal target) at the exact expiration date/time of an EC2
+instance, with no Lambda on the path.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+import json
+import datetime
+import logging
+
+from ExpireAction import ExpireAction
+from ExpirationIndex import ExpirationIndex
+
+
+
+########################################################################################################################
+# Globals
+########################################################################################################################
+
+# Logging
+LOG = logging.getLogger()
+
+# Other globals
+SCHEDULE_PREFIX = 'Expire-'             # Followed by the EC2 instance id
+SCHEDULE_AT_FMT = '%Y-%m-%dT%H:%M:%S'   # Format of the date/time in an EventBridge Scheduler 'at()' expression
+MIN_LEAD = datetime.timedelta(seconds = 30)   # Expirations any sooner are left to the Lambda
+
+# Universal target of each action
+TARGET_ARNS = {
+  ExpireAction.STOP: 'arn:aws:scheduler:::aws-sdk:ec2:stopInstances',
+  ExpireAction.TERM: 'arn:aws:scheduler:::aws-sdk:ec2:terminateInstances',
+}
+
+
+
+########################################################################################################################
+# Functions
+########################################################################################################################
+
+def Covers(entry, actions):
+  """
+  :param entry:         ExpirationIndexEntry (or Ec2Instance).
+  :param actions:       ExpireAction values enabled for direct actions (or a dict keyed by them).
+  :return:              True if the entry is acted on by a schedule; False if left to the Lambda (action not enabled,
+                        or expiring sooner than MIN_LEAD).
+  """
+
+  return entry.ExpireAction in actions and entry.ExpireDateTime >= datetime.datetime.now(datetime.UTC) + MIN_LEAD
+
+
+
+########################################################################################################################
+# Main Class
+########################################################################################################################
+
+class DirectActionIndex(ExpirationIndex):
+  """
+  Expiration index decorator that also keeps, for each entry, a one-time schedule that acts on the EC2 instance at its
+  expiration date/time. Every write to the index writes the schedule first: an upsert creates or updates it; a delete
+  (or an entry the schedules do not cover) deletes it. Schedules delete themselves after completion.
+
+  An entry whose schedule fails to write is left out of the index write, so the difference remains for the next write
+  or reconciliation, and its EC2 instance id is recorded (see FailedInstanceIds) for the caller to fail the check. The
+  Lambda's own follow-up check still acts on the EC2 instance (see CalculateNextCheck), only later.
+  """
+
+  @property
+  def FailedInstanceIds(self):
+    return self._failed
+
+
+
+  def __init__(self, index, aws_scheduler, group_name, role_arns, executor, rate_limit, reconcile_limit):
+    """
+    :param index:           Expiration index to decorate.
+    :param aws_scheduler:   Boto3 EventBridge Scheduler client.
+    :param group_name:      Schedule group of the schedules.
+    :param role_arns:       Dict of each ExpireAction enabled for direct actions to the IAM role its schedules assume,
+                            which can only take that action, on EC2 instances with its expiration tags.
+    :param executor:        ActionExecutor to write schedules concurrently.
+    :param rate_limit:      TokenBucket limiting schedule writes.
+    :param reconcile_limit: Maximum schedule writes per reconciliation (see Reconcile).
+    """
+
+    self._index = index
+    self._scheduler = aws_scheduler
+    self._group_name = group_name
+    self._role_arns = dict(role_arns)
+    self._executor = executor
+    self._rate_limit = rate_limit
+    self._reconcile_limit = reconcile_limit
+    self._failed = set()
+
+
+
+  #
+  # Index interface, delegated.
+  #
+
+  def IsPopulated(self):
+    return self._index.IsPopulated()
+
+  def Get(self, instance_id):
+    return self._index.Get(instance_id)
+
+  def GetMany(self, instance_ids):
+    return self._index.GetMany(instance_ids)
+
+  def Next(self, after):
+    return self._index.Next(after)
+
+  def Due(self, at):
+    return self._index.Due(at)
+
+  def Entries(self):
+    return self._index.Entries()
+
+  def MarkPopulated(self):
+    self._index.MarkPopulated()
+
+  def MarkUnpopulated(self):
+    self._index.MarkUnpopulated()
+
+  def Upsert(self, entry):
+    self.WriteMany([entry], [])
+
+  def Delete(self, instance_id):
+    self.WriteMany([], [instance_id])
+
+
+
+  def WriteMany(self, upserts, deletes):
+
+    puts = [e for e in upserts if Covers(e, self._role_arns)]
+    removes = [e.InstanceId for e in upserts if not Covers(e, self._role_arns)] + list(deletes)
+
+    failed = {
+      i for i in self._executor.Map(self._TryPutSchedule, puts) + self._executor.Map(self._TryDeleteSchedule, removes)
+      if i is not None
+    }
+
+    self._index.WriteMany([e for e in upserts if e.InstanceId not in failed], [i for i in deletes if i not in failed])
+    self._failed |= failed
+
+    LOG.info('Direct action schedules: %d put, %d deleted, %d failed', len(puts), len(removes), len(failed))
+
+
+
+  def Reconcile(self, instances, rewrite = False, scanned_at = None):
+    """
+    As ExpirationIndex.Reconcile(), but writing every entry (and so its schedule) if the index is not yet populated
+    for direct actions, as schedules may be missing for entries that are already in the index.
+
+    At most the reconcile limit of schedules are written, deletes first, then the soonest expirations, so enabling
+    direct actions on a large fleet fits within the invocation. The other entries are written to the index only, and
+    the index is marked populated regardless. Their EC2 instance ids are returned, for the caller to hand off to
+    incremental checks (see HandOff), whose writes of the entries write the schedules. Until then (or if the hand-off
+    is lost), the Lambda acts on those EC2 instances itself.
+    """
+
+    upserts, deletes = self.Differences(instances, rewrite or not self.IsPopulated(), scanned_at)
+
+    upserts.sort(key = lambda e: e.ExpireDateTime)
+    count = max(0, self._reconcile_limit - len(deletes))
+    upserts, remaining = upserts[:count], upserts[count:]
+
+    LOG.info('Reconciling expiration index: %d upserts, %d deletes, %d left to hand off',
+             len(upserts), len(deletes), len(remaining))
+
+    self.WriteMany(upserts, deletes)
+    self._index.WriteMany(remaining, [])
+    self.MarkPopulated()
+
+    return [e.InstanceId for e in remaining]
+
+
+
+  #
+  # Schedules
+  #
+
+  @staticmethod
+  def ScheduleName(instance_id):
+    """
+    :param instance_id:   EC2 instance id.
+    :return:              Name of the EC2 instance's schedule.
+    """
+
+    return SCHEDULE_PREFIX + instance_id
+
+
+
+  def PutSchedule(self, entry):
+    """
+    Create or update the schedule of an entry.
+
+    :param entry:         ExpirationIndexEntry (see Covers).
+    """
+
+    request = {
+      'Name': self.ScheduleName(entry.InstanceId),
+      'GroupName': self._group_name,
+      'ScheduleExpression': 'at(' + entry.ExpireDateTime.strftime(SCHEDULE_AT_FMT) + ')',
+      'ScheduleExpressionTimezone': 'UTC',
+      'FlexibleTimeWindow': {'Mode': 'OFF'},
+      'ActionAfterCompletion': 'DELETE',
+      'Target': {
+        'Arn': TARGET_ARNS[entry.ExpireAction],
+        'RoleArn': self._role_arns[entry.ExpireAction],
+        'Input': json.dumps({'InstanceIds': [entry.InstanceId]}),
+        'RetryPolicy': {'MaximumEventAgeInSeconds': 3600, 'MaximumRetryAttempts': 10},
+      },
+    }
+
+    self._rate_limit.Acquire()
+
+    try:
+      self._scheduler.create_schedule(**request)
+    except self._scheduler.exceptions.ConflictException as ex:
+      self._rate_limit.Acquire()
+      self._scheduler.update_schedule(**request)
+
+
+
+  def DeleteSchedule(self, instance_id):
+    """
+    Delete the schedule of an EC2 instance, if any.
+
+    :param instance_id:   EC2 instance id.
+    """
+
+    self._rate_limit.Acquire()
+
+    try:
+      self._scheduler.delete_schedule(Name = self.ScheduleName(instance_id), GroupName = self._group_name)
+    except self._scheduler.exceptions.ResourceNotFoundException as ex:
+      pass
+
+
+
+  def _TryPutSchedule(self, entry):
+    """
+    :return:              'None', or the EC2 instance id if its schedule failed to put.
+    """
+
+    try:
+      self.PutSchedule(entry)
+    except Exception as ex:
+      LOG.exception('Failed to put direct action schedule: %s', self.ScheduleName(entry.InstanceId))
+      return entry.InstanceId
+
+    return None
+
+
+
+  def _TryDeleteSchedule(self, instance_id):
+    """
+    :return:              'None', or the EC2 instance id if its schedule failed to delete.
+    """
+
+    try:
+      self.DeleteSchedule(instance_id)
+    except Exception as ex:
+      LOG.exception('Failed to delete direct action schedule: %s', self.ScheduleName(instance_id))
+      return instance_id
+
+    return None
@@ -31,11 +31,20 @@ LOG = logging.getLogger()
 IX_TAG_PREFIX = os.environ['IX_TAG_PREFIX']
 
 # Other globals
+TAG_PREFIX = IX_TAG_PREFIX + ':'
 STOP_AFTER_DURATION_TAG = IX_TAG_PREFIX + ':stop-after-duration'
 STOP_AFTER_DATETIME_TAG = IX_TAG_PREFIX + ':stop-after-datetime'
 TERM_AFTER_DURATION_TAG = IX_TAG_PREFIX + ':terminate-after-duration'
 TERM_AFTER_DATETIME_TAG = IX_TAG_PREFIX + ':terminate-after-datetime'
 
+# Compiled once, at import (see TimeDeltaFromStr)
+DURATION_REGEX = re.compile(
+  r'^((?P<days>[\.\d]+?)d)? *((?P<hours>[\.\d]+?)h)? *((?P<minutes>[\.\d]+?)m)? *((?P<seconds>[\.\d]+?)s)?$'
+)
+
+# Fast path for the only supported date/time tag format, Ec2Instance.ADT_FMT (see DateTimeFromStr)
+DATETIME_REGEX = re.compile(r'^(\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2}) UTC$')
+
 
 
 ########################################################################################################################
@@ -50,11 +59,7 @@ def TimeDeltaFromStr(duration):
   :return datetime.timedelta:   datetime.timedelta object, or 'None' if malformed duration string.
   """
 
-  REGEX = re.compile(
-    r'^((?P<days>[\.\d]+?)d)? *((?P<hours>[\.\d]+?)h)? *((?P<minutes>[\.\d]+?)m)? *((?P<seconds>[\.\d]+?)s)?$'
-  )
-
-  parts = REGEX.match(duration)
+  parts = DURATION_REGEX.match(duration)
 
   td = None
 
@@ -68,6 +73,22 @@ def TimeDeltaFromStr(duration):
 
 
 
+def DateTimeFromStr(dt):
+  """
+  Parse a date/time string matching the Ec2Instance.ADT_FMT format (ex: 2024-02-03 18:43:48 UTC) into a datetime
+  object. The fixed format is parsed directly; anything else falls back to the (much slower) strptime().
+
+  :param dt:                    Date/time string.
+  :return datetime.datetime:    datetime.datetime object (UTC). Raises ValueError if malformed.
+  """
+
+  if parts := DATETIME_REGEX.match(dt):
+    return datetime.datetime(*map(int, parts.groups()), tzinfo = datetime.UTC)
+  else:
+    return datetime.datetime.strptime(dt, Ec2Instance.ADT_FMT).replace(tzinfo = datetime.UTC)
+
+
+
 def LesserOf(one, two):
   """
   Return the lesser of two values, with 'None' being the highest possible value.
@@ -95,6 +116,8 @@ class Ec2Instance:
   Concise representation of an EC2 instance relevant to the Instance Expiration Lambda.
   """
 
+  __slots__ = ('_instance_id', '_state', '_expire_action', '_expire_date_time')
+
   @property
   def InstanceId(self):
     return self._instance_id
@@ -125,77 +148,115 @@ class Ec2Instance:
     self._instance_id = instance['InstanceId']
     self._state = instance['State']['Name']
 
-    sad  = self.GetDurationTagValue(instance, STOP_AFTER_DURATION_TAG)
-    sadt = self.GetDateTimeTagValue(instance, STOP_AFTER_DATETIME_TAG)
-    tad  = self.GetDurationTagValue(instance, TERM_AFTER_DURATION_TAG)
-    tadt = self.GetDateTimeTagValue(instance, TERM_AFTER_DATETIME_TAG)
+    tags = self.GetTags(instance)
+
+    self._expire_action, self._expire_date_time = self.CalculateExpiration(tags, instance['LaunchTime'])
+
+    if self._expire_date_time is None:
+      LOG.warning("Ignoring EC2 instance with no properly formed expiration tags: %s", self._instance_id)
+
+
+
+  @staticmethod
+  def CalculateExpiration(tags, launch_time):
+    """
+    Calculate the expiration of an EC2 instance from its expiration tags: the soonest of the tag values, with terminate
+    winning a tie.
+
+    :param tags:        Expiration tags (see GetTags).
+    :param launch_time: Instance launch time. Only used by duration tags (see NeedsLaunchTime).
+    :return:            Tuple of (ExpireAction, expiration datetime), or (None, None) if no properly formed tags.
+    """
+
+    sad  = Ec2Instance.GetDurationTagValue(tags, STOP_AFTER_DURATION_TAG, launch_time)
+    sadt = Ec2Instance.GetDateTimeTagValue(tags, STOP_AFTER_DATETIME_TAG)
+    tad  = Ec2Instance.GetDurationTagValue(tags, TERM_AFTER_DURATION_TAG, launch_time)
+    tadt = Ec2Instance.GetDateTimeTagValue(tags, TERM_AFTER_DATETIME_TAG)
 
     sa = LesserOf(sad, sadt)
     ta = LesserOf(tad, tadt)
 
-    self._expire_date_time = LesserOf(sa, ta)
+    expire_date_time = LesserOf(sa, ta)
 
-    if not self._expire_date_time:
-      LOG.warning("Ignoring EC2 instance with no properly formed expiration tags: %s", self._instance_id)
-      self._expire_action = None
-    elif self._expire_date_time == ta:
-      self._expire_action = ExpireAction.TERM       # Term wins in a tie
-    elif self._expire_date_time == sa:
-      self._expire_action = ExpireAction.STOP
+    if not expire_date_time:
+      return None, None
+    elif expire_date_time == ta:
+      return ExpireAction.TERM, expire_date_time      # Term wins in a tie
     else:
-      assert False, "Logic error while processing EC2 instance '{}'.".format(self._instance_id)
+      return ExpireAction.STOP, expire_date_time
 
 
 
   @staticmethod
-  def GetTagValue(instance, tag_name):
+  def NeedsLaunchTime(tags):
+    """
+    :param tags:        Expiration tags (see GetTags).
+    :return:            True if the expiration depends on the instance launch time (a duration tag is present).
     """
-    Get the specified tag's value from a boto3 EC2.Instance object.
+
+    return STOP_AFTER_DURATION_TAG in tags or TERM_AFTER_DURATION_TAG in tags
+
+
+
+  @staticmethod
+  def GetTags(instance):
+    """
+    Get the expiration tags of a boto3 EC2.Instance object, in a single pass over its tags.
 
     :param instance:    Boto3 EC2.Instance object.
-    :param tag_name:    Name of tag to retrieve.
-    :return:            Tag value, or 'None' if not found.
+    :return:            Dict of tag name to tag value, for only the tags with the expiration tag prefix.
     """
 
-    if tag := list(filter(lambda x: x['Key'] == tag_name, instance['Tags'])):
-      return tag[0]['Value']
-    else:
-      return None
+    return {t['Key']: t['Value'] for t in instance.get('Tags') or () if t['Key'].startswith(TAG_PREFIX)}
 
 
 
   @staticmethod
-  def GetDurationTagValue(instance, tag_name):
+  def GetTagsFromDict(tags):
     """
-    Get the specified tag's value from a boto3 EC2.Instance object, assuming it is a duration value and adding it to
-    the instance's launch time to create an absolute datetime.
+    Get the expiration tags from a dict of tag name to tag value, as found in the 'detail' of an Amazon EventBridge
+    'Tag Change on Resource' event.
 
-    :param instance:    Boto3 EC2.Instance object.
+    :param tags:        Dict of tag name to tag value.
+    :return:            Dict of tag name to tag value, for only the tags with the expiration tag prefix.
+    """
+
+    return {k: v for k, v in tags.items() if k.startswith(TAG_PREFIX)}
+
+
+
+  @staticmethod
+  def GetDurationTagValue(tags, tag_name, launch_time):
+    """
+    Get the specified tag's value, assuming it is a duration value and adding it to the instance's launch time to
+    create an absolute datetime.
+
+    :param tags:        Expiration tags (see GetTags).
     :param tag_name:    Name of tag to retrieve.
+    :param launch_time: Instance launch time.
     :return:            Datetime of tag value added to instance launch time, or 'None' if not found or invalid.
     """
 
-    if d := Ec2Instance.GetTagValue(instance, tag_name):
+    if d := tags.get(tag_name):
       if o := TimeDeltaFromStr(d):
-        return instance['LaunchTime'] + o
+        return launch_time + o
     return None
 
 
 
   @staticmethod
-  def GetDateTimeTagValue(instance, tag_name):
+  def GetDateTimeTagValue(tags, tag_name):
     """
-    Get the specified tag's value from a boto3 EC2.Instance object, assuming it is a datetime string matching the
-    Ec2Instance.ADT_FMT format.
+    Get the specified tag's value, assuming it is a datetime string matching the Ec2Instance.ADT_FMT format.
 
-    :param instance:    Boto3 EC2.Instance object.
+    :param tags:        Expiration tags (see GetTags).
     :param tag_name:    Name of tag to retrieve.
     :return:            Datetime object, or 'None' if not found or invalid.
     """
 
-    if dt := Ec2Instance.GetTagValue(instance, tag_name):
+    if dt := tags.get(tag_name):
       try:
-        return datetime.datetime.strptime(dt, Ec2Instance.ADT_FMT).replace(tzinfo = datetime.UTC)
+        return DateTimeFromStr(dt)
       except Exception as ex:
         LOG.exception('Ignoring malformed datetime string: %s', dt)
     return None
@@ -0,0 +1,513 @@
+"""
+Persistent expiration index for use by the Instance Expiration lambda.
+
+The index holds, per EC2 instance id, the computed expiration date/time and action of each in-scope EC2 instance,
+ordered by expiration date/time. It lets the Lambda find the next expiration and the currently expired EC2 instances
+with range queries instead of scanning all EC2 instances.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+import abc
+import time
+import datetime
+import operator
+import logging
+
+from ExpireAction import ExpireAction
+from Batching import Chunks
+from Sharding import Shards, MAX_SHARD_COUNT
+
+
+
+########################################################################################################################
+# Globals
+########################################################################################################################
+
+# Logging
+LOG = logging.getLogger()
+
+# Other globals
+EXPIRE_AT_FMT = '%Y-%m-%dT%H:%M:%S.%fZ'     # Fixed width, so lexical order is chronological order
+DEFAULT_SHARD = '0'
+FULL_SCAN_MARKER_ID = '@FullScan'           # Not an EC2 instance id, and absent from the expiration GSI
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_WRITE_MAX_ATTEMPTS = 5
+BATCH_GET_MAX_KEYS = 100
+
+# Expression attribute names of the GSI key attributes ('Shard' is a DynamoDB reserved word)
+GSI_KEY_NAMES = {'#shard': 'Shard', '#expire_at': 'ExpireAt'}
+
+
+
+########################################################################################################################
+# Classes
+########################################################################################################################
+
+class ExpirationIndexEntry:
+  """
+  Entry of the expiration index for a single EC2 instance.
+  """
+
+  @property
+  def InstanceId(self):
+    return self._instance_id
+
+  @property
+  def ExpireAction(self):
+    return self._expire_action
+
+  @property
+  def ExpireDateTime(self):
+    return self._expire_date_time
+
+  @property
+  def TaggedAt(self):
+    return self._tagged_at
+
+
+
+  def __init__(self, instance_id, expire_action, expire_date_time, tagged_at = None):
+    """
+    :param instance_id:         EC2 instance id.
+    :param expire_action:       ExpireAction.
+    :param expire_date_time:    Expiration datetime (UTC).
+    :param tagged_at:           Datetime (UTC) the EC2 instance's tags were known to be as of (the time of a tag
+                                change event, or of the start of a describe), or 'None' if unknown. Tag change events
+                                newer than this can be applied to the entry without describing the EC2 instance. Not
+                                compared by equality.
+    """
+
+    self._instance_id = instance_id
+    self._expire_action = expire_action
+    self._expire_date_time = expire_date_time
+    self._tagged_at = tagged_at
+
+
+
+  @staticmethod
+  def FromInstance(inst, tagged_at = None):
+    """
+    :param inst:        Ec2Instance.
+    :param tagged_at:   Datetime (UTC) the EC2 instance was described as of (see TaggedAt), or 'None' if unknown.
+    :return:            Entry for the EC2 instance, or 'None' if the EC2 instance has no expiration.
+    """
+
+    if inst.ExpireAction is None or inst.ExpireDateTime is None:
+      return None
+    else:
+      return ExpirationIndexEntry(inst.InstanceId, inst.ExpireAction, inst.ExpireDateTime, tagged_at)
+
+
+
+  def __eq__(self, other):
+    return isinstance(other, ExpirationIndexEntry) and \
+      (self._instance_id, self._expire_action, self._expire_date_time) == \
+      (other._instance_id, other._expire_action, other._expire_date_time)
+
+
+
+  def __repr__(self):
+    """
+    :return:            Developer friendly string representation of this object.
+    """
+
+    return repr((self._instance_id, self._expire_action, self._expire_date_time.strftime(EXPIRE_AT_FMT)))
+
+
+
+class ExpirationIndex(abc.ABC):
+  """
+  Base class (interface) for an expiration index backend.
+  """
+
+  @abc.abstractmethod
+  def IsPopulated(self):
+    """
+    :return:    True if a full scan has ever been recorded by Reconcile(), so the index is complete; else False.
+    """
+
+  @abc.abstractmethod
+  def Get(self, instance_id):
+    """
+    :param instance_id:   EC2 instance id.
+    :return:              ExpirationIndexEntry, or 'None' if not in the index.
+    """
+
+  def GetMany(self, instance_ids):
+    """
+    Get several entries. Backends should override when they can batch.
+
+    :param instance_ids:  EC2 instance ids.
+    :return:              Dict of EC2 instance id to ExpirationIndexEntry, for those in the index.
+    """
+
+    entries = {i: self.Get(i) for i in instance_ids}
+
+    return {i: e for i, e in entries.items() if e is not None}
+
+  @abc.abstractmethod
+  def Upsert(self, entry):
+    """
+    :param entry:         ExpirationIndexEntry to insert or replace.
+    """
+
+  @abc.abstractmethod
+  def Delete(self, instance_id):
+    """
+    :param instance_id:   EC2 instance id to remove (no error if not in the index).
+    """
+
+  @abc.abstractmethod
+  def Next(self, after):
+    """
+    :param after:         Datetime (UTC).
+    :return:              ExpirationIndexEntry with the soonest expiration later than 'after', or 'None'.
+    """
+
+  @abc.abstractmethod
+  def Due(self, at):
+    """
+    :param at:            Datetime (UTC).
+    :return:              Generator of ExpirationIndexEntry with expiration no later than 'at', soonest first.
+    """
+
+  @abc.abstractmethod
+  def Entries(self):
+    """
+    :return:              Generator of all ExpirationIndexEntry, in no particular order.
+    """
+
+  def WriteMany(self, upserts, deletes):
+    """
+    Write several changes. Backends should override when they can batch.
+
+    :param upserts:       ExpirationIndexEntry objects to insert or replace.
+    :param deletes:       EC2 instance ids to remove.
+    """
+
+    for e in upserts:
+      self.Upsert(e)
+
+    for i in deletes:
+      self.Delete(i)
+
+  @abc.abstractmethod
+  def MarkPopulated(self):
+    """
+    Record that a full scan has been reconciled into the index.
+    """
+
+  @abc.abstractmethod
+  def MarkUnpopulated(self):
+    """
+    Record that the index is no longer complete (ex: EC2 instances are being checked without it), so it needs another
+    full scan before it is trusted again.
+    """
+
+
+
+  def Reconcile(self, instances, rewrite = False, scanned_at = None):
+    """
+    Make the index match a full scan of all in-scope EC2 instances, writing only the differences.
+
+    :param instances:     All in-scope Ec2Instance objects.
+    :param rewrite:       True to write every entry found, not only the differences (ex: to rebuild state kept
+                          alongside the index).
+    :param scanned_at:    Datetime (UTC) the scan started, recorded as the TaggedAt of the entries written.
+    :return:              EC2 instance ids whose writes are left for the caller to hand off (see DirectActionIndex);
+                          none here.
+    """
+
+    upserts, deletes = self.Differences(instances, rewrite, scanned_at)
+
+    LOG.info('Reconciling expiration index: %d upserts, %d deletes', len(upserts), len(deletes))
+
+    self.WriteMany(upserts, deletes)
+    self.MarkPopulated()
+
+    return []
+
+
+
+  def Differences(self, instances, rewrite = False, scanned_at = None):
+    """
+    :param instances:     All in-scope Ec2Instance objects.
+    :param rewrite:       True to include every entry found, not only the differences.
+    :param scanned_at:    Datetime (UTC) the scan started (see Reconcile).
+    :return:              Tuple of (entries to upsert, EC2 instance ids to delete) to make the index match the scan.
+    """
+
+    current = {e.InstanceId: e for e in self.Entries()}
+
+    upserts = []
+
+    for inst in instances:
+      entry = ExpirationIndexEntry.FromInstance(inst, scanned_at)
+      if entry is not None and (current.pop(inst.InstanceId, None) != entry or rewrite):
+        upserts.append(entry)
+
+    # Whatever remains was not found by the scan, or was found without an expiration.
+    deletes = list(current)
+
+    return upserts, deletes
+
+
+
+class MemoryExpirationIndex(ExpirationIndex):
+  """
+  In-memory expiration index backend, for tests and local benchmarks.
+  """
+
+  def __init__(self):
+    self._entries = {}
+    self._populated = False
+
+  def IsPopulated(self):
+    return self._populated
+
+  def Get(self, instance_id):
+    return self._entries.get(instance_id)
+
+  def Upsert(self, entry):
+    self._entries[entry.InstanceId] = entry
+
+  def Delete(self, instance_id):
+    self._entries.pop(instance_id, None)
+
+  def Next(self, after):
+    future = [e for e in self._entries.values() if e.ExpireDateTime > after]
+    return min(future, key = operator.attrgetter('ExpireDateTime'), default = None)
+
+  def Due(self, at):
+    due = [e for e in self._entries.values() if e.ExpireDateTime <= at]
+    yield from sorted(due, key = operator.attrgetter('ExpireDateTime'))
+
+  def Entries(self):
+    yield from list(self._entries.values())
+
+  def MarkPopulated(self):
+    self._populated = True
+
+  def MarkUnpopulated(self):
+    self._populated = False
+
+
+
+class DynamoDbExpirationIndex(ExpirationIndex):
+  """
+  Amazon DynamoDB expiration index backend.
+
+  Table key is 'InstanceId'. The global secondary index (GSI) is keyed by 'Shard' and 'ExpireAt', so range queries on
+  the GSI return entries in expiration order. Each shard records its own full scan, along with the number of shards and
+  the mode at the time, so changing either makes every shard unpopulated until its next full scan. Recording a full
+  scan also removes the records of shards beyond the current number of shards, so changing the number back later does
+  not revive them.
+  """
+
+  GSI_NAME = 'ExpireAtIndex'
+
+
+
+  def __init__(self, aws_dynamodb, table_name, shard = DEFAULT_SHARD, shard_count = 1, mode = ''):
+    """
+    :param aws_dynamodb:    Boto3 DynamoDB client.
+    :param table_name:      DynamoDB table name.
+    :param shard:           GSI partition key value for entries written by this object.
+    :param shard_count:     Total number of shards.
+    :param mode:            Any string naming state kept alongside the index (ex: 'direct', see DirectActionIndex).
+    """
+
+    self._ddb = aws_dynamodb
+    self._table_name = table_name
+    self._shard = shard
+    self._shard_count = str(shard_count)
+    self._mode = mode
+
+    self._marker_id = self._MarkerId(shard)
+
+
+
+  def IsPopulated(self):
+    rsp = self._ddb.get_item(TableName = self._table_name, Key = {'InstanceId': {'S': self._marker_id}})
+    return 'Item' in rsp and \
+      rsp['Item'].get('ShardCount', {'N': '1'})['N'] == self._shard_count and \
+      rsp['Item'].get('Mode', {'S': ''})['S'] == self._mode
+
+  def Get(self, instance_id):
+    rsp = self._ddb.get_item(TableName = self._table_name, Key = {'InstanceId': {'S': instance_id}})
+    return self._FromItem(rsp['Item']) if 'Item' in rsp else None
+
+  def Upsert(self, entry):
+    self._ddb.put_item(TableName = self._table_name, Item = self._ToItem(entry))
+
+  def GetMany(self, instance_ids):
+
+    entries = {}
+
+    for chunk in Chunks(list(instance_ids), BATCH_GET_MAX_KEYS):
+
+      pending = {self._table_name: {'Keys': [{'InstanceId': {'S': i}} for i in chunk]}}
+
+      for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+        rsp = self._ddb.batch_get_item(RequestItems = pending)
+        entries.update((e.InstanceId, e) for e in map(self._FromItem, rsp['Responses'].get(self._table_name, [])))
+        if not (pending := rsp.get('UnprocessedKeys')):
+          break
+        time.sleep(0.05 * 2 ** attempt)
+      else:
+        raise RuntimeError('Expiration index batch get left unprocessed keys: ' + str(pending))
+
+    return entries
+
+  def Delete(self, instance_id):
+    self._ddb.delete_item(TableName = self._table_name, Key = {'InstanceId': {'S': instance_id}})
+
+
+
+  def Next(self, after):
+
+    rsp = self._ddb.query(
+      TableName = self._table_name,
+      IndexName = self.GSI_NAME,
+      KeyConditionExpression = '#shard = :shard AND #expire_at > :after',
+      ExpressionAttributeNames = GSI_KEY_NAMES,
+      ExpressionAttributeValues = {
+        ':shard': {'S': self._shard},
+        ':after': {'S': after.strftime(EXPIRE_AT_FMT)},
+      },
+      ScanIndexForward = True,
+      Limit = 1,
+    )
+
+    items = rsp.get('Items', [])
+
+    return self._FromItem(items[0]) if items else None
+
+
+
+  def Due(self, at):
+
+    pages = self._ddb.get_paginator('query').paginate(
+      TableName = self._table_name,
+      IndexName = self.GSI_NAME,
+      KeyConditionExpression = '#shard = :shard AND #expire_at <= :at',
+      ExpressionAttributeNames = GSI_KEY_NAMES,
+      ExpressionAttributeValues = {
+        ':shard': {'S': self._shard},
+        ':at': {'S': at.strftime(EXPIRE_AT_FMT)},
+      },
+      ScanIndexForward = True,
+    )
+
+    for page in pages:
+      for item in page.get('Items', []):
+        yield self._FromItem(item)
+
+
+
+  def Entries(self):
+
+    pages = self._ddb.get_paginator('query').paginate(
+      TableName = self._table_name,
+      IndexName = self.GSI_NAME,
+      KeyConditionExpression = '#shard = :shard',
+      ExpressionAttributeNames = {'#shard': 'Shard'},
+      ExpressionAttributeValues = {
+        ':shard': {'S': self._shard},
+      },
+    )
+
+    for page in pages:
+      for item in page.get('Items', []):
+        yield self._FromItem(item)
+
+
+
+  def WriteMany(self, upserts, deletes):
+
+    self._BatchWrite(
+      [{'PutRequest': {'Item': self._ToItem(e)}} for e in upserts] +
+      [{'DeleteRequest': {'Key': {'InstanceId': {'S': i}}}} for i in deletes]
+    )
+
+
+
+  def _BatchWrite(self, requests):
+    """
+    :param requests:      BatchWriteItem requests, retried while any are left unprocessed. Raises if any remain.
+    """
+
+    for chunk in Chunks(requests, BATCH_WRITE_MAX_ITEMS):
+
+      pending = {self._table_name: chunk}
+
+      for attempt in range(BATCH_WRITE_MAX_ATTEMPTS):
+        rsp = self._ddb.batch_write_item(RequestItems = pending)
+        if not (pending := rsp.get('UnprocessedItems')):
+          break
+        time.sleep(0.05 * 2 ** attempt)
+      else:
+        raise RuntimeError('Expiration index batch write left unprocessed items: ' + str(pending))
+
+
+
+  def MarkPopulated(self):
+
+    self._ddb.put_item(
+      TableName = self._table_name,
+      Item = {
+        'InstanceId': {'S': self._marker_id},
+        'ScannedAt': {'S': datetime.datetime.now(datetime.UTC).strftime(EXPIRE_AT_FMT)},
+        'ShardCount': {'N': self._shard_count},
+        'Mode': {'S': self._mode},
+      }
+    )
+
+    self._BatchWrite([
+      {'DeleteRequest': {'Key': {'InstanceId': {'S': self._MarkerId(s)}}}}
+      for s in Shards(MAX_SHARD_COUNT)[int(self._shard_count):]
+    ])
+
+  def MarkUnpopulated(self):
+    self._ddb.delete_item(TableName = self._table_name, Key = {'InstanceId': {'S': self._marker_id}})
+
+  @staticmethod
+  def _MarkerId(shard):
+    return FULL_SCAN_MARKER_ID if shard == DEFAULT_SHARD else FULL_SCAN_MARKER_ID + '/' + shard
+
+
+
+  def _ToItem(self, entry):
+
+    item = {
+      'InstanceId': {'S': entry.InstanceId},
+      'Shard': {'S': self._shard},
+      'ExpireAt': {'S': entry.ExpireDateTime.strftime(EXPIRE_AT_FMT)},
+      'ExpireAction': {'S': entry.ExpireAction.name},
+    }
+
+    if entry.TaggedAt is not None:
+      item['TaggedAt'] = {'S': entry.TaggedAt.strftime(EXPIRE_AT_FMT)}
+
+    return item
+
+
+
+  @staticmethod
+  def _FromItem(item):
+
+    return ExpirationIndexEntry(
+      item['InstanceId']['S'],
+      ExpireAction[item['ExpireAction']['S']],
+      datetime.datetime.strptime(item['ExpireAt']['S'], EXPIRE_AT_FMT).replace(tzinfo = datetime.UTC),
+      datetime.datetime.strptime(item['TaggedAt']['S'], EXPIRE_AT_FMT).replace(tzinfo = datetime.UTC)
+      if 'TaggedAt' in item else None,
+    )
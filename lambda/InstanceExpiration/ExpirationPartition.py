@@ -0,0 +1,108 @@
+"""
+Streaming partition of EC2 instances by expiration, for use by the Instance Expiration lambda.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+import heapq
+import itertools
+
+from ExpireAction import ExpireAction
+
+
+
+########################################################################################################################
+# Main Class
+########################################################################################################################
+
+class ExpirationPartition:
+  """
+  Partitions a stream of EC2 instances, as they arrive, into a min-heap of expired instances and the single soonest
+  future expiration. Memory is proportional to the number of expired instances, not to the number of instances
+  scanned, and no full sort is needed.
+
+  Ordering is soonest first; between instances expiring at the same date/time, terminate comes before stop.
+  """
+
+  @property
+  def Next(self):
+    return self._next
+
+  @property
+  def ExpiredCount(self):
+    return len(self._expired)
+
+
+
+  def __init__(self, now):
+    """
+    :param now:   Datetime (UTC) at or before which an EC2 instance is expired.
+    """
+
+    self._now = now
+    self._expired = []
+    self._next = None
+    self._seq = itertools.count()         # Tie breaker, so the heap never compares EC2 instances themselves
+
+
+
+  @staticmethod
+  def SortKey(inst):
+    """
+    :param inst:    Ec2Instance (or expiration index entry).
+    :return:        Sort key: soonest first, terminate before stop.
+    """
+
+    return (inst.ExpireDateTime, inst.ExpireAction != ExpireAction.TERM)
+
+
+
+  def Add(self, inst):
+    """
+    :param inst:    Ec2Instance (or expiration index entry) with an expiration.
+    :return:        True if the EC2 instance expires in the future; False if expired.
+    """
+
+    key = self.SortKey(inst)
+
+    if inst.ExpireDateTime <= self._now:
+      heapq.heappush(self._expired, (key, next(self._seq), inst))
+      return False
+
+    if self._next is None or key < self.SortKey(self._next):
+      self._next = inst
+
+    return True
+
+
+
+  def Future(self, instances):
+    """
+    Add each of a stream of EC2 instances, passing through only those that expire in the future.
+
+    :param instances:   Iterable of Ec2Instance (or expiration index entry).
+    :return:            Generator of the EC2 instances that expire in the future.
+    """
+
+    for inst in instances:
+      if self.Add(inst):
+        yield inst
+
+
+
+  def Expired(self):
+    """
+    Drain the expired EC2 instances.
+
+    :return:            Generator of expired EC2 instances, soonest first.
+    """
+
+    while self._expired:
+      yield heapq.heappop(self._expired)[-1]
@@ -12,14 +12,36 @@ AWS Lambda to check for and handle EC2 instances that have run past their expira
 ########################################################################################################################
 
 import os
+import copy
+import time
+import uuid
 import datetime
-import operator
+import contextlib
+import collections
 import json
 import logging
-import boto3
+import jmespath
 
 from Ec2Instance import Ec2Instance
 from ExpireAction import ExpireAction
+from Trigger import Trigger
+from TriggerKind import TriggerKind
+from ExpirationIndex import DynamoDbExpirationIndex, ExpirationIndexEntry, DEFAULT_SHARD
+from ActionExecutor import ActionExecutor, TokenBucket
+from ExpirationPartition import ExpirationPartition
+from Sharding import ShardOf, Shards, ShardFilter, ShardMessageGroupId
+from Batching import Chunks
+from DirectActions import DirectActionIndex, Covers
+from Clients import LazyClient
+from Metrics import MetricsRecorder
+from Tracing import Tracer, XRayDaemonExporter
+import Clients
+
+# SnapStart runtime hooks, only available in the AWS Lambda runtime (see Prime, Restore)
+try:
+  from snapshot_restore_py import register_before_snapshot, register_after_restore
+except ImportError:
+  register_before_snapshot = register_after_restore = None
 
 
 
@@ -32,11 +54,13 @@ LOG = logging.getLogger()
 LOG.setLevel(logging.INFO)
 #LOG.setLevel(logging.DEBUG)
 
-# Boto clients
-aws_ec2 = boto3.client('ec2')
-aws_events = boto3.client('events')
-aws_scheduler = boto3.client('scheduler')
-aws_ssm = boto3.client('ssm')
+# Boto clients (created on first use; see LazyClient)
+aws_dynamodb = LazyClient('dynamodb')
+aws_ec2 = LazyClient('ec2')
+aws_events = LazyClient('events')
+aws_scheduler = LazyClient('scheduler')
+aws_sqs = LazyClient('sqs')
+aws_ssm = LazyClient('ssm')
 
 # Environment
 CFN_STACK_NAME = os.environ['CFN_STACK_NAME']
@@ -45,6 +69,113 @@ IX_STOP_ACTION = os.environ['IX_STOP_ACTION'] == "Enable"
 IX_TERM_ACTION = os.environ['IX_TERM_ACTION'] == "Enable"
 IX_EVENT_BUS_NAME = os.environ['IX_EVENT_BUS_NAME']
 IX_SSM_PARAM_NEXT_SCHEDULE_ARN = os.environ['IX_SSM_PARAM_NEXT_SCHEDULE_ARN']
+IX_INCREMENTAL_CHECKS = os.environ['IX_INCREMENTAL_CHECKS'] == "Enable"
+IX_INDEX_TABLE_NAME = os.environ['IX_INDEX_TABLE_NAME']
+IX_ACTION_CONCURRENCY = int(os.environ['IX_ACTION_CONCURRENCY'])
+IX_ACTION_RATE_SHARE = int(os.environ['IX_ACTION_RATE_SHARE']) / 100
+IX_SHARD_COUNT = int(os.environ['IX_SHARD_COUNT'])
+IX_CHECK_GRACE_WINDOW = datetime.timedelta(seconds = int(os.environ['IX_CHECK_GRACE_WINDOW']))
+IX_IMMINENT_WAIT = int(os.environ['IX_IMMINENT_WAIT'])
+IX_QUEUE_URL = os.environ['IX_QUEUE_URL']
+IX_SQS_MESSAGE_ID = os.environ['IX_SQS_MESSAGE_ID']
+IX_SCHEDULE_GROUP_NAME = os.environ['IX_SCHEDULE_GROUP_NAME']
+IX_DIRECT_ACTIONS = os.environ['IX_DIRECT_ACTIONS'] == "Enable"
+IX_DIRECT_STOP_ROLE_ARN = os.environ['IX_DIRECT_STOP_ROLE_ARN']
+IX_DIRECT_TERM_ROLE_ARN = os.environ['IX_DIRECT_TERM_ROLE_ARN']
+IX_METRICS = os.environ['IX_METRICS'] == "Enable"
+IX_TRACING = os.environ['IX_TRACING'] == "Enable"
+
+# Other globals
+MAX_FILTER_VALUES = 200                 # Max values per DescribeInstances filter
+DESCRIBE_PAGE_SIZE = 1000               # Max instances per DescribeInstances page
+MAX_ACTION_IDS = 100                    # Max instance ids per StopInstances/TerminateInstances call
+MAX_PUT_EVENTS_ENTRIES = 10             # Max entries per PutEvents call
+MAX_SEND_MESSAGE_ENTRIES = 10           # Max entries per SendMessageBatch call
+PUT_EVENTS_MAX_ATTEMPTS = 3
+NEXT_SCHEDULE_CACHE_TTL = 60            # Seconds. Short, as other execution environments may update the schedule.
+
+# JMESPath projection of a DescribeInstances page to the fields used by Ec2Instance (see ProjectInstances)
+INSTANCE_PROJECTION = (
+  "Reservations[].Instances[].{"
+    "InstanceId: InstanceId, "
+    "State: {Name: State.Name}, "
+    "LaunchTime: LaunchTime, "
+    "Tags: Tags[?starts_with(Key, '" + IX_TAG_PREFIX.replace("'", "\\'") + ":')] || `[]`"
+  "}"
+)
+INSTANCE_PROJECTION_EXPRESSION = jmespath.compile(INSTANCE_PROJECTION)
+
+# Action events buffered during an invocation (see FlushEventBusEvents)
+EVENT_BUFFER = []
+
+# Next check schedules, as last read or written by this execution environment, by shard (see GetNextSchedule)
+NEXT_SCHEDULE_CACHE = {}
+SHARD_SCHEDULE_PREFIX = 'NextShard-'    # Followed by the shard. Created by the Lambda (see GetShardSchedule).
+
+# EC2 API throttling limits of an account and Region for StopInstances/TerminateInstances, as (refill rate per second,
+# burst capacity): the mutating actions request bucket, shared with all other mutating actions, and the resource buckets
+# (in EC2 instances), one for each of StopInstances and TerminateInstances.
+EC2_MUTATING_REQUEST_LIMIT = (5, 200)
+EC2_ACTION_RESOURCE_LIMIT = (20, 1000)
+
+# Concurrency of the action phase (shared across warm invocations), and rate limits for EC2 mutating calls at a share
+# of the account's limits (see ActionRateShare), leaving headroom for other callers in the account. StopInstances and
+# TerminateInstances share one resource bucket here, so neither can exceed its own.
+EXECUTOR = ActionExecutor(IX_ACTION_CONCURRENCY)
+EC2_MUTATING_REQUESTS = TokenBucket(*(limit * IX_ACTION_RATE_SHARE for limit in EC2_MUTATING_REQUEST_LIMIT))
+EC2_MUTATING_INSTANCES = TokenBucket(*(limit * IX_ACTION_RATE_SHARE for limit in EC2_ACTION_RESOURCE_LIMIT))
+SCHEDULE_AT_FMT = '%Y-%m-%dT%H:%M:%S'   # Format of the date/time in an EventBridge Scheduler 'at()' expression
+
+# Direct actions (see DirectActionIndex): the actions taken by per-instance schedules (and the role of each), the rate
+# limit for writing the schedules at half the EventBridge Scheduler default (50/sec), the schedule writes per
+# reconciliation (200 seconds at that rate; the rest are handed off), and how long after an expiration the Lambda
+# follows up to act on anything a schedule did not (and to clean up the index).
+DIRECT_ACTIONS = {
+  a: role_arn
+  for a, role_arn, enabled in (
+    (ExpireAction.STOP, IX_DIRECT_STOP_ROLE_ARN, IX_STOP_ACTION),
+    (ExpireAction.TERM, IX_DIRECT_TERM_ROLE_ARN, IX_TERM_ACTION),
+  )
+  if enabled and IX_DIRECT_ACTIONS
+}
+SCHEDULER_WRITES = TokenBucket(rate = 25, capacity = 50)
+DIRECT_ACTION_RECONCILE_WRITES = 5000
+DIRECT_ACTION_MAX_RETRIES = 3           # Hand-offs of failed schedule writes, before leaving them to the backup check
+DIRECT_ACTION_FOLLOW_UP = datetime.timedelta(minutes = 5)
+
+# End of the current invocation's time budget, per time.monotonic() (see handler, RemainingTime), and the time to keep
+# in hand for acting after waiting in the invocation for an imminent expiration (see ImminentWait).
+INVOCATION_DEADLINE = None
+IMMINENT_WAIT_MARGIN = 60               # Seconds
+
+# Expired EC2 instances are acted on in passes, and whatever is left once the invocation is short of time is handed off
+# to a continuation message (see OnExpiredInstances, HandOff). A pass is sized to what the EC2 rate limits allow in
+# ACTION_PASS_SECONDS once their bursts are spent, at the configured ActionRateShare (see ActionPassSize), and to at
+# most ACTION_PASS_SIZE EC2 instances, so it finishes well within the margin.
+ACTION_PASS_SIZE = 500
+ACTION_PASS_SECONDS = 45
+HANDOFF_MARGIN = 90                     # Seconds
+MAX_CONTINUATION_IDS = 4000             # About 100 KB of EC2 instance ids, well within the 256 KB SQS message limit
+
+# CloudWatch metrics, written as EMF records at the end of each invocation when the dashboard is enabled. Counts are
+# written every invocation; durations of the phases of a check (ex: 'ScanDuration') and expiration lag (the time from
+# an EC2 instance's expiration to the action on it) only when they occur.
+METRICS = MetricsRecorder(CFN_STACK_NAME, enabled = IX_METRICS, counts = [
+  'InstancesScanned',                   # EC2 instances described, expired or not
+  'InstancesDue',                       # Expired EC2 instances to act on
+  'StopActions',
+  'TerminateActions',
+  'VerificationRejects',                # Actions aborted by the verifier (see VerifyExpireAction)
+])
+
+# What the current check is acting for, as the Trigger dimension of the ExpirationLag metric (see OnActed): the cause
+# of each EC2 instance named by the check's triggers, and of any other found expired (see ActionCauses, CheckCause).
+CHECK_CAUSES = {}
+CHECK_CAUSE = 'Other'
+
+# Tracing of the phases of an invocation (see Phase), as X-Ray subsegments of the invocation's segment when active
+# tracing is enabled. Spans carry the number of API calls made within them.
+TRACER = Tracer(XRayDaemonExporter() if IX_TRACING else None, calls = lambda: Clients.ACCOUNTING.Calls)
 
 
 
@@ -73,18 +204,125 @@ def ResponseSuccessful(rsp):
 
 
 
-def PopNext(some_list):
+@contextlib.contextmanager
+def Phase(name, **attributes):
   """
-  Pop the next item from a list.
+  Context manager for a phase of a check: its duration is added to the '<name>Duration' metric, and it is traced as a
+  span.
 
-  :param some_list:   Any list.
-  :return:            First element from the list or 'None' if the list is empty.
+  :param name:          Phase name (ex: 'Verify').
+  :param attributes:    Initial span attributes (ex: instances = 100).
+  :return:              The span (see Tracer.Span).
   """
 
-  if len(some_list) != 0:
-    return some_list.pop(0)
+  with METRICS.Timer(name + 'Duration'), TRACER.Span(name, **attributes) as span:
+    yield span
+
+
+
+def ProjectPages(filters):
+  """
+  Describe EC2 instances, projecting each page down to only the fields Ec2Instance needs (id, state name, launch time,
+  and expiration tags) as it arrives, so the full page (network interfaces, block device mappings, etc.) can be freed
+  right away. Each page is traced as a 'Describe' span.
+
+  :param filters:         DescribeInstances filters.
+  :return:                Generator of lists of (projected) boto3 EC2.Instance, one per page.
+  """
+
+  pages = iter(aws_ec2.get_paginator('describe_instances').paginate(
+    Filters = filters,
+    PaginationConfig = {'PageSize': DESCRIBE_PAGE_SIZE},
+  ))
+
+  while True:
+
+    with TRACER.Span('Describe') as span:
+      page = next(pages, None)
+      if page is not None:
+        page = INSTANCE_PROJECTION_EXPRESSION.search(page) or []
+        span.SetAttribute('instances', len(page))
+
+    if page is None:
+      return
+
+    yield page
+
+
+
+def ProjectInstances(filters):
+  """
+  :param filters:         DescribeInstances filters.
+  :return:                Generator of (projected) boto3 EC2.Instance (see ProjectPages).
+  """
+
+  for page in ProjectPages(filters):
+    yield from page
+
+
+
+def ParseInstance(inst):
+  """
+  :param inst:            (Projected) boto3 EC2.Instance.
+  :return:                Ec2Instance, or 'None' if it failed to parse or has no expiration.
+  """
+
+  try:
+    if (i := Ec2Instance(inst)).ExpireDateTime is not None:
+      return i
+  except Exception as ex:
+    LOG.exception("Ignoring EC2 instance that failed to parse: %s", inst['InstanceId'])
+
+  return None
+
+
+
+def DescribeInstances(instance_ids = None, shard = None):
+  """
+  Iterate over in-scope EC2 instances: instances not shutting down or terminated, with at least one properly formed
+  expiration tag.
+
+  :param instance_ids:    Limit to these EC2 instance ids, or 'None' for all in-scope EC2 instances (full scan).
+  :param shard:           Limit a full scan to the EC2 instances of this shard (see ShardFilter), or 'None' for all.
+  :return:                Generator of Ec2Instance objects.
+  """
+
+  instance_filter = [
+    {
+      # Omitting 'shutting-down', 'terminated'
+      'Name': 'instance-state-name',
+      'Values': ['pending', 'running', 'stopping', 'stopped']
+    },
+    {
+      # Limiting to instances with at least one expiration tag
+      'Name': 'tag-key',
+      'Values': [IX_TAG_PREFIX + ':*']
+    }
+  ]
+
+  if instance_ids is None and shard is not None:
+    filters = [instance_filter + [ShardFilter(shard, IX_SHARD_COUNT)]]
+  elif instance_ids is None:
+    filters = [instance_filter]
   else:
-    return None
+    # Filtering (versus 'InstanceIds') avoids failing the whole call when an instance no longer exists.
+    filters = [
+      instance_filter + [{'Name': 'instance-id', 'Values': chunk}]
+      for chunk in Chunks(sorted(instance_ids), MAX_FILTER_VALUES)
+    ]
+
+  scanned = 0
+
+  try:
+    for f in filters:
+      for page in ProjectPages(f):
+        scanned += len(page)
+        with TRACER.Span('Parse', instances = len(page)) as span:
+          parsed = [i for i in map(ParseInstance, page) if i is not None]
+          span.SetAttribute('in_scope', len(parsed))
+        yield from parsed
+  finally:
+    METRICS.Count('InstancesScanned', scanned)
 
 
 
@@ -109,7 +347,11 @@ def CalculateNextCheck(inst):
   """
   Calculate the date/time of the next check. Normally use the expiration date/time of the given instance, but round
   up to at least X minutes from now to avoid trying to schedule in the past if the instance expiration date/time is
-  very close to right now.
+  very close to right now. With direct actions, an instance its schedule acts on is followed up on a few minutes later
+  instead (see DIRECT_ACTION_FOLLOW_UP).
+
+  The check is delayed by the grace window (IX_CHECK_GRACE_WINDOW), so a cluster of expirations within the window is
+  handled by one check rather than one check each.
 
   :param inst:    Base on this instance's expiration date/time.
   :return:        Next check date/time.
@@ -117,48 +359,235 @@ def CalculateNextCheck(inst):
 
   no_sooner_than = datetime.datetime.now(datetime.UTC) + datetime.timedelta(minutes = 1)
 
-  if inst.ExpireDateTime < no_sooner_than:
+  check_at = CheckDateTime(inst)
+
+  if check_at < no_sooner_than:
     return no_sooner_than
   else:
-    return inst.ExpireDateTime
+    return check_at
+
+
+
+def CheckDateTime(inst):
+  """
+  :param inst:    EC2 instance (or expiration index entry) that will expire in the future.
+  :return:        Date/time from which a check handles the instance's expiration (see CalculateNextCheck).
+  """
+
+  check_at = inst.ExpireDateTime + IX_CHECK_GRACE_WINDOW
+
+  if Covers(inst, DIRECT_ACTIONS):
+    check_at += DIRECT_ACTION_FOLLOW_UP
+
+  return check_at
+
+
+
+def RemainingTime():
+  """
+  :return:        Seconds left in the current invocation's time budget, or 'None' if unknown (not in an invocation).
+  """
+
+  return None if INVOCATION_DEADLINE is None else INVOCATION_DEADLINE - time.monotonic()
+
+
+
+def ImminentWait(inst):
+  """
+  Decide whether to wait for the next expiration within this invocation, rather than schedule another check. Only an
+  expiration within IX_IMMINENT_WAIT seconds is waited for, and only while the invocation would still have
+  IMMINENT_WAIT_MARGIN seconds left to act afterwards.
+
+  :param inst:    Next EC2 instance (or expiration index entry) that will expire in the future.
+  :return:        Seconds to wait before checking again, or 'None' to schedule the next check instead.
+  """
+
+  if IX_IMMINENT_WAIT <= 0 or (remaining := RemainingTime()) is None:
+    return None
+
+  wait = max(0.0, (CheckDateTime(inst) - datetime.datetime.now(datetime.UTC)).total_seconds())
+
+  if wait <= IX_IMMINENT_WAIT and remaining - wait >= IMMINENT_WAIT_MARGIN:
+    return wait
+  else:
+    return None
+
+
+
+def ScheduleOrWait(inst, shard = None):
+  """
+  :param inst:    Next EC2 instance (or expiration index entry) that will expire in the future, or 'None' if none.
+  :param shard:   Shard to schedule the next check of, or 'None' if not sharded.
+  :return:        Seconds to wait before checking again within this invocation (see ImminentWait), or 'None' if the
+                  next check was scheduled (or there is none).
+  """
+
+  if inst is None:
+    return None
+
+  if (wait := ImminentWait(inst)) is not None:
+    LOG.info('Waiting %.1f second(s) for imminent expiration of EC2 instance: %s', wait, inst.InstanceId)
+    return wait
+
+  with Phase('Schedule', shard = shard):
+    ScheduleNextCheck(inst, shard)
+
+  return None
+
+
+
+def GetNextSchedule(shard = None):
+  """
+  Get the schedule for the next check (an UpdateSchedule request body), from the cache while it is fresh. Otherwise
+  look up the schedule name (SSM parameter) and then the schedule itself.
+
+  :param shard: Shard whose schedule to get (see GetShardSchedule), or 'None' for the stack's next check schedule.
+  :return:      Schedule ready to be modified and supplied to the UpdateSchedule API, or 'None' on failure.
+  """
+
+  cached = NEXT_SCHEDULE_CACHE.get(shard)
+
+  if cached is None or time.monotonic() >= cached['expires']:
+
+    InvalidateNextSchedule(shard)
+
+    if shard is not None:
+
+      if (schedule := GetShardSchedule(shard)) is not None:
+        CacheNextSchedule(PrepScheduleRequest(schedule), shard)
+
+    else:
+
+      rsp = aws_ssm.get_parameter(Name = IX_SSM_PARAM_NEXT_SCHEDULE_ARN)
+
+      if ResponseSuccessful(rsp):
+        schedule_name = rsp['Parameter']['Value'].split('/')[-1]
+        schedule = aws_scheduler.get_schedule(Name = schedule_name)
+
+        if ResponseSuccessful(schedule):
+          CacheNextSchedule(PrepScheduleRequest(schedule), shard)
+
+  cached = NEXT_SCHEDULE_CACHE.get(shard)
+
+  return copy.deepcopy(cached['schedule']) if cached else None
+
+
+
+def GetShardSchedule(shard):
+  """
+  Get the next check schedule of a shard. A shard's schedule is created on first use, from the stack's next check
+  schedule, initially one minute out (the resulting check of the shard is harmless). It sends a coalesced trigger for
+  the shard to the shard's message group.
+
+  :param shard: Shard.
+  :return:      Schedule (as from the GetSchedule API), or 'None' on failure.
+  """
+
+  name = SHARD_SCHEDULE_PREFIX + shard
+
+  try:
+    return aws_scheduler.get_schedule(Name = name, GroupName = IX_SCHEDULE_GROUP_NAME)
+  except aws_scheduler.exceptions.ResourceNotFoundException as ex:
+    pass
+
+  if (template := GetNextSchedule()) is None:
+    return None
+
+  first_check = datetime.datetime.now(datetime.UTC) + datetime.timedelta(minutes = 1)
+
+  schedule = {k: template[k] for k in ('FlexibleTimeWindow', 'ScheduleExpressionTimezone', 'State') if k in template}
+
+  schedule.update({
+    'Name': name,
+    'GroupName': IX_SCHEDULE_GROUP_NAME,
+    'ScheduleExpression': 'at(' + first_check.strftime(SCHEDULE_AT_FMT) + ')',
+    'Target': dict(
+      template['Target'],
+      SqsParameters = {'MessageGroupId': ShardMessageGroupId(IX_SQS_MESSAGE_ID, shard)},
+      Input = Trigger.CoalescedBody(name, shard = shard),
+    ),
+  })
+
+  LOG.info('Creating next check schedule of shard %s: %s', shard, name)
+
+  try:
+    aws_scheduler.create_schedule(**schedule)
+  except aws_scheduler.exceptions.ConflictException as ex:
+    return aws_scheduler.get_schedule(Name = name, GroupName = IX_SCHEDULE_GROUP_NAME)
+
+  return schedule
 
 
 
-def ScheduleNextCheck(inst):
+def CacheNextSchedule(schedule, shard = None):
   """
-  Schedule the next time to run this Lambda.
+  :param schedule:    Schedule (UpdateSchedule request body) known to be current.
+  :param shard:       Shard of the schedule, or 'None' for the stack's next check schedule.
+  """
+
+  NEXT_SCHEDULE_CACHE[shard] = {
+    'schedule': copy.deepcopy(schedule),
+    'expires': time.monotonic() + NEXT_SCHEDULE_CACHE_TTL,
+  }
+
+
+
+def InvalidateNextSchedule(shard = None):
+
+  NEXT_SCHEDULE_CACHE.pop(shard, None)
+
 
-  :param inst:  Next EC2 instance that will expire in the future.
+
+def ScheduleNextCheck(inst, shard = None):
+  """
+  Schedule the next time to run this Lambda. Skips the update if the schedule is already as required.
+
+  :param inst:  Next EC2 instance (or expiration index entry) that will expire in the future.
+  :param shard: Shard to schedule the next check of, or 'None' if not sharded.
   """
 
   try:
 
     LOG.info('Scheduling next check based on EC2 instance: ' + str(inst))
 
-    rsp = aws_ssm.get_parameter(Name = IX_SSM_PARAM_NEXT_SCHEDULE_ARN)
+    schedule_at = CalculateNextCheck(inst)
+    schedule_expression = 'at(' + schedule_at.strftime(SCHEDULE_AT_FMT) + ')'
 
-    if ResponseSuccessful(rsp):
-      schedule_name = rsp['Parameter']['Value'].split('/')[-1]
-      schedule = aws_scheduler.get_schedule(Name = schedule_name)
+    # Second attempt only after the cached schedule turned out to be out of date.
+    for attempt in range(2):
+
+      if (schedule := GetNextSchedule(shard)) is None:
+        break
+
+      if schedule['ScheduleExpression'] == schedule_expression:
+        LOG.info('Next check already scheduled: ' + schedule_expression)
+        break
+
+      schedule['ScheduleExpression'] = schedule_expression
 
-      if ResponseSuccessful(schedule):
-        schedule_at = CalculateNextCheck(inst)
-        schedule['ScheduleExpression'] = 'at(' + schedule_at.strftime('%Y-%m-%dT%H:%M:%S') + ')'
-        rsp = aws_scheduler.update_schedule(**PrepScheduleRequest(schedule))
-        ResponseSuccessful(rsp)
+      try:
+        rsp = aws_scheduler.update_schedule(**schedule)
+        if ResponseSuccessful(rsp):
+          CacheNextSchedule(schedule, shard)
+        break
+      except (aws_scheduler.exceptions.ConflictException, aws_scheduler.exceptions.ResourceNotFoundException) as ex:
+        LOG.warning('Refreshing out of date next check schedule: %s', str(ex))
+        InvalidateNextSchedule(shard)
 
   except Exception as ex:
 
+    InvalidateNextSchedule(shard)
     LOG.exception('Failed to schedule next check.')
 
 
 
-def VerifyExpireAction(instance_id, expire_action):
+def VerifyExpireAction(instance_id, instance, expire_action):
   """
   Independently verify, to the extent practical, the planned action for an instance, in an attempt to catch any logic
   errors that were about to stop or terminate an EC2 instance incorrectly.
 
   :param instance_id:       EC2 instance id.
+  :param instance:          Freshly described boto3 EC2.Instance, or 'None' if it could not be described.
   :param expire_action:     Planned expiration action.
   :return:                  True to continue; False to abort.
   """
@@ -169,23 +598,21 @@ def VerifyExpireAction(instance_id, expire_action):
 
   try:
 
-    # Get instance metadata
-    rsp = aws_ec2.describe_instances(InstanceIds = [instance_id])
+    assert instance is not None, "EC2 instance not found."
+    assert instance['InstanceId'] == instance_id
 
-    if ResponseSuccessful(rsp):
+    # Choosing not to re-implement Ec2Instance logic as part of this verification...
+    inst = Ec2Instance(instance)
 
-      # Choosing not to re-implement Ec2Instance logic as part of this verification...
-      inst = Ec2Instance(rsp['Reservations'][0]['Instances'][0])
+    # Verify
+    assert inst.ExpireAction == expire_action
+    assert inst.ExpireDateTime <= datetime.datetime.now(datetime.UTC)
+    assert inst.State not in unexpected_instance_statuses
 
-      # Verify
-      assert inst.ExpireAction == expire_action
-      assert inst.ExpireDateTime <= datetime.datetime.now(datetime.UTC)
-      assert inst.State not in unexpected_instance_statuses
+    assert ( (expire_action == ExpireAction.STOP) and IX_STOP_ACTION ) or \
+           ( (expire_action == ExpireAction.TERM) and IX_TERM_ACTION )
 
-      assert ( (expire_action == ExpireAction.STOP) and IX_STOP_ACTION ) or \
-             ( (expire_action == ExpireAction.TERM) and IX_TERM_ACTION )
-
-      result = True
+    result = True
 
   except Exception as ex:
 
@@ -195,31 +622,112 @@ def VerifyExpireAction(instance_id, expire_action):
 
 
 
+def DescribeForVerification(instance_ids):
+  """
+  Describe EC2 instances for verification, independently of the in-scope filter used by DescribeInstances().
+
+  :param instance_ids:      EC2 instance ids (at most MAX_FILTER_VALUES).
+  :return:                  List of boto3 EC2.Instance; empty on failure (instances not described fail verification).
+  """
+
+  described = []
+
+  try:
+
+    described.extend(ProjectInstances([{'Name': 'instance-id', 'Values': instance_ids}]))
+
+  except Exception as ex:
+
+    LOG.exception("DescribeForVerification()")
+    described = []
+
+  return described
+
+
+
+def VerifyExpireActions(insts, expire_action):
+  """
+  Verify the planned action for several instances (see VerifyExpireAction), re-describing them with a few chunked
+  calls instead of one call per instance.
+
+  :param insts:             EC2 instances about to be acted upon.
+  :param expire_action:     Planned expiration action.
+  :return:                  Tuple of (verified, rejected) lists of the given EC2 instances.
+  """
+
+  fresh = {}
+
+  for described in EXECUTOR.Map(DescribeForVerification, Chunks([i.InstanceId for i in insts], MAX_FILTER_VALUES)):
+    fresh.update({inst['InstanceId']: inst for inst in described})
+
+  verified = []
+  rejected = []
+
+  for inst in insts:
+    if VerifyExpireAction(inst.InstanceId, fresh.get(inst.InstanceId), expire_action):
+      verified.append(inst)
+    else:
+      rejected.append(inst)
+
+  return verified, rejected
+
+
+
 def EmitEventBusEvent(inst):
   """
-  Emit an Amazon EventBridge event for a stop/term action.
+  Buffer an Amazon EventBridge event for a stop/term action, to be sent by FlushEventBusEvents().
 
   :param inst:              Expired EC2 instance.
   """
 
   if IX_EVENT_BUS_NAME != "":
 
+    EVENT_BUFFER.append(
+      {
+        'EventBusName': IX_EVENT_BUS_NAME,
+        'Source': CFN_STACK_NAME,
+        #'Resources': ...,                        # EC2 instance ARN is surprisingly difficult to get...
+        'DetailType': 'Action',
+        'Detail': json.dumps({
+          'action': str(inst.ExpireAction),
+          'instance-id': inst.InstanceId,
+        }),
+      }
+    )
+
+
+
+def FlushEventBusEvents():
+  """
+  Send all buffered Amazon EventBridge events, in batches. Entries that fail are retried (only those entries) a few
+  times before being given up on.
+  """
+
+  entries, EVENT_BUFFER[:] = list(EVENT_BUFFER), []
+
+  for batch in Chunks(entries, MAX_PUT_EVENTS_ENTRIES):
+
     try:
 
-      rsp = aws_events.put_events(Entries = [
-        {
-          'EventBusName': IX_EVENT_BUS_NAME,
-          'Source': CFN_STACK_NAME,
-          #'Resources': ...,                        # EC2 instance ARN is surprisingly difficult to get...
-          'DetailType': 'Action',
-          'Detail': json.dumps({
-            'action': str(inst.ExpireAction),
-            'instance-id': inst.InstanceId,
-          }),
-        }
-      ])
-
-      ResponseSuccessful(rsp)
+      for attempt in range(PUT_EVENTS_MAX_ATTEMPTS):
+
+        if attempt:
+          time.sleep(0.1 * 2 ** attempt)
+
+        rsp = aws_events.put_events(Entries = batch)
+
+        if not ResponseSuccessful(rsp) or not rsp.get('FailedEntryCount'):
+          break
+
+        # Result entries are in the same order as the request entries; failed ones have an 'ErrorCode'.
+        batch = [e for e, r in zip(batch, rsp['Entries']) if r.get('ErrorCode')]
+
+        LOG.warning('Failed to emit %d event(s) for action: %s', len(batch),
+          {r['ErrorCode'] for r in rsp['Entries'] if r.get('ErrorCode')})
+
+      else:
+
+        LOG.error('Giving up on emitting event(s) for action: %s', [e['Detail'] for e in batch])
 
     except Exception as ex:
 
@@ -227,128 +735,823 @@ def EmitEventBusEvent(inst):
 
 
 
-def OnStopInstance(inst):
+def ActOnChunk(api, result_key, instance_ids):
   """
-  Stop an expired instance.
+  Call an EC2 action API (StopInstances, TerminateInstances) once for several EC2 instances, within the EC2 mutating
+  call rate limits.
 
-  :param inst:  Expired EC2 instance.
+  :param api:             Boto3 EC2 client method (ex: aws_ec2.stop_instances).
+  :param result_key:      Response key listing the per-instance results (ex: 'StoppingInstances').
+  :param instance_ids:    EC2 instance ids (at most MAX_ACTION_IDS).
+  :return:                Tuple of (EC2 instance ids acted upon, EC2 instance ids to retry one at a time).
   """
 
-  if not IX_STOP_ACTION:
-    LOG.info("NOT stopping expired EC2 instance (StopAction disabled): %s",  inst.InstanceId)
-  elif inst.State != 'running' and inst.State != 'pending':
-    LOG.debug("NOT stopping expired EC2 instance (instance not running): %s",  inst.InstanceId)
-  elif not VerifyExpireAction(inst.InstanceId, ExpireAction.STOP):
-    LOG.error("Aborting stop of EC2 instance (failed verification): %s",  inst.InstanceId)
-  else:
-    rsp = aws_ec2.stop_instances(InstanceIds = [inst.InstanceId])
+  acted = []
+  retry = []
+
+  EC2_MUTATING_REQUESTS.Acquire()
+  EC2_MUTATING_INSTANCES.Acquire(len(instance_ids))
+
+  try:
+    rsp = api(InstanceIds = instance_ids)
     if ResponseSuccessful(rsp):
-      # The text of this log must match the StopActions CloudWatch logs metric filter.
-      LOG.info("Stopped EC2 instance: %s",  inst.InstanceId)
-      EmitEventBusEvent(inst)
+      acted = [r['InstanceId'] for r in rsp.get(result_key, [])]
+  except Exception as ex:
+    if len(instance_ids) == 1:
+      LOG.exception("Failed to act on expired EC2 instance: %s", instance_ids[0])
+    else:
+      LOG.warning("Retrying EC2 instances one at a time after failed call: %s", str(ex))
+      retry = instance_ids
+
+  return acted, retry
+
+
+
+def ActOnInstances(api, result_key, instance_ids):
+  """
+  Call an EC2 action API (StopInstances, TerminateInstances) for several EC2 instances, in concurrent chunks. Should a
+  chunk fail (the whole call fails if any one EC2 instance cannot be acted upon), its EC2 instances are retried one at
+  a time so one bad EC2 instance does not hold back the others.
+
+  :param api:             Boto3 EC2 client method (ex: aws_ec2.stop_instances).
+  :param result_key:      Response key listing the per-instance results (ex: 'StoppingInstances').
+  :param instance_ids:    EC2 instance ids.
+  :return:                Generator of the EC2 instance ids acted upon.
+  """
+
+  chunks = list(Chunks(instance_ids, MAX_ACTION_IDS))
+
+  while chunks:
+
+    results = EXECUTOR.Map(lambda chunk: ActOnChunk(api, result_key, chunk), chunks)
+
+    for acted, retry in results:
+      yield from acted
+
+    chunks = [[instance_id] for acted, retry in results for instance_id in retry]
+
+
 
+def OnActed(inst):
+  """
+  Record an action taken on an expired instance: emit its event, and the time since it expired.
+
+  The time since it expired is to the return of the StopInstances/TerminateInstances call, and is recorded by action
+  and by the trigger that led to the action (see CHECK_CAUSES).
+
+  :param inst:    EC2 instance acted upon.
+  """
+
+  EmitEventBusEvent(inst)
+
+  METRICS.Value('ExpirationLag', (datetime.datetime.now(datetime.UTC) - inst.ExpireDateTime).total_seconds(),
+    Action = str(inst.ExpireAction),
+    Trigger = CHECK_CAUSES.get(inst.InstanceId, CHECK_CAUSE),
+  )
+
+
+
+def OnStopInstances(insts):
+  """
+  Stop expired instances.
+
+  :param insts:   Expired EC2 instances with a stop action.
+  :return:        List of the EC2 instance ids that failed verification or could not be stopped.
+  """
+
+  candidates = []
+
+  for inst in insts:
+    if not IX_STOP_ACTION:
+      LOG.info("NOT stopping expired EC2 instance (StopAction disabled): %s",  inst.InstanceId)
+    elif inst.State != 'running' and inst.State != 'pending':
+      LOG.debug("NOT stopping expired EC2 instance (instance not running): %s",  inst.InstanceId)
+    else:
+      candidates.append(inst)
+
+  with Phase('Verify', action = str(ExpireAction.STOP), instances = len(candidates)) as span:
+    verified, rejected = VerifyExpireActions(candidates, ExpireAction.STOP) if candidates else ([], [])
+    span.SetAttribute('rejected', len(rejected))
+
+  for inst in rejected:
+    LOG.error("Aborting stop of EC2 instance (failed verification): %s",  inst.InstanceId)
+
+  METRICS.Count('VerificationRejects', len(rejected))
+
+  to_stop = {inst.InstanceId: inst for inst in verified}
+
+  with Phase('Act', action = str(ExpireAction.STOP), instances = len(to_stop)):
+    for instance_id in ActOnInstances(aws_ec2.stop_instances, 'StoppingInstances', list(to_stop)):
+      # The text of this log must match the App Action Logs CloudWatch dashboard query.
+      LOG.info("Stopped EC2 instance: %s",  instance_id)
+      OnActed(to_stop.pop(instance_id))
+      METRICS.Count('StopActions')
 
+  return [inst.InstanceId for inst in rejected] + list(to_stop)
 
-def OnTermInstance(inst):
+
+
+def OnTermInstances(insts):
   """
-  Terminate an expired instance.
+  Terminate expired instances.
 
-  :param inst:  Expired EC2 instance.
+  :param insts:   Expired EC2 instances with a terminate action.
+  :return:        List of the EC2 instance ids that failed verification or could not be terminated.
   """
 
-  if not IX_TERM_ACTION:
-    LOG.info("NOT terminating expired EC2 instance (TerminateAction disabled): %s",  inst.InstanceId)
-  elif not VerifyExpireAction(inst.InstanceId, ExpireAction.TERM):
+  candidates = []
+
+  for inst in insts:
+    if not IX_TERM_ACTION:
+      LOG.info("NOT terminating expired EC2 instance (TerminateAction disabled): %s",  inst.InstanceId)
+    else:
+      candidates.append(inst)
+
+  with Phase('Verify', action = str(ExpireAction.TERM), instances = len(candidates)) as span:
+    verified, rejected = VerifyExpireActions(candidates, ExpireAction.TERM) if candidates else ([], [])
+    span.SetAttribute('rejected', len(rejected))
+
+  for inst in rejected:
     LOG.error("Aborting termination of EC2 instance (failed verification): %s",  inst.InstanceId)
-  else:
-    rsp = aws_ec2.terminate_instances(InstanceIds = [inst.InstanceId])
-    if ResponseSuccessful(rsp):
-      # The text of this log must match the TerminateActions CloudWatch logs metric filter.
-      LOG.info("Terminated EC2 instance: %s",  inst.InstanceId)
-      EmitEventBusEvent(inst)
 
+  METRICS.Count('VerificationRejects', len(rejected))
+
+  to_term = {inst.InstanceId: inst for inst in verified}
+
+  with Phase('Act', action = str(ExpireAction.TERM), instances = len(to_term)):
+    for instance_id in ActOnInstances(aws_ec2.terminate_instances, 'TerminatingInstances', list(to_term)):
+      # The text of this log must match the App Action Logs CloudWatch dashboard query.
+      LOG.info("Terminated EC2 instance: %s",  instance_id)
+      OnActed(to_term.pop(instance_id))
+      METRICS.Count('TerminateActions')
+
+  return [inst.InstanceId for inst in rejected] + list(to_term)
+
+
+
+def OnExpiredInstances(insts, shard = None):
+  """
+  Handle expired EC2 instances in passes (see ActionPassSize), soonest first. Before each pass, check the invocation's
+  time budget: with less than HANDOFF_MARGIN seconds left, the EC2 instances not yet handled are handed off to a
+  continuation message (see HandOff) rather than risk a timeout, after which the whole trigger would be redelivered
+  and checked from scratch. A continuation starts with a full time budget, so always makes progress.
+
+  :param insts:   Expired EC2 instances (soonest first).
+  :param shard:   Shard of the EC2 instances, or 'None' if not sharded.
+  :return:        List of the EC2 instance ids that failed (see OnExpiredPass); all others were handled or handed off.
+                  Exceptions from HandOff are raised to the caller.
+  """
+
+  METRICS.Count('InstancesDue', len(insts))
+
+  failed = []
+  size = ActionPassSize()
+
+  for n, chunk in enumerate(Chunks(insts, size)):
+
+    if (remaining := RemainingTime()) is not None and remaining < HANDOFF_MARGIN:
+      LOG.warning('Handing off %d expired EC2 instance(s) with %.1f second(s) left.', len(insts) - n * size, remaining)
+      HandOff([i.InstanceId for i in insts[n * size:]], shard)
+      break
+
+    failed.extend(OnExpiredPass(chunk))
 
+  return failed
 
-def OnExpiredInstance(inst):
+
+
+def ActionPassSize():
+  """
+  :return:        Number of EC2 instances per pass (see OnExpiredInstances): as many as the EC2 action resource rate
+                  limit allows in ACTION_PASS_SECONDS, with up to two calls (stop, terminate) per MAX_ACTION_IDS of them
+                  within the EC2 mutating request rate limit; at least one, and at most ACTION_PASS_SIZE.
+  """
+
+  instance_rate = EC2_ACTION_RESOURCE_LIMIT[0] * IX_ACTION_RATE_SHARE
+  request_rate = EC2_MUTATING_REQUEST_LIMIT[0] * IX_ACTION_RATE_SHARE
+
+  size = min(instance_rate * ACTION_PASS_SECONDS, int(request_rate * ACTION_PASS_SECONDS / 2) * MAX_ACTION_IDS)
+
+  return max(1, min(ACTION_PASS_SIZE, int(size)))
+
+
+
+def OnExpiredPass(insts):
   """
-  Handle an expired EC2 instance.
+  Handle a pass of expired EC2 instances, grouped by action so each action is a few multi-instance API calls.
 
-  :param inst:  Expired EC2 instance.
+  :param insts:   Expired EC2 instances (soonest first).
+  :return:        List of the EC2 instance ids that failed verification or could not be acted upon.
   """
 
-  LOG.debug('Found expired EC2 instance: ' + str(inst))
+  stops = []
+  terms = []
+  failed = []
 
-  try:
+  for inst in insts:
+    LOG.debug('Found expired EC2 instance: ' + str(inst))
     if inst.ExpireAction == ExpireAction.STOP:
-      OnStopInstance(inst)
+      stops.append(inst)
     elif inst.ExpireAction == ExpireAction.TERM:
-      OnTermInstance(inst)
+      terms.append(inst)
     else:
-      assert False, "Unexpected ExpireAction '{}'.".format(inst.ExpireAction)
-  except Exception as ex:
-    LOG.exception("Failed to handle expired EC2 instance: %s", inst.InstanceId)
+      LOG.error("Failed to handle expired EC2 instance (unexpected ExpireAction '%s'): %s",
+        inst.ExpireAction, inst.InstanceId)
+
+  for action, group in ((OnTermInstances, terms), (OnStopInstances, stops)):
+    try:
+      if group:
+        failed.extend(action(group))
+    except Exception as ex:
+      LOG.exception("Failed to handle expired EC2 instances: %s", [i.InstanceId for i in group])
+      failed.extend(i.InstanceId for i in group)
 
+  return failed
 
 
-########################################################################################################################
-# Handler
-########################################################################################################################
 
-def handler(event, context):
+def HandOff(instance_ids, shard = None, retries = 0):
+  """
+  Send continuation messages naming EC2 instances to check again, to the (FIFO) queue of this Lambda, in the message
+  group of the shard. The continuation is an incremental check of just those EC2 instances (see CheckShard), so the
+  expired ones are re-described, verified and acted upon. Exceptions are raised to the caller; the trigger is then
+  redelivered instead.
+
+  :param instance_ids:    EC2 instance ids not yet handled.
+  :param shard:           Shard of the EC2 instances, or 'None' if not sharded.
+  :param retries:         Number of earlier checks that failed to handle the EC2 instances, or 0 if not a retry.
+  """
 
-  try:
+  group_id = IX_SQS_MESSAGE_ID if shard is None else ShardMessageGroupId(IX_SQS_MESSAGE_ID, shard)
 
-    LogTrigger(event, context)
+  # One message per call, as a batch of full size messages would exceed the SQS batch payload limit.
+  for chunk in Chunks(instance_ids, MAX_CONTINUATION_IDS):
+    aws_sqs.send_message(
+      QueueUrl = IX_QUEUE_URL,
+      MessageBody = Trigger.CoalescedBody(
+        CFN_STACK_NAME, chunk, shard = shard, continuation = True, retries = retries
+      ),
+      MessageGroupId = group_id,
+      MessageDeduplicationId = uuid.uuid4().hex,
+    )
 
-    #
-    # Iterate over all in-scope EC2 instances, collecting into a succinct list.
-    #
 
-    instance_filter = [
-      {
-        # Omitting 'shutting-down', 'terminated'
-        'Name': 'instance-state-name',
-        'Values': ['pending', 'running', 'stopping', 'stopped']
-      },
-      {
-        # Limiting to instances with at least one expiration tag
-        'Name': 'tag-key',
-        'Values': [IX_TAG_PREFIX + ':*']
-      }
-    ]
 
-    instances = []
+def FullCheck(index = None, shard = None):
+  """
+  Scan all in-scope EC2 instances, handle the expired ones and schedule the next check.
 
-    for page in aws_ec2.get_paginator('describe_instances').paginate(Filters = instance_filter):
-      for res in page['Reservations']:
-        for inst in res['Instances']:
-          try:
-            instances.append(Ec2Instance(inst))
-          except Exception as ex:
-            LOG.exception("Ignoring EC2 instance that failed to parse: %s", inst['InstanceId'])
+  :param index:   Expiration index to reconcile with the scan, or 'None' to not use an index.
+  :param shard:   Only handle the EC2 instances of this shard, or 'None' if not sharded.
+  :return:        Seconds to wait before checking again, or 'None' (see ScheduleOrWait).
+  """
 
-    #
-    # Sort resulting list by the next expiration date/time (soonest first).
-    #
+  #
+  # Stream all in-scope EC2 instances through a partition, which keeps only the expired instances (soonest first) and
+  # the next instance expected to expire. Future expirations stream on into the index, which holds only those.
+  #
+
+  now = datetime.datetime.now(datetime.UTC)
+  partition = ExpirationPartition(now)
+  remaining = []
+
+  with Phase('Scan', shard = shard, full = True) as span:
+
+    # Each shard scans only its own EC2 instances, so a backup check scans all of them once in total.
+    instances = DescribeInstances(shard = shard)
+
+    future = partition.Future(instances)
+
+    if index is not None:
+      remaining = index.Reconcile(future, scanned_at = now)
+    else:
+      collections.deque(future, maxlen = 0)
+
+    span.SetAttribute('expired', partition.ExpiredCount)
+
+  LOG.debug('Expired: %d, next: %s', partition.ExpiredCount, partition.Next)
+
+  #
+  # Handle expired instances and schedule check based on next instance expected to expire.
+  #
+
+  with TRACER.Span('Select', instances = partition.ExpiredCount):
+    expired = list(partition.Expired())
 
-    instances.sort(key = operator.attrgetter('ExpireDateTime'))
+  OnExpiredInstances(expired, shard)
+
+  # Index writes the reconciliation left undone (see DirectActionIndex.Reconcile) are continued by incremental checks.
+  if remaining:
+    HandOff(remaining, shard)
+
+  return ScheduleOrWait(partition.Next, shard)
+
+
+
+def LatestTagChanges(triggers):
+  """
+  Merge the tag changes of several triggers, keeping the latest event of each EC2 instance. EventBridge does not
+  guarantee the order of events, so the latest is found by event time. If the order is uncertain (events of the same
+  second, or without a time), the tag change is left undated, so the EC2 instance is described.
+
+  :param triggers:    Trigger objects, in SQS (FIFO) order.
+  :return:            Tuple of (dict of EC2 instance id to its full tags, dict of EC2 instance id to its event time).
+  """
+
+  tag_changes = {}
+  tagged_at = {}
+
+  for t in triggers:
+    for instance_id, tags in t.TagChanges.items():
+      at, latest = t.TaggedAt.get(instance_id), tagged_at.get(instance_id)
+      if instance_id not in tag_changes or (at is not None and latest is not None and at > latest):
+        tag_changes[instance_id], tagged_at[instance_id] = tags, at
+      elif at is None or latest is None or at == latest:
+        tag_changes[instance_id], tagged_at[instance_id] = tags, None
+
+  return tag_changes, {i: at for i, at in tagged_at.items() if at is not None}
+
+
+
+def EvaluateTagChanges(tag_changes, tagged_at, index, now):
+  """
+  Evaluate EC2 instances from the tags carried by their tag change events, without describing them. EventBridge does
+  not guarantee the order of events, so each index entry records the time its tags are known to be as of (see
+  ExpirationIndexEntry.TaggedAt), and an event is applied to the entry only if it is newer. An event that confirms the
+  index (the same future expiration, or no expiration and no entry) needs no write. Any other EC2 instance, including
+  one with a duration tag (which needs the launch time), an expired one (which is verified before acting), or one with
+  no entry to compare with, is left to be described.
+
+  :param tag_changes:     Dict of EC2 instance id to its full tags as of the event (see Trigger.TagChanges).
+  :param tagged_at:       Dict of EC2 instance id to the datetime (UTC) of its event (see Trigger.TaggedAt).
+  :param index:           Expiration index.
+  :param now:             Datetime (UTC).
+  :return:                Tuple of (entries to upsert, EC2 instance ids to delete, EC2 instance ids to describe). The
+                          other EC2 instances already match the index.
+  """
+
+  upserts = []
+  deletes = []
+  unresolved = []
+
+  entries = index.GetMany(tag_changes) if tag_changes else {}
+
+  for instance_id, tags in tag_changes.items():
+
+    tags = Ec2Instance.GetTagsFromDict(tags)
+    at = tagged_at.get(instance_id)
+
+    if at is None or Ec2Instance.NeedsLaunchTime(tags):
+      unresolved.append(instance_id)
+      continue
+
+    expire_action, expire_date_time = Ec2Instance.CalculateExpiration(tags, None)
+    entry = entries.get(instance_id)
+    newer = entry is not None and entry.TaggedAt is not None and at > entry.TaggedAt
+
+    if expire_date_time is None:
+      if entry is None:
+        pass
+      elif newer:
+        deletes.append(instance_id)
+      else:
+        unresolved.append(instance_id)
+    elif expire_date_time <= now or entry is None:
+      unresolved.append(instance_id)
+    elif (entry.ExpireAction, entry.ExpireDateTime) == (expire_action, expire_date_time):
+      pass
+    elif newer:
+      upserts.append(ExpirationIndexEntry(instance_id, expire_action, expire_date_time, at))
+    else:
+      unresolved.append(instance_id)
+
+  LOG.debug('Tag changes applied from event: %d upserts, %d deletes, %d left to describe', len(upserts), len(deletes),
+            len(unresolved))
+
+  return upserts, deletes, unresolved
+
+
+
+def IncrementalCheck(index, instance_ids, tag_changes = None, shard = None, tagged_at = None):
+  """
+  Inspect only the given EC2 instances plus those the expiration index says are expired, handle the expired ones,
+  update the index, and schedule the next check from the index. Tag changes are applied from their events where
+  possible (see EvaluateTagChanges), and only described otherwise.
+
+  :param index:           Expiration index (must be populated by a prior full check).
+  :param instance_ids:    EC2 instance ids named by the triggers (tag change, start) to describe.
+  :param tag_changes:     Dict of EC2 instance id to its full, current tags, from tag change triggers.
+  :param shard:           Shard of the index and EC2 instances, or 'None' if not sharded.
+  :param tagged_at:       Dict of EC2 instance id to the datetime (UTC) of its tag change event (see LatestTagChanges).
+  :return:                Seconds to wait before checking again, or 'None' (see ScheduleOrWait).
+  """
+
+  now = datetime.datetime.now(datetime.UTC)
+
+  with Phase('Scan', shard = shard, full = False) as span:
+
+    # An EC2 instance also named by another trigger (ex: just started) is described regardless.
+    tag_changes = {i: t for i, t in (tag_changes or {}).items() if i not in instance_ids}
+
+    applied, removed, unresolved = EvaluateTagChanges(tag_changes, tagged_at or {}, index, now)
+    resolved = set(tag_changes) - set(unresolved)
+
+    due = {e.InstanceId: e for e in index.Due(now)}
+
+    instance_ids = (set(instance_ids) | set(unresolved) | set(due)) - resolved
+
+    instances = {i.InstanceId: i for i in DescribeInstances(instance_ids)} if instance_ids else {}
 
     LOG.debug(str(instances))
 
     #
-    # Handle expired instances and schedule check based on next instance expected to expire.
+    # Update the index: future expirations are (re)inserted, and missing or untagged instances are removed, as of the
+    # start of the check (the describe reflects at least that). Tag changes resolved from their events are applied as
+    # of the event. Expired instances are (re)inserted as due, and only removed once handled (below), so any not
+    # handled stay due for the next check.
     #
 
-    while i := PopNext(instances):
-      if i.ExpireDateTime <= datetime.datetime.now(datetime.UTC):
-        OnExpiredInstance(i)
+    upserts = applied
+    deletes = removed
+    expired = []
+
+    for instance_id in instance_ids:
+      inst = instances.get(instance_id)
+      if inst is None or inst.ExpireDateTime is None:
+        deletes.append(instance_id)
+      elif inst.ExpireDateTime > now:
+        upserts.append(ExpirationIndexEntry.FromInstance(inst, now))
       else:
-        ScheduleNextCheck(i)
-        break
+        expired.append(inst)
+
+    upserts_due = [ExpirationIndexEntry.FromInstance(i, now) for i in expired if i.InstanceId not in due]
+
+    index.WriteMany(upserts + upserts_due, deletes)
+
+    span.SetAttribute('instances', len(instance_ids))
+    span.SetAttribute('resolved_from_events', len(resolved))
+
+  #
+  # Handle expired instances (soonest first).
+  #
+
+  with TRACER.Span('Select') as span:
+    expired.sort(key = ExpirationPartition.SortKey)
+    span.SetAttribute('instances', len(expired))
+
+  failed = set(OnExpiredInstances(expired, shard))
+
+  index.WriteMany([], [i.InstanceId for i in expired if i.InstanceId not in failed])
+
+  #
+  # Schedule check based on next entry expected to expire. Entries just written are included explicitly, as the
+  # index may not reflect them yet.
+  #
+
+  now = datetime.datetime.now(datetime.UTC)
+
+  candidates = [e for e in upserts + [index.Next(now)] if e is not None and e.ExpireDateTime > now]
+
+  return ScheduleOrWait(min(candidates, key = ExpirationPartition.SortKey) if candidates else None, shard)
+
+
+
+def CheckTriggers(triggers):
+  """
+  Run the checks that cover all the given triggers. Exceptions are raised to the caller.
+
+  When sharded, triggers of the ingest message group (events, the stack's schedules) are forwarded to the shards they
+  concern (see FanOutTriggers), and only the triggers of a shard's own message group are checked (see CheckShard).
+
+  :param triggers:    Trigger objects, in SQS (FIFO) order.
+  """
+
+  if IX_SHARD_COUNT > 1:
+
+    if ingest := [t for t in triggers if t.Shard is None]:
+      with TRACER.Span('FanOut', triggers = len(ingest)):
+        FanOutTriggers(ingest)
+
+    for shard in sorted({t.Shard for t in triggers if t.Shard is not None}):
+      shard_triggers = [t for t in triggers if t.Shard == shard]
+      with TRACER.Span('Check', shard = shard, triggers = len(shard_triggers)):
+        CheckShard(shard_triggers, shard)
+
+  else:
+
+    with TRACER.Span('Check', triggers = len(triggers)):
+      CheckShard(triggers)
+
+
+
+def CheckShard(triggers, shard = None):
+  """
+  Run the one check that covers all the given triggers, of one shard. Exceptions are raised to the caller.
+
+  :param triggers:    Trigger objects, in SQS (FIFO) order.
+  :param shard:       Shard, or 'None' if not sharded.
+  """
+
+  global CHECK_CAUSES, CHECK_CAUSE
+
+  CHECK_CAUSES, CHECK_CAUSE = ActionCauses(triggers), CheckCause(triggers)
+
+  index = ShardIndex(shard)
+
+  #
+  # Full scan for the backup schedule and unrecognized triggers, or if the index has yet to be populated. Otherwise
+  # only inspect EC2 instances named by the triggers (tag change, start, coalesced) or expired according to the index.
+  # Tag changes carry the full, current tags of the EC2 instance, so are evaluated from the event where possible.
+  #
+
+  tag_changes, tagged_at = LatestTagChanges(triggers)
+
+  if not IX_INCREMENTAL_CHECKS:
+    # Changes made meanwhile are not recorded, so the index needs another full scan once incremental checks resume
+    index.MarkUnpopulated()
+    wait = FullCheck(shard = shard)
+  elif not triggers or any(t.Kind in (TriggerKind.RATE, TriggerKind.UNKNOWN) or t.IsFullCheck for t in triggers):
+    wait = FullCheck(index, shard)
+  elif not index.IsPopulated():
+    LOG.info('Expiration index not yet populated; scanning all EC2 instances.')
+    wait = FullCheck(index, shard)
+  else:
+    wait = IncrementalCheck(
+      index,
+      {i for t in triggers for i in t.InstanceIds if i not in t.TagChanges},
+      tag_changes,
+      shard,
+      tagged_at,
+    )
+
+  #
+  # Imminent expirations are waited for and checked within this invocation (see ImminentWait). The index, populated by
+  # now, names the expired EC2 instances; without one, all EC2 instances are scanned again.
+  #
+
+  while wait is not None:
+    with TRACER.Span('Wait', seconds = wait):
+      time.sleep(wait)
+    CHECK_CAUSES, CHECK_CAUSE = {}, 'ImminentWait'
+    wait = IncrementalCheck(index, set(), shard = shard) if IX_INCREMENTAL_CHECKS else FullCheck(shard = shard)
+
+  # Failed direct action schedule writes (left out of the index) are handed off to be checked again right away, rather
+  # than failing the triggers (which would block the message group until redelivered). After a few retries they are left
+  # to the backup check, which reconciles the schedules with the index.
+  if IX_DIRECT_ACTIONS and index.FailedInstanceIds:
+    failed = sorted(index.FailedInstanceIds)
+    retries = max(t.Retries for t in triggers) + 1 if triggers else 1
+    if retries > DIRECT_ACTION_MAX_RETRIES:
+      LOG.error('Failed to write direct action schedules after %d retries, leaving them to the backup check: %s',
+                DIRECT_ACTION_MAX_RETRIES, failed)
+    else:
+      LOG.warning('Failed to write direct action schedules, retrying: %s', failed)
+      HandOff(failed, shard, retries)
+
+
+
+def ActionCauses(triggers):
+  """
+  :param triggers:    Trigger objects of a check.
+  :return:            Dict of EC2 instance id to the cause of the check of the EC2 instance, for each EC2 instance named
+                      by the triggers: 'Tag' (tag change), 'Start' (EC2 instance start), or 'Continuation' (see
+                      HandOff). Coalesced triggers name the EC2 instances of tag change events, unless listed as
+                      started.
+  """
+
+  causes = {}
+
+  for t in triggers:
+    for i in t.InstanceIds:
+      if t.Kind == TriggerKind.START or i in t.StartedInstanceIds:
+        causes.setdefault(i, 'Start')
+      elif t.IsContinuation:
+        causes.setdefault(i, 'Continuation')
+      elif t.Kind in (TriggerKind.TAG, TriggerKind.COALESCED):
+        causes.setdefault(i, 'Tag')
+
+  return causes
+
+
+
+def CheckCause(triggers):
+  """
+  :param triggers:    Trigger objects of a check.
+  :return:            Cause of the check of EC2 instances not named by the triggers (see ActionCauses): 'RateSchedule'
+                      (backup check, or a shard's part of one), 'Other' (unrecognized trigger), or 'NextSchedule'
+                      (expired according to the index or a scan, as any check with a next check schedule finds them).
+  """
+
+  if any(t.Kind == TriggerKind.RATE or t.IsFullCheck for t in triggers):
+    return 'RateSchedule'
+  elif not triggers or any(t.Kind == TriggerKind.UNKNOWN for t in triggers):
+    return 'Other'
+  else:
+    return 'NextSchedule'
+
+
+
+def ShardIndex(shard):
+  """
+  :param shard:       Shard, or 'None' if not sharded.
+  :return:            Expiration index of the shard. With direct actions, writes to it also write schedules.
+  """
+
+  index = DynamoDbExpirationIndex(
+    aws_dynamodb,
+    IX_INDEX_TABLE_NAME,
+    DEFAULT_SHARD if shard is None else shard,
+    IX_SHARD_COUNT,
+    'direct' if IX_DIRECT_ACTIONS else '',
+  )
+
+  if IX_DIRECT_ACTIONS:
+    index = DirectActionIndex(
+      index, aws_scheduler, IX_SCHEDULE_GROUP_NAME, DIRECT_ACTIONS, EXECUTOR, SCHEDULER_WRITES,
+      DIRECT_ACTION_RECONCILE_WRITES,
+    )
+
+  return index
+
+
+
+def FanOutTriggers(triggers):
+  """
+  Forward triggers from the ingest message group to the message groups of the shards they concern, as one coalesced
+  trigger per shard. A full check (backup schedule, unrecognized trigger) or a check of expired EC2 instances (next
+  check schedule) is forwarded to every shard. Exceptions are raised to the caller; forwarding again is harmless.
+
+  :param triggers:    Trigger objects, in SQS (FIFO) order.
+  """
+
+  full_check = any(t.Kind in (TriggerKind.RATE, TriggerKind.UNKNOWN) or t.IsFullCheck for t in triggers)
+  all_shards = full_check or any(t.Kind == TriggerKind.NEXT for t in triggers)
+
+  instance_ids = {s: set() for s in Shards(IX_SHARD_COUNT)}
+  started_ids = {s: set() for s in Shards(IX_SHARD_COUNT)}
+  tag_changes = {s: {} for s in Shards(IX_SHARD_COUNT)}
+  latest_tags, tagged_at = LatestTagChanges(triggers)
+
+  for t in triggers:
+    for i in t.InstanceIds:
+      if i in t.TagChanges:
+        tag_changes[ShardOf(i, IX_SHARD_COUNT)][i] = latest_tags[i]
+      else:
+        instance_ids[ShardOf(i, IX_SHARD_COUNT)].add(i)
+      if t.Kind == TriggerKind.START or i in t.StartedInstanceIds:
+        started_ids[ShardOf(i, IX_SHARD_COUNT)].add(i)
+
+  # An EC2 instance also to be described is not evaluated from its tags (see IncrementalCheck).
+  for s in Shards(IX_SHARD_COUNT):
+    tag_changes[s] = {i: tags for i, tags in tag_changes[s].items() if i not in instance_ids[s]}
+
+  entries = [
+    {
+      'Id': s,
+      'MessageBody': Trigger.CoalescedBody(
+        CFN_STACK_NAME,
+        sorted(instance_ids[s] - started_ids[s]),
+        tag_changes[s],
+        s,
+        full_check,
+        started_ids = sorted(instance_ids[s] & started_ids[s]),
+        tagged_at = {i: tagged_at[i] for i in tag_changes[s] if i in tagged_at},
+      ),
+      'MessageGroupId': ShardMessageGroupId(IX_SQS_MESSAGE_ID, s),
+      'MessageDeduplicationId': uuid.uuid4().hex,
+    }
+    for s in Shards(IX_SHARD_COUNT) if all_shards or instance_ids[s] or tag_changes[s]
+  ]
+
+  LOG.info('Forwarding triggers to %d of %d shards.', len(entries), IX_SHARD_COUNT)
+
+  for batch in Chunks(entries, MAX_SEND_MESSAGE_ENTRIES):
+    rsp = aws_sqs.send_message_batch(QueueUrl = IX_QUEUE_URL, Entries = batch)
+    if rsp.get('Failed'):
+      raise RuntimeError('Failed to forward triggers to shards: {}'.format(rsp['Failed']))
+
+
+
+def CheckTriggersInOrder(triggers):
+  """
+  Check triggers one at a time, in order, stopping at the first failure. As the queue is FIFO, the failed trigger and
+  every trigger after it are redelivered, so an older trigger (ex: a tag change) never overtakes a newer one.
+
+  :param triggers:    Trigger objects, in SQS (FIFO) order.
+  :return:            List of the failed and unchecked triggers.
+  """
+
+  for n, t in enumerate(triggers):
+    try:
+      CheckTriggers([t])
+    except Exception as ex:
+      LOG.exception('Failed to check trigger: %s', t)
+      return triggers[n:]
+
+  return []
+
+
+
+########################################################################################################################
+# Handler
+########################################################################################################################
+
+def handler(event, context):
+  """
+  :return:    SQS partial batch response: the records to redeliver (see CheckTriggersInOrder); all others are deleted.
+  """
+
+  global INVOCATION_DEADLINE
+
+  INVOCATION_DEADLINE = time.monotonic() + context.get_remaining_time_in_millis() / 1000
+
+  Clients.ACCOUNTING.Reset()
+  METRICS.Reset()
+  TRACER.Begin(os.environ.get('_X_AMZN_TRACE_ID'))
+
+  with TRACER.Span('Trigger') as span:
+    triggers = Trigger.FromEvent(event)
+    LogTrigger(event, context, triggers)
+    span.SetAttribute('triggers', len(triggers))
+
+  failed = []
+
+  try:
+
+    try:
+      CheckTriggers(triggers)
+    except Exception as ex:
+      if len(triggers) > 1:
+        LOG.exception('Failed to check %d triggers together; checking one at a time.', len(triggers))
+        failed = CheckTriggersInOrder(triggers)
+      else:
+        LOG.exception('Failed to check trigger.')
+        failed = triggers
 
   except Exception as ex:
 
     LOG.exception("handler()")
+    failed = triggers
+
+  with Phase('Emit', events = len(EVENT_BUFFER)):
+    FlushEventBusEvents()
+
+  LOG.info('API calls: %s', Clients.ACCOUNTING.Summary())
+
+  METRICS.Flush()
+
+  return {'batchItemFailures': [{'itemIdentifier': t.MessageId} for t in failed if t.MessageId is not None]}
+
+
+
+########################################################################################################################
+# SnapStart
+########################################################################################################################
+
+def Prime():
+  """
+  Warm this execution environment before its SnapStart snapshot, so restored environments skip the work: load the
+  service models of all clients, parse the projection of DescribeInstances pages, and run EC2 instance and trigger
+  parsing over synthetic data. No AWS API is called.
+  """
+
+  LOG.info('Priming execution environment before snapshot.')
+
+  for client in Clients.CLIENTS:
+    client.Client
+
+  INSTANCE_PROJECTION_EXPRESSION.search({'Reservations': []})
+
+  now = datetime.datetime.now(datetime.UTC)
+
+  Ec2Instance({
+    'InstanceId': 'i-00000000000000000',
+    'State': {'Name': 'running'},
+    'LaunchTime': now,
+    'Tags': [
+      {'Key': IX_TAG_PREFIX + ':stop-after-duration', 'Value': '1d2h3m4s'},
+      {'Key': IX_TAG_PREFIX + ':terminate-after-datetime', 'Value': now.strftime('%Y-%m-%d %H:%M:%S UTC')},
+    ],
+  })
+
+  Trigger.FromEvent({'Records': [{'messageId': '0', 'body': Trigger.CoalescedBody(CFN_STACK_NAME, ['i-0'])}]})
+
+
+
+def Restore():
+  """
+  Re-initialize this execution environment after a SnapStart restore: clients (and their credentials, which were
+  those of the snapshotted environment) are created anew on first use, and cached state is dropped.
+  """
+
+  Clients.Reset()
+  NEXT_SCHEDULE_CACHE.clear()
+
+
+
+if register_before_snapshot is not None:
+  register_before_snapshot(Prime)
+  register_after_restore(Restore)
 
 
 
@@ -365,7 +1568,7 @@ def LogTriggerSource(name, event = None):
 
 
 
-def LogTrigger(event, context):
+def LogTrigger(event, context, triggers):
 
   try:
 
@@ -376,29 +1579,26 @@ def LogTrigger(event, context):
     LOG.debug('Stop Action: ' + str(IX_STOP_ACTION))
     LOG.debug('Term Action: ' + str(IX_TERM_ACTION))
     LOG.debug('Event Bus Name: ' + str(IX_EVENT_BUS_NAME))
+    LOG.debug('Incremental Checks: ' + str(IX_INCREMENTAL_CHECKS))
+    LOG.debug('Shard Count: ' + str(IX_SHARD_COUNT))
 
-    if not (records := event.get('Records')) or not len(records):
+    if not triggers:
       LogTriggerSource('Unknown', event)
     else:
-      for rec in records:
-        try:
-          body = json.loads(rec['body'])
-          detail_type = body['detail-type']
-          resource = body['resources'][0]
-          if detail_type == 'Tag Change on Resource':
-            LogTriggerSource('EC2 Instance Expiration Tag Change (' + resource + ')')
-          elif detail_type == 'EC2 Instance State-change Notification':
-            LogTriggerSource('EC2 Instance State Change (' + resource + ')')
-          elif detail_type == 'Scheduled Event':
-            if 'NextSchedule' in resource:
-              LogTriggerSource('Next Schedule')
-            elif 'RateSchedule' in resource:
-              LogTriggerSource('Backup Schedule')
-            else:
-              LogTriggerSource('Unknown', event)
-          else:
-            LogTriggerSource('Unknown', event)
-        except Exception as ex:
+      for t in triggers:
+        if t.Kind == TriggerKind.TAG:
+          LogTriggerSource('EC2 Instance Expiration Tag Change (' + t.Resource + ')')
+        elif t.Kind == TriggerKind.START:
+          LogTriggerSource('EC2 Instance State Change (' + t.Resource + ')')
+        elif t.Kind == TriggerKind.NEXT:
+          LogTriggerSource('Next Schedule')
+        elif t.Kind == TriggerKind.RATE:
+          LogTriggerSource('Backup Schedule')
+        elif t.Kind == TriggerKind.COALESCED and t.Shard is not None:
+          LogTriggerSource('Shard ' + t.Shard + ' (' + str(len(t.InstanceIds)) + ' EC2 instances)')
+        elif t.Kind == TriggerKind.COALESCED:
+          LogTriggerSource('Coalesced EC2 Instance Changes (' + str(len(t.InstanceIds)) + ' EC2 instances)')
+        else:
           LogTriggerSource('Unknown', event)
 
   except Exception as ex:
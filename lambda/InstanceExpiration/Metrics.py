@@ -0,0 +1,177 @@
+"""
+Amazon CloudWatch metrics for the Instance Expiration lambda, in Embedded Metric Format (EMF) log records.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+import time
+import json
+import threading
+import contextlib
+
+
+
+########################################################################################################################
+# Globals
+########################################################################################################################
+
+MAX_METRICS = 100                       # Max metrics per EMF record
+MAX_VALUES = 100                        # Max values per metric per EMF record
+
+COUNT = 'Count'
+SECONDS = 'Seconds'
+MILLISECONDS = 'Milliseconds'
+
+
+
+########################################################################################################################
+# Main Class
+########################################################################################################################
+
+class MetricsRecorder:
+  """
+  Collects metrics over an invocation and writes them as EMF records, which CloudWatch Logs turns into metrics without
+  any API call. Counts and timers are summed into one value per invocation; other values (ex: per EC2 instance) are
+  kept individually, so percentiles can be computed over them. Thread-safe.
+  """
+
+  def __init__(self, namespace, enabled = True, counts = ()):
+    """
+    :param namespace:     CloudWatch metrics namespace.
+    :param enabled:       False to record nothing (ex: no dashboard to show the metrics).
+    :param counts:        Names of counts written every invocation, as 0 if nothing was counted.
+    """
+
+    self._namespace = namespace
+    self._enabled = enabled
+    self._counts = tuple(counts)
+    self._lock = threading.Lock()
+
+    self.Reset()
+
+
+
+  def Reset(self):
+    """
+    Drop everything recorded so far.
+    """
+
+    with self._lock:
+      self._metrics = self._Empty()
+
+
+
+  def Count(self, name, value = 1):
+    """
+    Add to a count.
+    """
+
+    self._Add(name, value, COUNT)
+
+
+
+  def Value(self, name, value, unit = SECONDS, **dimensions):
+    """
+    Record one more value of a metric.
+
+    :param dimensions:    Dimension names and values of the metric, if any.
+    """
+
+    if not self._enabled:
+      return
+
+    key = tuple(sorted(dimensions.items()))
+
+    with self._lock:
+      self._metrics.setdefault(key, {}).setdefault(name, (unit, []))[1].append(value)
+
+
+
+  @contextlib.contextmanager
+  def Timer(self, name):
+    """
+    Context manager adding the time spent within it to a duration, in milliseconds.
+    """
+
+    start = time.monotonic()
+
+    try:
+      yield
+    finally:
+      self._Add(name, (time.monotonic() - start) * 1000, MILLISECONDS)
+
+
+
+  def Flush(self, write = print):
+    """
+    Write all that was recorded as EMF records, one per set of dimensions (more should there be too many values), then
+    reset. Values with dimensions are also rolled up: published without dimensions, and by each dimension alone.
+
+    :param write:         Function to write one record (a JSON string) to the log.
+    """
+
+    if not self._enabled:
+      return
+
+    with self._lock:
+      metrics, self._metrics = self._metrics, self._Empty()
+
+    timestamp = int(time.time() * 1000)
+
+    for dimensions, by_name in metrics.items():
+
+      names = [d for d, v in dimensions]
+      rollups = [[]] + [[d] for d in names] + ([names] if len(names) > 1 else []) if names else [[]]
+
+      items = [(name, unit, values) for name, (unit, values) in by_name.items() if values]
+
+      while items:
+
+        batch = items[:MAX_METRICS]
+
+        record = {
+          '_aws': {
+            'Timestamp': timestamp,
+            'CloudWatchMetrics': [{
+              'Namespace': self._namespace,
+              'Dimensions': rollups,
+              'Metrics': [{'Name': name, 'Unit': unit} for name, unit, values in batch],
+            }],
+          },
+          **dict(dimensions),
+        }
+
+        for name, unit, values in batch:
+          record[name] = values[0] if len(values) == 1 else values[:MAX_VALUES]
+
+        write(json.dumps(record))
+
+        items = items[MAX_METRICS:] + [(name, unit, values[MAX_VALUES:]) for name, unit, values in batch
+                                       if len(values) > MAX_VALUES]
+
+
+
+  def _Empty(self):
+    """
+    :return:    (unit, list of values) by metric name, by dimensions (a tuple of name/value pairs); only the counts.
+    """
+
+    return {(): {name: (COUNT, [0]) for name in self._counts}}
+
+
+
+  def _Add(self, name, value, unit):
+
+    if not self._enabled:
+      return
+
+    with self._lock:
+      values = self._metrics[()].setdefault(name, (unit, [0]))[1]
+      values[0] += value
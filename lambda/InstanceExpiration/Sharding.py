@@ -0,0 +1,71 @@
+"""
+Sharding helpers for use by the Instance Expiration lambdas.
+
+With more than one shard, each EC2 instance belongs to one shard by the last (hexadecimal) digit of its id. EC2
+instance ids end in random digits, so shards are about even, and a shard's EC2 instances can be selected by a
+DescribeInstances filter (see ShardFilter). Each shard has its own SQS message group, expiration index partition, and
+next check schedule, so shards are checked in parallel while the checks of any one shard stay serialized.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+HEX_DIGITS = '0123456789abcdef'
+MAX_SHARD_COUNT = len(HEX_DIGITS)       # One shard per last digit, at most
+
+
+
+########################################################################################################################
+# Functions
+########################################################################################################################
+
+def ShardOf(instance_id, shard_count):
+  """
+  :param instance_id:     EC2 instance id.
+  :param shard_count:     Number of shards.
+  :return:                Shard (string, '0' to shard_count - 1).
+  """
+
+  # Not a hexadecimal digit (never so for an actual EC2 instance id): -1, so the last shard.
+  return str(HEX_DIGITS.find(instance_id[-1:].lower()) % shard_count)
+
+
+
+def ShardFilter(shard, shard_count):
+  """
+  :param shard:           Shard.
+  :param shard_count:     Number of shards.
+  :return:                DescribeInstances filter selecting only the EC2 instances of the shard (see ShardOf).
+  """
+
+  return {
+    'Name': 'instance-id',
+    'Values': ['*' + d for d in HEX_DIGITS if ShardOf(d, shard_count) == shard],
+  }
+
+
+
+def Shards(shard_count):
+  """
+  :param shard_count:     Number of shards.
+  :return:                List of all shards (strings).
+  """
+
+  return [str(s) for s in range(shard_count)]
+
+
+
+def ShardMessageGroupId(message_group_id, shard):
+  """
+  :param message_group_id:  SQS message group id of the (unsharded) ingest message group.
+  :param shard:             Shard.
+  :return:                  SQS message group id of the shard.
+  """
+
+  return message_group_id + '-' + shard
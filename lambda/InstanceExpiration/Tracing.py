@@ -0,0 +1,291 @@
+"""
+Lightweight tracing of the phases of the Instance Expiration lambda, as AWS X-Ray subsegments or OpenTelemetry style
+span records, without a tracing SDK in the deployment package.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+import os
+import json
+import time
+import socket
+import secrets
+import logging
+import threading
+import contextlib
+
+
+
+########################################################################################################################
+# Globals
+########################################################################################################################
+
+LOG = logging.getLogger()
+
+# Header of every document sent to the X-Ray daemon.
+XRAY_HEADER = '{"format": "json", "version": 1}\n'
+
+# Default X-Ray daemon address, as set by AWS Lambda when active tracing is on.
+XRAY_DAEMON_ADDRESS = '127.0.0.1:2000'
+
+
+
+########################################################################################################################
+# Functions
+########################################################################################################################
+
+def NewTraceId():
+  """
+  :return:    New X-Ray trace id (ex: '1-5759e988-bd862e3fe1be46a994272793').
+  """
+
+  return '1-' + format(int(time.time()), '08x') + '-' + secrets.token_hex(12)
+
+
+
+def ParseTraceHeader(header):
+  """
+  :param header:    X-Ray trace header (ex: the '_X_AMZN_TRACE_ID' environment variable of an AWS Lambda invocation:
+                    'Root=1-...;Parent=...;Sampled=1'), or 'None'.
+  :return:          Tuple of (trace id, parent id, sampled); a new trace id, no parent, and sampled if no header.
+  """
+
+  fields = dict(f.split('=', 1) for f in (header or '').split(';') if '=' in f)
+
+  return fields.get('Root') or NewTraceId(), fields.get('Parent'), fields.get('Sampled', '1') != '0'
+
+
+
+########################################################################################################################
+# Classes
+########################################################################################################################
+
+class Span:
+  """
+  One timed phase, with attributes (ex: EC2 instance and API call counts).
+  """
+
+  def __init__(self, name, trace_id, parent_id, attributes):
+
+    self.Name = name
+    self.Id = secrets.token_hex(8)
+    self.TraceId = trace_id
+    self.ParentId = parent_id
+    self.Attributes = dict(attributes)
+    self.Error = False
+    self.Start = time.time()
+    self.End = None
+
+
+
+  def SetAttribute(self, name, value):
+
+    self.Attributes[name] = value
+
+
+
+  def ToXRay(self):
+    """
+    :return:    X-Ray subsegment document.
+    """
+
+    doc = {
+      'type': 'subsegment',
+      'name': self.Name,
+      'id': self.Id,
+      'trace_id': self.TraceId,
+      'start_time': self.Start,
+      'end_time': self.End,
+      'metadata': {'default': self.Attributes},
+    }
+
+    if self.ParentId:
+      doc['parent_id'] = self.ParentId
+    if self.Error:
+      doc['fault'] = True
+
+    return doc
+
+
+
+  def ToOpenTelemetry(self):
+    """
+    :return:    Span record in the shape of the OpenTelemetry SDK's JSON span export (ids in hex, times in ISO 8601).
+    """
+
+    def Iso(t):
+      return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(t)) + f'.{int(t % 1 * 1e6):06d}Z'
+
+    return {
+      'name': self.Name,
+      'context': {
+        'trace_id': '0x' + self.TraceId.replace('1-', '', 1).replace('-', ''),
+        'span_id': '0x' + self.Id,
+      },
+      'parent_id': ('0x' + self.ParentId) if self.ParentId else None,
+      'start_time': Iso(self.Start),
+      'end_time': Iso(self.End),
+      'duration_ms': round((self.End - self.Start) * 1000, 3),
+      'status': {'status_code': 'ERROR' if self.Error else 'UNSET'},
+      'attributes': self.Attributes,
+    }
+
+
+
+class NoSpan:
+  """
+  Stands in for a Span when tracing is disabled (or the trace is not sampled).
+  """
+
+  def SetAttribute(self, name, value):
+    pass
+
+
+
+NO_SPAN = NoSpan()
+
+
+
+class XRayDaemonExporter:
+  """
+  Sends each span to the X-Ray daemon as a subsegment of the AWS Lambda invocation's segment (over UDP, as the X-Ray
+  SDKs do). Sending never fails the caller.
+  """
+
+  def __init__(self, address = None):
+    """
+    :param address:     Daemon address ('host:port', or 'tcp:host:port udp:host:port'), by default from the
+                        'AWS_XRAY_DAEMON_ADDRESS' environment variable.
+    """
+
+    address = address or os.environ.get('AWS_XRAY_DAEMON_ADDRESS') or XRAY_DAEMON_ADDRESS
+    address = next((a[4:] for a in address.split() if a.startswith('udp:')), address.split()[0])
+
+    host, port = address.rsplit(':', 1)
+
+    self._address = (host, int(port))
+    self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+
+
+  def Export(self, span):
+
+    try:
+      self._socket.sendto((XRAY_HEADER + json.dumps(span.ToXRay(), default = str)).encode(), self._address)
+    except Exception as ex:
+      LOG.debug('Failed to send span to X-Ray daemon: %s', ex)
+
+
+
+class FileExporter:
+  """
+  Appends each span to a file, one OpenTelemetry style JSON record per line (ex: for the offline benchmark).
+  """
+
+  def __init__(self, path):
+
+    self._path = path
+    self._lock = threading.Lock()
+
+
+
+  def Export(self, span):
+
+    line = json.dumps(span.ToOpenTelemetry(), default = str)
+
+    with self._lock:
+      with open(self._path, 'a') as f:
+        f.write(line + '\n')
+
+
+
+########################################################################################################################
+# Main Class
+########################################################################################################################
+
+class Tracer:
+  """
+  Creates nested spans (per thread) and hands each, once ended, to an exporter. Without an exporter, spans cost next
+  to nothing and go nowhere.
+  """
+
+  @property
+  def Enabled(self):
+    return self._exporter is not None
+
+
+
+  def __init__(self, exporter = None, calls = None):
+    """
+    :param exporter:    Object with an Export(span) method, or 'None' to disable tracing.
+    :param calls:       Function returning the number of API calls made so far, to set the 'api_calls' attribute of
+                        each span; 'None' to not count.
+    """
+
+    self.Configure(exporter, calls)
+
+
+
+  def Configure(self, exporter, calls = None):
+    """
+    Replace the exporter (and API call counter). See __init__.
+    """
+
+    self._exporter = exporter
+    self._calls = calls
+    self._local = threading.local()
+
+    self.Begin(None)
+
+
+
+  def Begin(self, trace_header):
+    """
+    Start a trace for an invocation: spans are children of the trace header's parent (ex: the invocation's segment).
+
+    :param trace_header:    X-Ray trace header, or 'None' for a new trace (see ParseTraceHeader).
+    """
+
+    self._trace_id, self._root_id, self._sampled = ParseTraceHeader(trace_header)
+
+
+
+  @contextlib.contextmanager
+  def Span(self, name, **attributes):
+    """
+    Context manager timing a phase, as a child of the current thread's innermost span.
+
+    :param name:            Span name (ex: 'Verify').
+    :param attributes:      Initial attributes (ex: instances = 100).
+    :return:                The Span, to set more attributes on; NO_SPAN if tracing is disabled.
+    """
+
+    if self._exporter is None or not self._sampled:
+      yield NO_SPAN
+      return
+
+    stack = self._local.__dict__.setdefault('stack', [])
+
+    span = Span(name, self._trace_id, stack[-1].Id if stack else self._root_id, attributes)
+    calls = self._calls() if self._calls else None
+
+    stack.append(span)
+
+    try:
+      yield span
+    except BaseException:
+      span.Error = True
+      raise
+    finally:
+      stack.pop()
+      span.End = time.time()
+      if calls is not None:
+        span.SetAttribute('api_calls', self._calls() - calls)
+      self._exporter.Export(span)
@@ -0,0 +1,303 @@
+"""
+Lambda trigger (SQS record) class for use by the Instance Expiration lambda.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+import json
+import logging
+import datetime
+
+from TriggerKind import TriggerKind
+
+
+
+########################################################################################################################
+# Globals
+########################################################################################################################
+
+# Logging
+LOG = logging.getLogger()
+
+EVENT_TIME_FMT = '%Y-%m-%dT%H:%M:%SZ'   # Format of the 'time' of EventBridge events
+
+
+
+########################################################################################################################
+# Main Class
+########################################################################################################################
+
+class Trigger:
+  """
+  Concise representation of a single SQS record that triggered the Instance Expiration Lambda.
+  """
+
+  COALESCED_DETAIL_TYPE = 'Coalesced Triggers'      # See the Coalesce lambda
+
+  @property
+  def MessageId(self):
+    return self._message_id
+
+  @property
+  def Kind(self):
+    return self._kind
+
+  @property
+  def Resource(self):
+    return self._resource
+
+  @property
+  def InstanceId(self):
+    return self._instance_id
+
+  @property
+  def InstanceIds(self):
+    return self._instance_ids
+
+  @property
+  def Body(self):
+    return self._body
+
+  @property
+  def Tags(self):
+    return self._tags
+
+  @property
+  def TagChanges(self):
+    return self._tag_changes
+
+  @property
+  def TaggedAt(self):
+    return self._tagged_at
+
+  @property
+  def Shard(self):
+    return self._shard
+
+  @property
+  def IsFullCheck(self):
+    return self._full_check
+
+  @property
+  def StartedInstanceIds(self):
+    return self._started_ids
+
+  @property
+  def IsContinuation(self):
+    return self._continuation
+
+  @property
+  def Retries(self):
+    return self._retries
+
+
+
+  def __init__(self, record):
+    """
+    Construct from an SQS record of a Lambda event.
+
+    :param record:    SQS record (dict) from the 'Records' list of a Lambda event.
+    """
+
+    self._message_id = record.get('messageId')
+    self._kind = TriggerKind.UNKNOWN
+    self._resource = None
+    self._instance_id = None
+    self._instance_ids = []
+    self._body = None
+    self._tags = None
+    self._tag_changes = {}
+    self._tagged_at = {}
+    self._shard = None
+    self._full_check = False
+    self._started_ids = set()
+    self._continuation = False
+    self._retries = 0
+
+    try:
+
+      self._body = json.loads(record['body'])
+      detail_type = self._body['detail-type']
+      self._resource = self._body['resources'][0]
+
+      if detail_type == 'Tag Change on Resource':
+        self._kind = TriggerKind.TAG
+        self._instance_id = self.InstanceIdFromArn(self._resource)
+        self._tags = self.TagsFromDetail(self._body.get('detail'))
+      elif detail_type == 'EC2 Instance State-change Notification':
+        self._kind = TriggerKind.START
+        self._instance_id = self.InstanceIdFromArn(self._resource)
+      elif detail_type == 'Scheduled Event':
+        if 'NextSchedule' in self._resource:
+          self._kind = TriggerKind.NEXT
+        elif 'RateSchedule' in self._resource:
+          self._kind = TriggerKind.RATE
+      elif detail_type == self.COALESCED_DETAIL_TYPE:
+        detail = self._body['detail']
+        self._tag_changes = {str(i): t for i, t in (detail.get('tag-changes') or {}).items()}
+        self._tagged_at = {str(i): self.EventTime(t) for i, t in (detail.get('tagged-at') or {}).items()}
+        self._started_ids = {str(i) for i in detail.get('started-ids', [])}
+        self._instance_ids = [str(i) for i in detail.get('instance-ids', [])] + sorted(self._started_ids) + \
+                             list(self._tag_changes)
+        self._shard = detail.get('shard')
+        self._full_check = bool(detail.get('full-check'))
+        self._continuation = bool(detail.get('continuation'))
+        self._retries = int(detail.get('retries', 0))
+        self._kind = TriggerKind.COALESCED
+
+      if self._instance_id is not None:
+        self._instance_ids = [self._instance_id]
+
+      if self._tags is not None and self._instance_id is not None:
+        self._tag_changes = {self._instance_id: self._tags}
+        self._tagged_at = {self._instance_id: self.EventTime(self._body.get('time'))}
+
+      self._tagged_at = {i: t for i, t in self._tagged_at.items() if i in self._tag_changes and t is not None}
+
+    except Exception as ex:
+
+      LOG.debug('Unrecognized SQS record: %s', record)
+      self._kind = TriggerKind.UNKNOWN
+      self._instance_ids = []
+      self._tag_changes = {}
+      self._tagged_at = {}
+      self._shard = None
+      self._full_check = False
+      self._started_ids = set()
+      self._continuation = False
+      self._retries = 0
+
+
+
+  @property
+  def IsInstanceScoped(self):
+    """
+    :return:    True if this trigger concerns a single, known EC2 instance; else False.
+    """
+
+    return self._kind in (TriggerKind.TAG, TriggerKind.START) and self._instance_id is not None
+
+
+
+  @staticmethod
+  def InstanceIdFromArn(arn):
+    """
+    Get the EC2 instance id from an EC2 instance ARN (ex: arn:aws:ec2:us-east-1:111122223333:instance/i-0123456789).
+
+    :param arn:         EC2 instance ARN.
+    :return:            EC2 instance id, or 'None' if not an EC2 instance ARN.
+    """
+
+    resource = arn.split(':')[-1]
+
+    if resource.startswith('instance/'):
+      return resource.split('/')[-1]
+    else:
+      return None
+
+
+
+  @staticmethod
+  def TagsFromDetail(detail):
+    """
+    Get the full, current set of tags of the resource from the detail of a 'Tag Change on Resource' event.
+
+    :param detail:      Event detail (dict).
+    :return:            Dict of tag name to tag value, or 'None' if the detail carries no tags.
+    """
+
+    tags = (detail or {}).get('tags')
+
+    if isinstance(tags, dict) and all(isinstance(v, str) for v in tags.values()):
+      return tags
+    else:
+      return None
+
+
+
+  @staticmethod
+  def EventTime(value):
+    """
+    :param value:       'time' of an EventBridge event (ex: 2024-02-03T18:43:48Z).
+    :return:            Datetime (UTC), or 'None' if missing or malformed.
+    """
+
+    try:
+      return datetime.datetime.strptime(value, EVENT_TIME_FMT).replace(tzinfo = datetime.UTC)
+    except (TypeError, ValueError):
+      return None
+
+
+
+  @staticmethod
+  def CoalescedBody(source, instance_ids = (), tag_changes = None, shard = None, full_check = False, started_ids = (),
+                    continuation = False, retries = 0, tagged_at = None):
+    """
+    Build the body of a coalesced trigger message, naming several EC2 instances (see the Coalesce lambda), or the work
+    of one shard (see the Instance Expiration lambda).
+
+    :param source:        Resource (ARN or name) sending the message.
+    :param instance_ids:  EC2 instance ids to check (by describing them).
+    :param tag_changes:   Dict of EC2 instance id to its full, current tags, for other EC2 instances that can be
+                          evaluated from their tags. Only send where message order is preserved (FIFO).
+    :param shard:         Shard the message is for, or 'None' if not sharded.
+    :param full_check:    True to check all EC2 instances (of the shard).
+    :param started_ids:   EC2 instance ids to check, named by EC2 instance start events (rather than tag changes).
+    :param continuation:  True if the EC2 instances were handed off by an earlier check (see HandOff).
+    :param retries:       Number of earlier checks that failed to handle the EC2 instances (ex: direct action schedule
+                          writes), when handed off to be retried.
+    :param tagged_at:     Dict of EC2 instance id to the datetime (UTC) of its tag change event, for the tag changes.
+    :return:              Message body (string).
+    """
+
+    detail = {'instance-ids': list(instance_ids)}
+
+    if started_ids:
+      detail['started-ids'] = list(started_ids)
+    if tag_changes:
+      detail['tag-changes'] = tag_changes
+    if tagged_at:
+      detail['tagged-at'] = {i: t.strftime(EVENT_TIME_FMT) for i, t in tagged_at.items()}
+    if shard is not None:
+      detail['shard'] = shard
+    if full_check:
+      detail['full-check'] = True
+    if continuation:
+      detail['continuation'] = True
+    if retries:
+      detail['retries'] = retries
+
+    return json.dumps({
+      'detail-type': Trigger.COALESCED_DETAIL_TYPE,
+      'resources': [source],
+      'detail': detail,
+    })
+
+
+
+  @staticmethod
+  def FromEvent(event):
+    """
+    Parse all SQS records of a Lambda event.
+
+    :param event:       Lambda event.
+    :return:            List of Trigger objects (empty if the event has no SQS records).
+    """
+
+    return [Trigger(rec) for rec in (event.get('Records') or [])]
+
+
+
+  def __repr__(self):
+    """
+    :return:            Developer friendly string representation of this object.
+    """
+
+    return repr((str(self._kind), self._resource))
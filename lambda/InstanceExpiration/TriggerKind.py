@@ -0,0 +1,34 @@
+"""
+Helper class for the Instance Expiration lambda.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+import enum
+
+
+
+########################################################################################################################
+# Main Class
+########################################################################################################################
+
+class TriggerKind(enum.Enum):
+
+  """ Enum for the possible sources of a Lambda trigger (SQS record). """
+
+  TAG = 1
+  START = 2
+  NEXT = 3
+  RATE = 4
+  UNKNOWN = 5
+  COALESCED = 6
+
+  def __str__(self):
+    return self.name
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark of the Instance Expiration lambda's cold start: module import plus the first invocation (a backup check of
+an empty fleet, against local botocore Stubbers), each in a fresh Python process.
+
+Usage (from the project root):
+
+    python tests/benchmark/bench_cold_start.py [--runs N]
+
+The 'eager' case creates every boto3 client at import, as the Lambda did before its clients were created on first use
+(see Clients.LazyClient); the 'lazy' case is the Lambda as is.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import statistics
+import subprocess
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lambda', 'InstanceExpiration')
+
+# Backup check trigger
+EVENT = {
+  'Records': [{
+    'messageId': '1',
+    'body': json.dumps({
+      'detail-type': 'Scheduled Event',
+      'resources': ['arn:aws:scheduler:us-east-1:123456789012:schedule/default/InstanceExpiration-RateSchedule'],
+    }),
+  }],
+}
+
+
+
+########################################################################################################################
+# Functions
+########################################################################################################################
+
+def Child(eager):
+  """
+  Measure one cold start, in this (fresh) process, and print it as JSON.
+
+  :param eager:   True to create every boto3 client at import.
+  """
+
+  sys.path.insert(0, LAMBDA_DIR)
+
+  t0 = time.perf_counter()
+
+  import Lambda
+  from Clients import LazyClient
+
+  if eager:
+    for client in vars(Lambda).values():
+      if isinstance(client, LazyClient):
+        client.Client
+
+  t1 = time.perf_counter()
+
+  from botocore.stub import Stubber
+
+  stubbers = [Stubber(Lambda.aws_ec2.Client), Stubber(Lambda.aws_dynamodb.Client)]
+  stubbers[0].add_response('describe_instances', {'Reservations': []})
+  stubbers[1].add_response('delete_item', {})
+
+  for stubber in stubbers:
+    stubber.activate()
+
+  context = types.SimpleNamespace(
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:InstanceExpiration',
+    aws_request_id = 'cold-start',
+    get_remaining_time_in_millis = lambda: 600000,
+  )
+
+  Lambda.handler(EVENT, context)
+
+  t2 = time.perf_counter()
+
+  for stubber in stubbers:
+    stubber.assert_no_pending_responses()
+
+  print(json.dumps({'import': t1 - t0, 'invoke': t2 - t1}))
+
+
+
+def Measure(eager, runs):
+  """
+  :return:    List of per-run dicts of seconds spent importing and on the first invocation.
+  """
+
+  # The simulator's Lambda environment, with incremental checks disabled so the first invocation only calls EC2
+  # DescribeInstances (and DynamoDB DeleteItem, to mark the index unpopulated). Imported here, not at the top, so the
+  # child processes do not import boto3 ahead of the Lambda.
+  from fleet_simulator import ENVIRONMENT
+
+  results = []
+
+  for n in range(runs):
+    out = subprocess.run(
+      [sys.executable, os.path.abspath(__file__), '--child'] + (['--eager'] if eager else []),
+      env = dict(os.environ, **dict(ENVIRONMENT, IX_INCREMENTAL_CHECKS = 'Disable')),
+      check = True,
+      capture_output = True,
+      text = True,
+    )
+    results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+  return results
+
+
+
+########################################################################################################################
+# Main Script
+########################################################################################################################
+
+def main():
+
+  parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+  parser.add_argument('--runs', type = int, default = 10, help = 'Cold starts per case.')
+  parser.add_argument('--child', action = 'store_true', help = argparse.SUPPRESS)
+  parser.add_argument('--eager', action = 'store_true', help = argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.child:
+    Child(args.eager)
+    return
+
+  print(f"{'case':<8} {'import (ms)':>12} {'invoke (ms)':>12} {'total (ms)':>12}")
+
+  for name, eager in (('eager', True), ('lazy', False)):
+    results = Measure(eager, args.runs)
+    imp = statistics.median(r['import'] for r in results) * 1e3
+    inv = statistics.median(r['invoke'] for r in results) * 1e3
+    tot = statistics.median(r['import'] + r['invoke'] for r in results) * 1e3
+    print(f'{name:<8} {imp:>12.1f} {inv:>12.1f} {tot:>12.1f}')
+
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""
+Microbenchmark of the per-instance cost of parsing a boto3 EC2.Instance into an Ec2Instance.
+
+Usage (from the project root):
+
+    python tests/benchmark/bench_ec2_instance.py [--count N]
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+import os
+import sys
+import timeit
+import argparse
+import datetime
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lambda', 'InstanceExpiration')
+
+sys.path.insert(0, LAMBDA_DIR)
+os.environ.setdefault('IX_TAG_PREFIX', 'expiration')
+
+from Ec2Instance import Ec2Instance
+
+
+
+########################################################################################################################
+# Functions
+########################################################################################################################
+
+def SyntheticInstance(other_tags, expiration_tags):
+  """
+  :param other_tags:        Number of unrelated tags.
+  :param expiration_tags:   Dict of expiration tag postfix to value.
+  :return:                  Boto3 EC2.Instance-like dict.
+  """
+
+  prefix = os.environ['IX_TAG_PREFIX']
+
+  tags = [{'Key': f'team:tag-{i}', 'Value': f'value-{i}'} for i in range(other_tags)]
+  tags += [{'Key': f'{prefix}:{k}', 'Value': v} for k, v in expiration_tags.items()]
+
+  return {
+    'InstanceId': 'i-0123456789abcdef0',
+    'State': {'Name': 'running'},
+    'LaunchTime': datetime.datetime(2024, 2, 3, 18, 43, 48, tzinfo = datetime.UTC),
+    'Tags': tags,
+  }
+
+
+
+def Measure(instance, count):
+  """
+  :return:    Microseconds per Ec2Instance construction (best of 5 runs).
+  """
+
+  return min(timeit.repeat(lambda: Ec2Instance(instance), number = count, repeat = 5)) / count * 1e6
+
+
+
+########################################################################################################################
+# Main Script
+########################################################################################################################
+
+def main():
+
+  parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+  parser.add_argument('--count', type = int, default = 20000, help = 'Constructions per run.')
+  args = parser.parse_args()
+
+  cases = {
+    'duration, 5 tags':             (5,  {'stop-after-duration': '1d2h3m4s'}),
+    'duration, 50 tags':            (50, {'stop-after-duration': '1d2h3m4s'}),
+    'datetime, 50 tags':            (50, {'terminate-after-datetime': '2030-01-02 03:04:05 UTC'}),
+    'all four expiration, 50 tags': (50, {
+      'stop-after-duration': '10d',
+      'stop-after-datetime': '2030-01-02 03:04:05 UTC',
+      'terminate-after-duration': '20d',
+      'terminate-after-datetime': '2031-01-02 03:04:05 UTC',
+    }),
+  }
+
+  print(f'{"Case":<32} {"us/instance":>12}')
+
+  for name, (other_tags, expiration_tags) in cases.items():
+    print(f'{name:<32} {Measure(SyntheticInstance(other_tags, expiration_tags), args.count):>12.2f}')
+
+
+
+########################################################################################################################
+# See: https://docs.python.org/3/library/__main__.html#idiomatic-usage
+########################################################################################################################
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+"""
+End-to-end benchmark of the Instance Expiration lambda's handler against synthetic fleets (see fleet_simulator).
+
+Usage (from the project root):
+
+    python tests/benchmark/bench_handler.py [--sizes 1000,10000,100000,500000] [--retag 0.01] [--shards 1]
+                                            [--incremental Enable|Disable] [--trace DIR]
+
+Each fleet size runs in a fresh Python process, through these steps:
+
+  scan      Backup check: full scan of the fleet, populating the expiration index and acting on expired instances.
+  next      Next check: incremental check of whatever the index says is due.
+  retag     Mass expiration: a fraction of the tagged instances is retagged to expire now, and named in coalesced
+            messages (as sent by the coalescing Lambda), then checked.
+  drain     Messages the Lambda sent to its own queue (hand-offs, shard fan-out), delivered until none are left.
+
+Reported per step: wall time, API calls by service and operation, and the peak RSS of the process so far (the fleet
+itself is part of it; see the 'fleet' row).
+
+With --trace, the Lambda's phase spans (see Tracing) are written to DIR/spans-<size>.jsonl, one OpenTelemetry style
+record per line, and the total time and API calls of each phase are reported.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import subprocess
+import collections
+
+from fleet_simulator import Fleet, Simulation, NEXT_SCHEDULE_NAME, RATE_SCHEDULE_NAME
+
+
+
+########################################################################################################################
+# Functions
+########################################################################################################################
+
+def PeakRssMb():
+  """
+  :return:    Peak resident set size of this process so far, in MB.
+  """
+
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+
+def Child(size, retag, shards, incremental, trace):
+  """
+  Run all steps for one fleet size, in this (fresh) process, printing one JSON line per step.
+  """
+
+  logging.disable(logging.CRITICAL)
+
+  Simulation.Environment(IX_SHARD_COUNT = str(shards), IX_INCREMENTAL_CHECKS = incremental)
+
+  import Lambda
+  from Trigger import Trigger
+  from Tracing import FileExporter
+
+  t0 = time.perf_counter()
+  fleet = Fleet(size)
+  Report('fleet', time.perf_counter() - t0, collections.Counter())
+
+  sim = Simulation(fleet)
+  sim.Install(Lambda)
+
+  if trace:
+    Lambda.TRACER.Configure(FileExporter(SpansPath(trace, size)), calls = lambda: sum(sim.Calls.values()))
+
+  def Step(name, fn):
+    before = collections.Counter(sim.Calls)
+    t = time.perf_counter()
+    fn()
+    Report(name, time.perf_counter() - t, sim.Calls - before)
+
+  Step('scan', lambda: sim.Invoke([sim.ScheduledEvent(RATE_SCHEDULE_NAME)]))
+  Step('next', lambda: sim.Invoke([sim.ScheduledEvent(NEXT_SCHEDULE_NAME)]))
+
+  tagged = sorted(fleet.TagKeyMatches(fleet.Prefix + ':*'))
+  targets = tagged[::max(1, round(1 / retag))] if retag > 0 else []
+  fleet.ExpireNow(targets)
+
+  bodies = [Trigger.CoalescedBody('bench', targets[n:n + 4000]) for n in range(0, len(targets), 4000)]
+
+  Step('retag', lambda: [sim.Invoke(bodies[n:n + 10]) for n in range(0, len(bodies), 10)])
+  Step('drain', sim.Drain)
+
+
+
+def SpansPath(trace, size):
+
+  return os.path.join(trace, f'spans-{size}.jsonl')
+
+
+
+def ReportSpans(path):
+  """
+  Print the count, total time and API calls of each span name (phase) in a spans file, most time consuming first.
+  Nested spans are included in their parents' time.
+  """
+
+  totals = collections.defaultdict(lambda: [0, 0.0, 0])
+
+  with open(path) as f:
+    for line in f:
+      span = json.loads(line)
+      t = totals[span['name']]
+      t[0] += 1
+      t[1] += span['duration_ms'] / 1000
+      t[2] += span['attributes'].get('api_calls', 0)
+
+  for name, (count, seconds, calls) in sorted(totals.items(), key = lambda kv: kv[1][1], reverse = True):
+    print(f"{'':>8} {name:<10} {seconds:>9.2f} {count:>8} span(s) {calls:>8} API call(s)")
+
+
+
+def Report(step, seconds, calls):
+
+  print(json.dumps({'step': step, 'seconds': seconds, 'calls': dict(calls), 'rss': PeakRssMb()}), flush = True)
+
+
+
+def Run(size, args):
+  """
+  :return:    List of per-step dicts, from a child process.
+  """
+
+  out = subprocess.run(
+    [sys.executable, os.path.abspath(__file__), '--child', '--sizes', str(size), '--retag', str(args.retag),
+     '--shards', str(args.shards), '--incremental', args.incremental]
+    + (['--trace', args.trace] if args.trace else []),
+    check = True,
+    capture_output = True,
+    text = True,
+  )
+
+  return [json.loads(line) for line in out.stdout.splitlines() if line.startswith('{')]
+
+
+
+########################################################################################################################
+# Main Script
+########################################################################################################################
+
+def main():
+
+  parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+  parser.add_argument('--sizes', default = '1000,10000,100000', help = 'Comma separated fleet sizes.')
+  parser.add_argument('--retag', type = float, default = 0.01, help = 'Fraction of tagged instances to expire.')
+  parser.add_argument('--shards', type = int, default = 1, help = 'ShardCount.')
+  parser.add_argument('--incremental', default = 'Enable', choices = ['Enable', 'Disable'], help = 'IncrementalChecks.')
+  parser.add_argument('--trace', help = 'Directory to write the spans of each fleet size to.')
+  parser.add_argument('--child', action = 'store_true', help = argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  sizes = [int(s) for s in args.sizes.split(',')]
+
+  if args.child:
+    Child(sizes[0], args.retag, args.shards, args.incremental, args.trace)
+    return
+
+  print(f"{'size':>8} {'step':<6} {'wall (s)':>9} {'peak RSS (MB)':>14}  API calls")
+
+  if args.trace:
+    os.makedirs(args.trace, exist_ok = True)
+
+  for size in sizes:
+
+    if args.trace and os.path.exists(SpansPath(args.trace, size)):
+      os.remove(SpansPath(args.trace, size))
+
+    for r in Run(size, args):
+      calls = ', '.join(f'{k}={v}' for k, v in sorted(r['calls'].items()))
+      print(f"{size:>8} {r['step']:<6} {r['seconds']:>9.2f} {r['rss']:>14.1f}  {calls}")
+
+    if args.trace:
+      ReportSpans(SpansPath(args.trace, size))
+
+
+
+if __name__ == '__main__':
+  main()
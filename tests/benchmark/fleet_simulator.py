@@ -0,0 +1,786 @@
+"""
+Offline fleet simulator for the Instance Expiration lambda: a synthetic fleet of EC2 instances, and simulated AWS
+services (EC2, EventBridge Scheduler, SSM, EventBridge, SQS, DynamoDB) that serve the fleet and count API calls. The
+Lambda's handler runs end-to-end against real boto3 clients, answered by the simulated services through the clients'
+event hooks, with no network access: requests and responses are validated against the service models, and errors are
+raised as the clients' modeled exceptions.
+
+The simulated services implement only the calls and behavior the Lambda relies upon. EC2 mutating call rate limits are
+lifted (see Simulation.Install), so actions take no simulated time.
+"""
+
+# Copyright Amazon.com, Inc. and its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+
+
+########################################################################################################################
+# Imports
+########################################################################################################################
+
+import os
+import re
+import sys
+import copy
+import json
+import uuid
+import types
+import random
+import fnmatch
+import hashlib
+import datetime
+import threading
+import collections
+
+import boto3
+from botocore.awsrequest import AWSResponse
+from botocore.validate import validate_parameters
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lambda', 'InstanceExpiration')
+
+
+
+########################################################################################################################
+# Globals
+########################################################################################################################
+
+# Lambda environment, as set by the stack (see Stack.py)
+ENVIRONMENT = {
+  'AWS_DEFAULT_REGION': 'us-east-1',
+  'AWS_ACCESS_KEY_ID': 'testing',
+  'AWS_SECRET_ACCESS_KEY': 'testing',
+  'CFN_STACK_NAME': 'InstanceExpiration',
+  'IX_TAG_PREFIX': 'expiration',
+  'IX_STOP_ACTION': 'Enable',
+  'IX_TERM_ACTION': 'Enable',
+  'IX_EVENT_BUS_NAME': 'default',
+  'IX_SSM_PARAM_NEXT_SCHEDULE_ARN': '/InstanceExpiration/NextScheduleArn',
+  'IX_INCREMENTAL_CHECKS': 'Enable',
+  'IX_INDEX_TABLE_NAME': 'ExpirationIndex',
+  'IX_ACTION_CONCURRENCY': '4',
+  'IX_ACTION_RATE_SHARE': '50',
+  'IX_SHARD_COUNT': '1',
+  'IX_CHECK_GRACE_WINDOW': '0',
+  'IX_IMMINENT_WAIT': '0',
+  'IX_SQS_MESSAGE_ID': 'InstanceExpiration',
+  'IX_QUEUE_URL': 'https://sqs.us-east-1.amazonaws.com/123456789012/InstanceExpiration.fifo',
+  'IX_SCHEDULE_GROUP_NAME': 'InstanceExpiration',
+  'IX_DIRECT_ACTIONS': 'Disable',
+  'IX_DIRECT_STOP_ROLE_ARN': '',
+  'IX_DIRECT_TERM_ROLE_ARN': '',
+  'IX_METRICS': 'Disable',
+  'IX_TRACING': 'Disable',
+}
+
+ACCOUNT_ARN = 'arn:aws:scheduler:us-east-1:123456789012'
+NEXT_SCHEDULE_NAME = 'InstanceExpiration-NextSchedule'
+RATE_SCHEDULE_NAME = 'InstanceExpiration-RateSchedule'
+
+DESCRIBE_MAX_RESULTS = 1000             # Max instances per DescribeInstances page
+QUERY_PAGE_ITEMS = 5000                 # About 1 MB of expiration index items per DynamoDB Query page
+TAG_DATETIME_FMT = '%Y-%m-%d %H:%M:%S UTC'
+
+# Session the simulated services' clients are created from: never sends a request, but needs a region and credentials.
+SESSION = boto3.session.Session(
+  region_name = ENVIRONMENT['AWS_DEFAULT_REGION'],
+  aws_access_key_id = ENVIRONMENT['AWS_ACCESS_KEY_ID'],
+  aws_secret_access_key = ENVIRONMENT['AWS_SECRET_ACCESS_KEY'],
+)
+
+# Words DynamoDB rejects as attribute names in expressions, unless aliased (see the DynamoDB Developer Guide).
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dynamodb_reserved_words.txt')) as f:
+  DYNAMODB_RESERVED_WORDS = frozenset(f.read().split())
+
+
+
+########################################################################################################################
+# Fleet
+########################################################################################################################
+
+class Fleet:
+  """
+  Synthetic fleet of EC2 instances, as boto3 EC2.Instance dicts.
+  """
+
+  def __init__(self, size, tagged = 0.5, terminate = 0.3, duration = 0.5, expired = 0.01, malformed = 0.01,
+               stopped = 0.2, horizon = 24, other_tags = 5, prefix = 'expiration', seed = 0):
+    """
+    :param size:          Number of EC2 instances.
+    :param tagged:        Fraction of EC2 instances with an expiration tag.
+    :param terminate:     Fraction of tagged EC2 instances to terminate (the rest are stopped).
+    :param duration:      Fraction of tagged EC2 instances with a duration tag (the rest have a date/time tag).
+    :param expired:       Fraction of tagged EC2 instances already expired.
+    :param malformed:     Fraction of tagged EC2 instances whose tag value does not parse.
+    :param stopped:       Fraction of EC2 instances stopped (the rest are running).
+    :param horizon:       Future expirations are spread uniformly over this many hours.
+    :param other_tags:    Number of unrelated tags per EC2 instance.
+    :param prefix:        Expiration tag prefix.
+    :param seed:          Random seed, for repeatable fleets.
+    """
+
+    rng = random.Random(seed)
+    now = datetime.datetime.now(datetime.UTC)
+
+    self.Prefix = prefix
+    self.Instances = {}
+
+    for n in range(size):
+
+      instance_id = 'i-{:017x}'.format(n)
+      launch_time = now - datetime.timedelta(hours = rng.uniform(1, 72))
+
+      tags = [{'Key': f'team:tag-{t}', 'Value': f'value-{t}'} for t in range(other_tags)]
+
+      if rng.random() < tagged:
+
+        if rng.random() < expired:
+          expire_at = now - datetime.timedelta(minutes = rng.uniform(1, 60))
+        else:
+          expire_at = now + datetime.timedelta(hours = rng.uniform(0.1, horizon))
+
+        action = 'terminate' if rng.random() < terminate else 'stop'
+
+        if rng.random() < duration:
+          expire_at = max(expire_at, launch_time + datetime.timedelta(seconds = 1))
+          key, value = 'after-duration', '{}s'.format(int((expire_at - launch_time).total_seconds()))
+        else:
+          key, value = 'after-datetime', expire_at.strftime(TAG_DATETIME_FMT)
+
+        if rng.random() < malformed:
+          value = 'not-a-' + key
+
+        tags.append({'Key': f'{prefix}:{action}-{key}', 'Value': value})
+
+      self.Instances[instance_id] = {
+        'InstanceId': instance_id,
+        'ImageId': 'ami-0123456789abcdef0',
+        'InstanceType': 't4g.micro',
+        'LaunchTime': launch_time,
+        'State': {'Name': 'stopped' if rng.random() < stopped else 'running'},
+        'SubnetId': 'subnet-0123456789abcdef0',
+        'VpcId': 'vpc-0123456789abcdef0',
+        'Tags': tags,
+      }
+
+    self._tag_key_matches = {}
+
+
+
+  def ExpireNow(self, instance_ids, action = 'stop'):
+    """
+    Retag EC2 instances to expire right away (ex: a mass expiration by an admin).
+
+    :param instance_ids:  EC2 instance ids.
+    :param action:        'stop' or 'terminate'.
+    :return:              Dict of EC2 instance id to its new tags (as in a tag change event's detail).
+    """
+
+    return self.ExpireAt(instance_ids, datetime.datetime.now(datetime.UTC) - datetime.timedelta(seconds = 1), action)
+
+
+
+  def ExpireAt(self, instance_ids, at, action = 'stop'):
+    """
+    Retag EC2 instances to expire at a date/time.
+
+    :param instance_ids:  EC2 instance ids.
+    :param at:            Expiration date/time (UTC).
+    :param action:        'stop' or 'terminate'.
+    :return:              Dict of EC2 instance id to its new tags (as in a tag change event's detail).
+    """
+
+    changes = {}
+
+    for instance_id in instance_ids:
+      inst = self.Instances[instance_id]
+      inst['Tags'] = [t for t in inst['Tags'] if not t['Key'].startswith(self.Prefix + ':')]
+      inst['Tags'].append({'Key': f'{self.Prefix}:{action}-after-datetime', 'Value': at.strftime(TAG_DATETIME_FMT)})
+      changes[instance_id] = {t['Key']: t['Value'] for t in inst['Tags']}
+
+    self._tag_key_matches = {}
+
+    return changes
+
+
+
+  def Untag(self, instance_ids):
+    """
+    Remove the expiration tags of EC2 instances.
+
+    :param instance_ids:  EC2 instance ids.
+    :return:              Dict of EC2 instance id to its new tags (as in a tag change event's detail).
+    """
+
+    changes = {}
+
+    for instance_id in instance_ids:
+      inst = self.Instances[instance_id]
+      inst['Tags'] = [t for t in inst['Tags'] if not t['Key'].startswith(self.Prefix + ':')]
+      changes[instance_id] = {t['Key']: t['Value'] for t in inst['Tags']}
+
+    self._tag_key_matches = {}
+
+    return changes
+
+
+
+  def TagKeyMatches(self, pattern):
+    """
+    :param pattern:       EC2 'tag-key' filter value (may contain '*' wildcards).
+    :return:              Set of the EC2 instance ids with a matching tag key (cached until tags change).
+    """
+
+    if pattern not in self._tag_key_matches:
+      regex = re.compile(fnmatch.translate(pattern))
+      self._tag_key_matches[pattern] = {
+        i for i, inst in self.Instances.items() if any(regex.match(t['Key']) for t in inst['Tags'])
+      }
+
+    return self._tag_key_matches[pattern]
+
+
+
+  def Count(self, state):
+    """
+    :return:              Number of EC2 instances in a state (ex: 'terminated').
+    """
+
+    return sum(1 for inst in self.Instances.values() if inst['State']['Name'] == state)
+
+
+
+########################################################################################################################
+# Simulated Services
+########################################################################################################################
+
+class SimulatedError(Exception):
+  """
+  Error response of a simulated service, raised by the client as the modeled exception of its code.
+  """
+
+  def __init__(self, code, message = '', status = 400):
+    super().__init__(message or code)
+    self.Code = code
+    self.Status = status
+
+
+
+class SimulatedService:
+  """
+  A real boto3 client, answered by this simulated service instead of AWS: each call is answered from the client's
+  'before-call' event, by the method named after the operation (ex: 'DescribeInstances'), as botocore's Stubber does
+  with responses queued ahead. So requests are validated by the client, and responses here, against the service model;
+  errors are raised by the client as modeled exceptions (ex: client.exceptions.ConflictException).
+
+  Calls are counted, by '<service>:<Operation>', in a counter shared by all simulated services.
+  """
+
+  SERVICE = None
+
+  def __init__(self, calls):
+
+    self.client = SESSION.client(self.SERVICE)
+
+    self._calls = calls
+    self._lock = threading.Lock()
+
+    events = self.client.meta.events
+
+    # The parameters as called, before the client serializes them. The answer comes after every other before-call
+    # handler (ex: the Lambda's API call accounting), as the first response returned ends the event.
+    events.register('before-parameter-build', self._KeepParams)
+    events.register_last('before-call', self._Answer)
+
+
+
+  @staticmethod
+  def _KeepParams(params, context, **kwargs):
+    context['simulated_params'] = dict(params)
+
+
+
+  def _Answer(self, model, context, **kwargs):
+    """
+    :return:    Tuple of (HTTP response, parsed response) answering the call, after the client validated the request.
+    """
+
+    with self._lock:
+
+      self._calls[self.SERVICE + ':' + model.name] += 1
+
+      try:
+        response = getattr(self, model.name)(**context['simulated_params'])
+      except SimulatedError as ex:
+        return AWSResponse(None, ex.Status, {}, None), {
+          'Error': {'Code': ex.Code, 'Message': str(ex)},
+          'ResponseMetadata': {'HTTPStatusCode': ex.Status},
+        }
+
+      if model.output_shape is not None:
+        validate_parameters(response, model.output_shape)
+
+      return AWSResponse(None, 200, {}, None), dict(response, ResponseMetadata = {'HTTPStatusCode': 200})
+
+
+
+class SimulatedEc2(SimulatedService):
+  """
+  Serves the fleet. DescribeInstances supports the filters the Lambda uses; StopInstances and TerminateInstances fail
+  the whole call if any EC2 instance is unknown, or listed in 'Failing' (ex: termination protection).
+  """
+
+  SERVICE = 'ec2'
+
+  def __init__(self, calls, fleet):
+
+    super().__init__(calls)
+
+    self._fleet = fleet
+    self._results = {}                  # Remaining EC2 instance ids of a paginated DescribeInstances, by NextToken
+
+    self.Failing = set()
+
+
+
+  def DescribeInstances(self, Filters = (), MaxResults = DESCRIBE_MAX_RESULTS, NextToken = None, **kwargs):
+
+    if NextToken is not None:
+      ids = self._results.pop(NextToken)
+    else:
+      ids = self._Filter(Filters)
+
+    page, rest = ids[:MaxResults], ids[MaxResults:]
+
+    response = {'Reservations': [{'Instances': [self._fleet.Instances[i] for i in page]}] if page else []}
+
+    if rest:
+      response['NextToken'] = uuid.uuid4().hex
+      self._results[response['NextToken']] = rest
+
+    return response
+
+
+
+  def _Filter(self, filters):
+
+    ids = None
+    states = None
+    tag_keys = []
+
+    for f in filters:
+      if f['Name'] == 'instance-id':
+        ids = [i for i in self._fleet.Instances if any(fnmatch.fnmatchcase(i, v) for v in f['Values'])] \
+              if any('*' in v for v in f['Values']) else [i for i in f['Values'] if i in self._fleet.Instances]
+      elif f['Name'] == 'instance-state-name':
+        states = set(f['Values'])
+      elif f['Name'] == 'tag-key':
+        tag_keys.append(set().union(*(self._fleet.TagKeyMatches(v) for v in f['Values'])))
+      else:
+        raise SimulatedError('InvalidParameterValue', 'Unsupported filter: ' + f['Name'])
+
+    if ids is None:
+      ids = sorted(set.intersection(*tag_keys)) if tag_keys else list(self._fleet.Instances)
+    else:
+      ids = [i for i in ids if all(i in m for m in tag_keys)]
+
+    if states is not None:
+      ids = [i for i in ids if self._fleet.Instances[i]['State']['Name'] in states]
+
+    return ids
+
+
+
+  def _Act(self, result_key, InstanceIds, state):
+
+    for instance_id in InstanceIds:
+      if instance_id not in self._fleet.Instances:
+        raise SimulatedError('InvalidInstanceID.NotFound', instance_id)
+      if instance_id in self.Failing:
+        raise SimulatedError('OperationNotPermitted', instance_id)
+
+    results = []
+
+    for instance_id in InstanceIds:
+      inst = self._fleet.Instances[instance_id]
+      previous = inst['State']['Name']
+      inst['State'] = {'Name': state}
+      results.append({'InstanceId': instance_id, 'PreviousState': {'Name': previous}, 'CurrentState': {'Name': state}})
+
+    return {result_key: results}
+
+  def StopInstances(self, InstanceIds, **kwargs):
+    return self._Act('StoppingInstances', InstanceIds, 'stopped')
+
+  def TerminateInstances(self, InstanceIds, **kwargs):
+    return self._Act('TerminatingInstances', InstanceIds, 'terminated')
+
+
+
+class SimulatedScheduler(SimulatedService):
+
+  SERVICE = 'scheduler'
+
+  def __init__(self, calls):
+
+    super().__init__(calls)
+
+    self.Schedules = {
+      ('default', NEXT_SCHEDULE_NAME): {
+        'Name': NEXT_SCHEDULE_NAME,
+        'GroupName': 'default',
+        'ScheduleExpression': 'at(2000-01-01T00:00:00)',
+        'ScheduleExpressionTimezone': 'UTC',
+        'FlexibleTimeWindow': {'Mode': 'OFF'},
+        'State': 'ENABLED',
+        'Target': {
+          'Arn': 'arn:aws:sqs:us-east-1:123456789012:InstanceExpiration.fifo',
+          'RoleArn': 'arn:aws:iam::123456789012:role/InstanceExpiration-SchedulerRole',
+          'SqsParameters': {'MessageGroupId': 'InstanceExpiration'},
+        },
+      }
+    }
+
+  @staticmethod
+  def Arn(name, group_name):
+    return ACCOUNT_ARN + ':schedule/' + group_name + '/' + name
+
+  def GetSchedule(self, Name, GroupName = 'default'):
+    if (GroupName, Name) not in self.Schedules:
+      raise SimulatedError('ResourceNotFoundException', Name, 404)
+    return dict(copy.deepcopy(self.Schedules[(GroupName, Name)]), Arn = self.Arn(Name, GroupName))
+
+  def CreateSchedule(self, Name, GroupName = 'default', ClientToken = None, **kwargs):
+    if (GroupName, Name) in self.Schedules:
+      raise SimulatedError('ConflictException', Name, 409)
+    self.Schedules[(GroupName, Name)] = dict(kwargs, Name = Name, GroupName = GroupName)
+    return {'ScheduleArn': self.Arn(Name, GroupName)}
+
+  def UpdateSchedule(self, Name, GroupName = 'default', ClientToken = None, **kwargs):
+    if (GroupName, Name) not in self.Schedules:
+      raise SimulatedError('ResourceNotFoundException', Name, 404)
+    self.Schedules[(GroupName, Name)] = dict(kwargs, Name = Name, GroupName = GroupName)
+    return {'ScheduleArn': self.Arn(Name, GroupName)}
+
+  def DeleteSchedule(self, Name, GroupName = 'default', ClientToken = None):
+    if self.Schedules.pop((GroupName, Name), None) is None:
+      raise SimulatedError('ResourceNotFoundException', Name, 404)
+    return {}
+
+
+
+class SimulatedSsm(SimulatedService):
+
+  SERVICE = 'ssm'
+
+  def GetParameter(self, Name, **kwargs):
+    value = SimulatedScheduler.Arn(NEXT_SCHEDULE_NAME, 'default')
+    return {'Parameter': {'Name': Name, 'Type': 'String', 'Value': value}}
+
+
+
+class SimulatedEvents(SimulatedService):
+  """
+  Collects the events put.
+  """
+
+  SERVICE = 'events'
+
+  def __init__(self, calls):
+    super().__init__(calls)
+    self.Events = []
+
+  def PutEvents(self, Entries, **kwargs):
+    self.Events.extend(Entries)
+    return {'FailedEntryCount': 0, 'Entries': [{'EventId': uuid.uuid4().hex} for e in Entries]}
+
+
+
+class SimulatedSqs(SimulatedService):
+  """
+  Collects sent messages, by message group, for the simulation to deliver (see Simulation.Drain).
+  """
+
+  SERVICE = 'sqs'
+
+  def __init__(self, calls):
+    super().__init__(calls)
+    self.Groups = collections.defaultdict(collections.deque)
+
+  @staticmethod
+  def _Sent(body):
+    return {'MessageId': uuid.uuid4().hex, 'MD5OfMessageBody': hashlib.md5(body.encode()).hexdigest()}
+
+  def SendMessage(self, QueueUrl, MessageBody, MessageGroupId, MessageDeduplicationId, **kwargs):
+    self.Groups[MessageGroupId].append(MessageBody)
+    return self._Sent(MessageBody)
+
+  def SendMessageBatch(self, QueueUrl, Entries):
+    for e in Entries:
+      self.Groups[e['MessageGroupId']].append(e['MessageBody'])
+    return {'Successful': [dict(self._Sent(e['MessageBody']), Id = e['Id']) for e in Entries], 'Failed': []}
+
+
+
+class SimulatedDynamoDb(SimulatedService):
+  """
+  Single table keyed by 'InstanceId', with the 'ExpireAtIndex' GSI (Shard, ExpireAt) kept sorted on demand. Key
+  condition expressions are checked as DynamoDB does: reserved words must be aliased, and every expression attribute
+  name and value must be used.
+  """
+
+  SERVICE = 'dynamodb'
+
+  # Key conditions the GSI supports: the partition key, and optionally a comparison on the sort key.
+  KEY_CONDITION = re.compile(r'^\s*Shard\s*=\s*(:\w+)\s*(?:AND\s+ExpireAt\s*(<=|<|>=|>)\s*(:\w+))?\s*$')
+
+  def __init__(self, calls):
+    super().__init__(calls)
+    self.Items = {}
+    self._gsi = None
+
+  def GetItem(self, TableName, Key, **kwargs):
+    item = self.Items.get(Key['InstanceId']['S'])
+    return {'Item': item} if item is not None else {}
+
+  def BatchGetItem(self, RequestItems, **kwargs):
+    responses = {}
+    for table, request in RequestItems.items():
+      if len(request['Keys']) > 100:
+        raise SimulatedError('ValidationException', 'Too many items requested for the BatchGetItem call')
+      items = (self.Items.get(k['InstanceId']['S']) for k in request['Keys'])
+      responses[table] = [i for i in items if i is not None]
+    return {'Responses': responses, 'UnprocessedKeys': {}}
+
+  def PutItem(self, TableName, Item, **kwargs):
+    self._Put(Item)
+    return {}
+
+  def DeleteItem(self, TableName, Key, **kwargs):
+    self._Delete(Key['InstanceId']['S'])
+    return {}
+
+  def BatchWriteItem(self, RequestItems, **kwargs):
+    for requests in RequestItems.values():
+      if len(requests) > 25:
+        raise SimulatedError('ValidationException', 'Too many items requested for the BatchWriteItem call')
+      for r in requests:
+        if 'PutRequest' in r:
+          self._Put(r['PutRequest']['Item'])
+        else:
+          self._Delete(r['DeleteRequest']['Key']['InstanceId']['S'])
+    return {'UnprocessedItems': {}}
+
+  def Query(self, TableName, IndexName, KeyConditionExpression, ExpressionAttributeValues,
+            ExpressionAttributeNames = None, ScanIndexForward = True, Limit = None, ExclusiveStartKey = None):
+
+    if self._gsi is None:
+      self._gsi = sorted(
+        (i for i in self.Items.values() if 'Shard' in i and 'ExpireAt' in i),
+        key = lambda i: (i['Shard']['S'], i['ExpireAt']['S'], i['InstanceId']['S']),
+      )
+
+    match = self.KEY_CONDITION.match(
+      self._Expression(KeyConditionExpression, ExpressionAttributeNames or {}, ExpressionAttributeValues)
+    )
+
+    if match is None:
+      raise SimulatedError('ValidationException', 'Query key condition not supported')
+
+    shard, operator, value = match.groups()
+    compare = {'<=': str.__le__, '<': str.__lt__, '>=': str.__ge__, '>': str.__gt__}.get(operator)
+
+    items = [
+      i for i in self._gsi
+      if i['Shard']['S'] == ExpressionAttributeValues[shard]['S'] and
+         (compare is None or compare(i['ExpireAt']['S'], ExpressionAttributeValues[value]['S']))
+    ]
+
+    if not ScanIndexForward:
+      items.reverse()
+
+    if ExclusiveStartKey is not None:
+      n = next(n for n, i in enumerate(items) if i['InstanceId'] == ExclusiveStartKey['InstanceId'])
+      items = items[n + 1:]
+
+    page = items[:min(Limit or QUERY_PAGE_ITEMS, QUERY_PAGE_ITEMS)]
+    response = {'Items': page, 'Count': len(page), 'ScannedCount': len(page)}
+
+    if len(page) < len(items):
+      response['LastEvaluatedKey'] = {k: page[-1][k] for k in ('InstanceId', 'Shard', 'ExpireAt')}
+
+    return response
+
+  @staticmethod
+  def _Expression(expression, names, values):
+    """
+    :return:    The expression, with attribute name aliases resolved. Raises as DynamoDB would.
+    """
+
+    for word in re.findall(r'(?<![#:\w])[A-Za-z_]\w*', expression):
+      if word.upper() in DYNAMODB_RESERVED_WORDS and word.upper() != 'AND':
+        raise SimulatedError('ValidationException',
+          'Invalid KeyConditionExpression: Attribute name is a reserved keyword; reserved keyword: ' + word)
+
+    for alias in set(re.findall(r'#\w+', expression)) - set(names):
+      raise SimulatedError('ValidationException', 'An expression attribute name used in the document path is not '
+        'defined; attribute name: ' + alias)
+
+    for unused in (set(names) - set(re.findall(r'#\w+', expression))) | \
+                  (set(values) - set(re.findall(r':\w+', expression))):
+      raise SimulatedError('ValidationException', 'Value provided in ExpressionAttributeNames/Values unused in '
+        'expressions: ' + unused)
+
+    return re.sub(r'#\w+', lambda m: names[m.group(0)], expression)
+
+  def _Put(self, item):
+    self.Items[item['InstanceId']['S']] = item
+    self._gsi = None
+
+  def _Delete(self, instance_id):
+    if self.Items.pop(instance_id, None) is not None:
+      self._gsi = None
+
+
+
+########################################################################################################################
+# Simulation
+########################################################################################################################
+
+class Simulation:
+  """
+  Runs the Instance Expiration lambda's handler against a fleet, through the simulated services. The Lambda module must
+  be imported after the environment is set (see Environment), as it reads the environment at import.
+  """
+
+  def __init__(self, fleet):
+    """
+    :param fleet:         Fleet.
+    """
+
+    self.Fleet = fleet
+    self.Calls = collections.Counter()
+
+    self.Ec2 = SimulatedEc2(self.Calls, fleet)
+    self.Scheduler = SimulatedScheduler(self.Calls)
+    self.Ssm = SimulatedSsm(self.Calls)
+    self.Events = SimulatedEvents(self.Calls)
+    self.Sqs = SimulatedSqs(self.Calls)
+    self.DynamoDb = SimulatedDynamoDb(self.Calls)
+
+    self._invocations = 0
+
+
+
+  @staticmethod
+  def Environment(**overrides):
+    """
+    Set the Lambda environment, and make the Lambda code importable.
+
+    :param overrides:     Environment variables to override (ex: IX_INCREMENTAL_CHECKS = 'Disable').
+    """
+
+    os.environ.update(ENVIRONMENT, **overrides)
+
+    if LAMBDA_DIR not in sys.path:
+      sys.path.insert(0, LAMBDA_DIR)
+
+
+
+  def Install(self, module):
+    """
+    Point the Lambda module at the simulated services' clients, with the Lambda's API call accounting, and lift its
+    EC2 mutating call rate limits.
+
+    :param module:        The imported Lambda module.
+    """
+
+    from ActionExecutor import TokenBucket
+
+    self._lambda = module
+
+    module.aws_ec2 = self.Ec2.client
+    module.aws_scheduler = self.Scheduler.client
+    module.aws_ssm = self.Ssm.client
+    module.aws_events = self.Events.client
+    module.aws_sqs = self.Sqs.client
+    module.aws_dynamodb = self.DynamoDb.client
+
+    for service in (self.Ec2, self.Scheduler, self.Ssm, self.Events, self.Sqs, self.DynamoDb):
+      module.Clients.ACCOUNTING.Register(service.client)
+
+    module.EC2_MUTATING_REQUESTS = TokenBucket(rate = 1e12, capacity = 1e12)
+    module.EC2_MUTATING_INSTANCES = TokenBucket(rate = 1e12, capacity = 1e12)
+    module.SCHEDULER_WRITES = TokenBucket(rate = 1e12, capacity = 1e12)
+    module.NEXT_SCHEDULE_CACHE.clear()
+
+
+
+  def Invoke(self, bodies, remaining = 600):
+    """
+    Invoke the handler with one SQS batch.
+
+    :param bodies:        SQS message bodies (strings).
+    :param remaining:     Seconds left in the invocation, at its start (the Lambda's timeout).
+    :return:              The handler's response.
+    """
+
+    self._invocations += 1
+
+    event = {'Records': [{'messageId': str(n), 'body': b} for n, b in enumerate(bodies)]}
+
+    context = types.SimpleNamespace(
+      invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:InstanceExpiration',
+      aws_request_id = 'simulated-' + str(self._invocations),
+      get_remaining_time_in_millis = lambda: remaining * 1000,
+    )
+
+    return self._lambda.handler(event, context)
+
+
+
+  def Drain(self, max_invocations = 1000):
+    """
+    Deliver the messages the Lambda sent to its own queue (hand-offs, shard fan-out), in batches of up to 10 per
+    message group, until none are left.
+
+    :return:              Number of invocations.
+    """
+
+    n = 0
+
+    while any(self.Sqs.Groups.values()) and n < max_invocations:
+      for group in [g for g, q in self.Sqs.Groups.items() if q]:
+        queue = self.Sqs.Groups[group]
+        self.Invoke([queue.popleft() for _ in range(min(10, len(queue)))])
+        n += 1
+
+    return n
+
+
+
+  @staticmethod
+  def ScheduledEvent(schedule_name):
+    """
+    :return:              SQS message body of a schedule invocation (ex: NEXT_SCHEDULE_NAME, RATE_SCHEDULE_NAME).
+    """
+
+    return json.dumps({
+      'detail-type': 'Scheduled Event',
+      'resources': [ACCOUNT_ARN + ':schedule/default/' + schedule_name],
+    })
+
+
+
+  @staticmethod
+  def TagChangeEvent(instance_id, tags, at = None):
+    """
+    :param at:            Datetime (UTC) of the event, or 'None' for now.
+    :return:              SQS message body of an EC2 instance tag change event.
+    """
+
+    return json.dumps({
+      'detail-type': 'Tag Change on Resource',
+      'time': (at or datetime.datetime.now(datetime.UTC)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+      'resources': ['arn:aws:ec2:us-east-1:123456789012:instance/' + instance_id],
+      'detail': {'tags': tags},
+    })
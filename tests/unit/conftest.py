@@ -0,0 +1,28 @@
+import os
+import sys
+import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lambda', 'InstanceExpiration'))
+
+from ExpireAction import ExpireAction
+from ExpirationIndex import ExpirationIndexEntry
+
+NOW = datetime.datetime(2024, 2, 3, 18, 43, 48, tzinfo = datetime.UTC)
+
+
+@pytest.fixture
+def now():
+    """Reference time of the expiration index entries built by the entry fixture. Override for wall clock entries."""
+    return NOW
+
+
+@pytest.fixture
+def entry(now):
+    """Factory of expiration index entries, expiring some minutes from now."""
+
+    def make(instance_id, minutes, action = ExpireAction.STOP):
+        return ExpirationIndexEntry(instance_id, action, now + datetime.timedelta(minutes = minutes))
+
+    return make
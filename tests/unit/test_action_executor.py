@@ -0,0 +1,105 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lambda', 'InstanceExpiration'))
+
+import ActionExecutor as action_executor
+from ActionExecutor import ActionExecutor, TokenBucket
+
+
+class Clock:
+    """
+    Stands in for time.monotonic and time.sleep: sleeping advances the clock, and is recorded. Rates in the tests are
+    powers of two, so waits are exact.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(action_executor.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(action_executor.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_token_bucket_allows_burst_then_refill_rate(clock):
+    bucket = TokenBucket(rate = 4, capacity = 10)
+
+    for _ in range(10):
+        bucket.Acquire()
+    assert clock.sleeps == []
+
+    bucket.Acquire()
+    assert clock.sleeps == [0.25]
+
+    clock.now += 1
+    bucket.Acquire(4)
+    assert len(clock.sleeps) == 1
+
+
+def test_token_bucket_refill_is_capped_at_capacity(clock):
+    bucket = TokenBucket(rate = 4, capacity = 10)
+    bucket.Acquire(10)
+
+    clock.now += 3600
+    bucket.Acquire(10)
+    assert clock.sleeps == []
+
+    bucket.Acquire(1)
+    assert clock.sleeps == [0.25]
+
+
+def test_token_bucket_takes_more_than_capacity_in_debt(clock):
+    bucket = TokenBucket(rate = 8, capacity = 48)
+    bucket.Acquire(40)
+
+    # Waits for a full bucket rather than forever, then owes the rest
+    bucket.Acquire(100)
+    assert clock.sleeps == [5]
+
+    bucket.Acquire(8)
+    assert clock.sleeps == [5, 7.5]
+
+
+def test_map_keeps_order_and_runs_concurrently():
+    executor = ActionExecutor(4)
+    barrier = threading.Barrier(4, timeout = 5)
+
+    def fn(n):
+        barrier.wait()
+        return n * n
+
+    assert executor.MaxInFlight == 4
+    assert executor.Map(fn, range(8)) == [n * n for n in range(8)]
+
+
+def test_map_with_one_in_flight_runs_on_calling_thread():
+    executor = ActionExecutor(0)
+    caller = threading.current_thread()
+
+    assert executor.MaxInFlight == 1
+    assert executor.Map(lambda n: threading.current_thread() is caller, range(3)) == [True, True, True]
+
+
+def test_map_reraises():
+    def fn(n):
+        if n == 2:
+            raise ValueError(n)
+        return n
+
+    with pytest.raises(ValueError):
+        ActionExecutor(4).Map(fn, range(4))
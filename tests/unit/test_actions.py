@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import uuid
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmark'))
+
+from fleet_simulator import Fleet, Simulation, SimulatedError, NEXT_SCHEDULE_NAME
+
+Simulation.Environment()
+
+import Lambda
+from Ec2Instance import Ec2Instance
+from ExpireAction import ExpireAction
+from ExpirationIndex import ExpirationIndexEntry
+
+
+def simulate(size, **kwargs):
+    fleet = Fleet(size, malformed = 0, **kwargs)
+    sim = Simulation(fleet)
+    sim.Install(Lambda)
+    Lambda.EVENT_BUFFER.clear()
+    return fleet, sim
+
+
+def expired(size, **kwargs):
+    """
+    :return:    Fleet, simulation, and the fleet's EC2 instances, all expired and running.
+    """
+
+    fleet, sim = simulate(size, tagged = 1, expired = 1, stopped = 0, **kwargs)
+    return fleet, sim, [Ec2Instance(dict(i)) for i in fleet.Instances.values()]
+
+
+def test_rate_limits_are_a_share_of_the_documented_ec2_limits():
+    assert Lambda.EC2_MUTATING_REQUEST_LIMIT == (5, 200)
+    assert Lambda.EC2_ACTION_RESOURCE_LIMIT == (20, 1000)
+    assert Lambda.IX_ACTION_RATE_SHARE == 0.5
+
+
+def test_failed_chunk_is_retried_one_instance_at_a_time():
+    fleet, sim = simulate(250, stopped = 0)
+    ids = sorted(fleet.Instances)
+    sim.Ec2.Failing = {ids[3]}
+
+    acted = list(Lambda.ActOnInstances(Lambda.aws_ec2.stop_instances, 'StoppingInstances', ids))
+
+    assert sorted(acted) == [i for i in ids if i != ids[3]]
+    assert fleet.Instances[ids[3]]['State']['Name'] == 'running'
+
+    # 3 chunks, then the 100 EC2 instances of the failed chunk one at a time
+    assert sim.Calls['ec2:StopInstances'] == 3 + 100
+
+
+def test_expired_instances_are_verified_and_acted_on_in_batches():
+    fleet, sim, insts = expired(250, terminate = 0)
+
+    Lambda.OnStopInstances(insts)
+
+    assert fleet.Count('stopped') == 250
+    assert sim.Calls['ec2:DescribeInstances'] == 2          # MAX_FILTER_VALUES per verification describe
+    assert sim.Calls['ec2:StopInstances'] == 3              # MAX_ACTION_IDS per call
+    assert len(Lambda.EVENT_BUFFER) == 250
+
+
+def test_failed_verification_describe_rejects_rather_than_acts(monkeypatch):
+    fleet, sim, insts = expired(10, terminate = 0)
+
+    def describe(**kwargs):
+        raise SimulatedError('UnauthorizedOperation', status = 403)
+
+    monkeypatch.setattr(sim.Ec2, 'DescribeInstances', describe)
+
+    verified, rejected = Lambda.VerifyExpireActions(insts, ExpireAction.STOP)
+    assert (verified, rejected) == ([], insts)
+
+    Lambda.OnStopInstances(insts)
+
+    assert fleet.Count('stopped') == 0
+    assert sim.Calls['ec2:StopInstances'] == 0
+
+
+def test_verification_rejects_instances_changed_since_the_scan():
+    fleet, sim, insts = expired(10, terminate = 0)
+    fleet.Instances[insts[0].InstanceId]['Tags'] = []
+    fleet.Instances[insts[1].InstanceId]['State'] = {'Name': 'shutting-down'}
+
+    verified, rejected = Lambda.VerifyExpireActions(insts, ExpireAction.STOP)
+
+    assert rejected == insts[:2]
+    assert verified == insts[2:]
+    assert not Lambda.VerifyExpireActions(insts[2:], ExpireAction.TERM)[0]
+
+
+def test_put_events_retries_only_failed_entries(monkeypatch):
+    fleet, sim, insts = expired(12)
+    requests = []
+
+    def put_events(Entries, **kwargs):
+        requests.append([json.loads(e['Detail'])['instance-id'] for e in Entries])
+        failed = {1, 4} if len(requests) == 1 else set()
+        return {
+            'FailedEntryCount': len(failed),
+            'Entries': [
+                {'ErrorCode': 'InternalFailure'} if n in failed else {'EventId': uuid.uuid4().hex}
+                for n in range(len(Entries))
+            ],
+        }
+
+    monkeypatch.setattr(sim.Events, 'PutEvents', put_events)
+    monkeypatch.setattr(Lambda.time, 'sleep', lambda seconds: None)
+
+    for inst in insts:
+        Lambda.EmitEventBusEvent(inst)
+    Lambda.FlushEventBusEvents()
+
+    ids = [i.InstanceId for i in insts]
+    assert requests == [ids[:10], [ids[1], ids[4]], ids[10:]]
+    assert Lambda.EVENT_BUFFER == []
+
+
+def test_put_events_gives_up_after_max_attempts(monkeypatch):
+    fleet, sim, insts = expired(3)
+
+    monkeypatch.setattr(sim.Events, 'PutEvents', lambda Entries, **kwargs: {
+        'FailedEntryCount': 1,
+        'Entries': [{'ErrorCode': 'InternalFailure'}] + [{'EventId': uuid.uuid4().hex} for e in Entries[1:]],
+    })
+    monkeypatch.setattr(Lambda.time, 'sleep', lambda seconds: None)
+
+    for inst in insts:
+        Lambda.EmitEventBusEvent(inst)
+    Lambda.FlushEventBusEvents()
+
+    assert sim.Calls['events:PutEvents'] == Lambda.PUT_EVENTS_MAX_ATTEMPTS
+
+
+def expiring(hours):
+    at = datetime.datetime.now(datetime.UTC) + datetime.timedelta(hours = hours)
+    return ExpirationIndexEntry('i-1', ExpireAction.STOP, at.replace(microsecond = 0))
+
+
+def scheduled(sim):
+    return sim.Scheduler.Schedules[('default', NEXT_SCHEDULE_NAME)]['ScheduleExpression']
+
+
+def test_next_schedule_is_cached_until_its_ttl(monkeypatch):
+    fleet, sim = simulate(0)
+    clock = [1000.0]
+    monkeypatch.setattr(Lambda.time, 'monotonic', lambda: clock[0])
+
+    soon, later = expiring(2), expiring(3)
+
+    Lambda.ScheduleNextCheck(soon)
+    Lambda.ScheduleNextCheck(soon)
+    Lambda.ScheduleNextCheck(later)
+
+    assert (sim.Calls['ssm:GetParameter'], sim.Calls['scheduler:GetSchedule']) == (1, 1)
+    assert sim.Calls['scheduler:UpdateSchedule'] == 2
+    assert Lambda.GetNextSchedule()['ScheduleExpression'] == scheduled(sim)
+
+    clock[0] += Lambda.NEXT_SCHEDULE_CACHE_TTL
+    Lambda.ScheduleNextCheck(later)
+
+    assert (sim.Calls['ssm:GetParameter'], sim.Calls['scheduler:GetSchedule']) == (2, 2)
+    assert sim.Calls['scheduler:UpdateSchedule'] == 2
+
+
+def test_out_of_date_next_schedule_is_refreshed_and_retried(monkeypatch):
+    fleet, sim = simulate(0)
+    update = sim.Scheduler.UpdateSchedule
+    conflicts = [SimulatedError('ConflictException', status = 409)]
+
+    def update_once_out_of_date(**kwargs):
+        if conflicts:
+            raise conflicts.pop()
+        return update(**kwargs)
+
+    Lambda.GetNextSchedule()
+    monkeypatch.setattr(sim.Scheduler, 'UpdateSchedule', update_once_out_of_date)
+
+    Lambda.ScheduleNextCheck(expiring(2))
+
+    assert sim.Calls['scheduler:GetSchedule'] == 2
+    assert sim.Calls['scheduler:UpdateSchedule'] == 2
+    assert Lambda.NEXT_SCHEDULE_CACHE[None]['schedule']['ScheduleExpression'] == scheduled(sim)
+
+
+def test_failed_update_invalidates_the_cached_next_schedule(monkeypatch):
+    fleet, sim = simulate(0)
+
+    def update(**kwargs):
+        raise SimulatedError('ValidationException')
+
+    monkeypatch.setattr(sim.Scheduler, 'UpdateSchedule', update)
+
+    Lambda.ScheduleNextCheck(expiring(2))
+
+    assert None not in Lambda.NEXT_SCHEDULE_CACHE
@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lambda', 'InstanceExpiration'))
+
+import boto3
+import botocore.config
+import botocore.awsrequest
+
+from ApiCalls import ApiCallAccounting
+
+
+class Raw:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+def client(*responses):
+    """
+    DynamoDB client answering each attempt with the next (status, body), without any network access.
+    """
+
+    c = boto3.session.Session().client(
+        'dynamodb',
+        region_name = 'us-east-1',
+        aws_access_key_id = 'test',
+        aws_secret_access_key = 'test',
+        config = botocore.config.Config(retries = {'mode': 'standard', 'total_max_attempts': len(responses)}),
+    )
+
+    pending = list(responses)
+
+    def send(request, **kwargs):
+        status, body = pending.pop(0)
+        return botocore.awsrequest.AWSResponse(
+            request.url, status, {'Content-Type': 'application/x-amz-json-1.0'}, Raw(json.dumps(body).encode())
+        )
+
+    c.meta.events.register('before-send', send)
+    return c
+
+
+THROTTLED = (400, {'__type': 'com.amazonaws.dynamodb.v20120810#ThrottlingException', 'message': 'Rate exceeded'})
+
+
+def test_calls_are_counted_per_operation():
+    c = client((200, {'TableNames': []}), (200, {'TableNames': []}))
+    accounting = ApiCallAccounting()
+    accounting.Register(c)
+
+    c.list_tables()
+    c.list_tables()
+
+    stats = accounting.Stats['dynamodb:ListTables']
+    assert (stats.Calls, stats.Retries, stats.Throttles, stats.Errors) == (2, 0, 0, 0)
+    assert stats.Seconds > 0
+    assert accounting.Summary().startswith('2 in ')
+
+
+def test_throttled_attempt_is_counted_as_retry():
+    c = client(THROTTLED, (200, {'TableNames': []}))
+    accounting = ApiCallAccounting()
+    accounting.Register(c)
+
+    c.list_tables()
+
+    stats = accounting.Stats['dynamodb:ListTables']
+    assert (stats.Calls, stats.Retries, stats.Throttles, stats.Errors) == (1, 1, 1, 0)
+    assert '1 retries, 1 throttled' in accounting.Summary()
+
+
+def test_throttled_call_is_counted_as_throttled_and_failed():
+    c = client(THROTTLED)
+    accounting = ApiCallAccounting()
+    accounting.Register(c)
+
+    try:
+        c.list_tables()
+    except c.exceptions.ClientError:
+        pass
+
+    stats = accounting.Stats['dynamodb:ListTables']
+    assert (stats.Calls, stats.Retries, stats.Throttles, stats.Errors) == (1, 0, 1, 1)
+
+    accounting.Reset()
+    assert accounting.Summary() == 'none'
@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lambda', 'InstanceExpiration'))
+
+from ExpireAction import ExpireAction
+from ExpirationIndex import MemoryExpirationIndex
+from ActionExecutor import ActionExecutor, TokenBucket
+from DirectActions import DirectActionIndex
+
+
+@pytest.fixture
+def now():
+    # Schedules are only kept for entries far enough in the future, by the wall clock.
+    return datetime.datetime.now(datetime.UTC)
+
+
+class FakeScheduler:
+    class exceptions:
+        class ConflictException(Exception):
+            pass
+
+        class ResourceNotFoundException(Exception):
+            pass
+
+    def __init__(self):
+        self.schedules = {}
+        self.failing = set()
+
+    def create_schedule(self, **kwargs):
+        if kwargs['Name'] in self.failing:
+            raise RuntimeError(kwargs['Name'])
+        if kwargs['Name'] in self.schedules:
+            raise self.exceptions.ConflictException()
+        self.schedules[kwargs['Name']] = kwargs
+
+    def update_schedule(self, **kwargs):
+        self.schedules[kwargs['Name']] = kwargs
+
+    def delete_schedule(self, Name, GroupName):
+        if Name in self.failing:
+            raise RuntimeError(Name)
+        if self.schedules.pop(Name, None) is None:
+            raise self.exceptions.ResourceNotFoundException()
+
+
+def direct_index(actions = (ExpireAction.STOP, ExpireAction.TERM), reconcile_limit = 100):
+    scheduler = FakeScheduler()
+    index = DirectActionIndex(
+        MemoryExpirationIndex(), scheduler, 'group', {a: a.name.lower() + '-role-arn' for a in actions},
+        ActionExecutor(1), TokenBucket(1000, 1000), reconcile_limit,
+    )
+    return index, scheduler
+
+
+def test_writes_keep_schedules_in_step_with_index(entry):
+    index, scheduler = direct_index()
+
+    index.WriteMany([entry('i-1', 10), entry('i-2', 20, ExpireAction.TERM)], [])
+    index.Upsert(entry('i-1', 30, ExpireAction.TERM))
+
+    assert sorted(scheduler.schedules) == ['Expire-i-1', 'Expire-i-2']
+    target = scheduler.schedules['Expire-i-1']['Target']
+    assert target['Arn'].endswith(':ec2:terminateInstances')
+    assert target['RoleArn'] == 'term-role-arn'
+    assert scheduler.schedules['Expire-i-2']['Target']['RoleArn'] == 'term-role-arn'
+    assert json.loads(target['Input']) == {'InstanceIds': ['i-1']}
+
+    index.Delete('i-2')
+    index.Delete('i-3')
+
+    assert sorted(scheduler.schedules) == ['Expire-i-1']
+    assert sorted(e.InstanceId for e in index.Entries()) == ['i-1']
+
+
+def test_imminent_and_disabled_actions_are_left_to_the_lambda(entry):
+    index, scheduler = direct_index(actions = [ExpireAction.TERM])
+
+    index.WriteMany([entry('i-1', 10), entry('i-2', 0, ExpireAction.TERM), entry('i-3', 10, ExpireAction.TERM)], [])
+
+    assert sorted(scheduler.schedules) == ['Expire-i-3']
+    assert sorted(e.InstanceId for e in index.Entries()) == ['i-1', 'i-2', 'i-3']
+
+
+def test_failed_schedule_writes_are_recorded_and_left_out_of_the_index(entry):
+    index, scheduler = direct_index()
+    index.WriteMany([entry('i-1', 10), entry('i-2', 10)], [])
+    scheduler.failing = {'Expire-i-1', 'Expire-i-3'}
+
+    index.WriteMany([entry('i-1', 30), entry('i-3', 10)], ['i-2'])
+    index.Delete('i-1')
+
+    assert index.FailedInstanceIds == {'i-1', 'i-3'}
+    assert {e.InstanceId: e.ExpireDateTime for e in index.Entries()} == {'i-1': entry('i-1', 10).ExpireDateTime}
+    assert sorted(scheduler.schedules) == ['Expire-i-1']
+
+
+def test_schedule_write_errors_propagate(entry):
+    index, scheduler = direct_index()
+    scheduler.failing = {'Expire-i-1'}
+
+    with pytest.raises(RuntimeError):
+        index.PutSchedule(entry('i-1', 10))
+    with pytest.raises(RuntimeError):
+        index.DeleteSchedule('i-1')
+
+
+def test_reconcile_writes_soonest_schedules_and_returns_the_rest(entry):
+    index, scheduler = direct_index(reconcile_limit = 3)
+    index.WriteMany([entry('i-0', 5)], [])
+
+    remaining = index.Reconcile([entry('i-%d' % n, 60 - n) for n in range(1, 6)])
+
+    # The delete of i-0 counts towards the limit; the soonest two are written
+    assert sorted(scheduler.schedules) == ['Expire-i-4', 'Expire-i-5']
+    assert sorted(remaining) == ['i-1', 'i-2', 'i-3']
+    assert sorted(e.InstanceId for e in index.Entries()) == ['i-1', 'i-2', 'i-3', 'i-4', 'i-5']
+    assert index.IsPopulated()
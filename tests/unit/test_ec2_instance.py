@@ -0,0 +1,57 @@
+import os
+import sys
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lambda', 'InstanceExpiration'))
+os.environ.setdefault('IX_TAG_PREFIX', 'expiration')
+
+from ExpireAction import ExpireAction
+from Ec2Instance import Ec2Instance
+
+LAUNCH = datetime.datetime(2024, 2, 3, 18, 43, 48, tzinfo = datetime.UTC)
+
+
+def instance(**tags):
+    return {
+        'InstanceId': 'i-1',
+        'State': {'Name': 'running'},
+        'LaunchTime': LAUNCH,
+        'Tags': [{'Key': 'Name', 'Value': 'x'}] + [
+            {'Key': 'expiration:' + k.replace('_', '-'), 'Value': v} for k, v in tags.items()
+        ],
+    }
+
+
+def test_soonest_tag_wins_and_terminate_wins_tie():
+    inst = Ec2Instance(instance(
+        stop_after_duration = '1d2h',
+        terminate_after_datetime = '2024-02-04 21:43:48 UTC',
+    ))
+    assert inst.ExpireAction == ExpireAction.STOP
+    assert inst.ExpireDateTime == LAUNCH + datetime.timedelta(days = 1, hours = 2)
+
+    inst = Ec2Instance(instance(stop_after_duration = '1d', terminate_after_datetime = '2024-02-04 18:43:48 UTC'))
+    assert (inst.ExpireAction, inst.ExpireDateTime) == (ExpireAction.TERM, LAUNCH + datetime.timedelta(days = 1))
+
+
+def test_datetime_formats():
+    # Fast path, strptime() fallback (not zero-padded), and malformed.
+    assert Ec2Instance(instance(stop_after_datetime = '2030-01-02 03:04:05 UTC')).ExpireDateTime == \
+        datetime.datetime(2030, 1, 2, 3, 4, 5, tzinfo = datetime.UTC)
+    assert Ec2Instance(instance(stop_after_datetime = '2030-1-2 03:04:05 UTC')).ExpireDateTime == \
+        datetime.datetime(2030, 1, 2, 3, 4, 5, tzinfo = datetime.UTC)
+    assert Ec2Instance(instance(stop_after_datetime = '2030-13-02 03:04:05 UTC')).ExpireDateTime is None
+
+
+def test_expiration_from_tag_change_event_tags():
+    tags = Ec2Instance.GetTagsFromDict({
+        'Name': 'x',
+        'expiration:stop-after-datetime': '2030-01-02 03:04:05 UTC',
+        'expiration:terminate-after-datetime': '2030-01-02 03:04:05 UTC',
+    })
+    assert not Ec2Instance.NeedsLaunchTime(tags)
+    assert Ec2Instance.CalculateExpiration(tags, None) == \
+        (ExpireAction.TERM, datetime.datetime(2030, 1, 2, 3, 4, 5, tzinfo = datetime.UTC))
+
+    assert Ec2Instance.NeedsLaunchTime(Ec2Instance.GetTagsFromDict({'expiration:stop-after-duration': '1d'}))
+    assert Ec2Instance.CalculateExpiration(Ec2Instance.GetTagsFromDict({'Name': 'x'}), None) == (None, None)
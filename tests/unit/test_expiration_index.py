@@ -0,0 +1,101 @@
+import os
+import sys
+import datetime
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lambda', 'InstanceExpiration'))
+
+from ExpireAction import ExpireAction
+from ExpirationIndex import ExpirationIndex, MemoryExpirationIndex, DynamoDbExpirationIndex
+
+
+def test_next_and_due_are_range_queries(now, entry):
+    index = MemoryExpirationIndex()
+    for e in [entry('i-3', 30), entry('i-1', -10), entry('i-2', 5), entry('i-0', -20, ExpireAction.TERM)]:
+        index.Upsert(e)
+
+    assert index.Next(now).InstanceId == 'i-2'
+    assert [e.InstanceId for e in index.Due(now)] == ['i-0', 'i-1']
+
+    index.Delete('i-2')
+    assert index.Next(now).InstanceId == 'i-3'
+    assert index.Next(now + datetime.timedelta(hours = 1)) is None
+
+
+def test_reconcile_writes_only_differences(entry):
+    class Inst:
+        def __init__(self, e):
+            self.InstanceId, self.ExpireAction, self.ExpireDateTime = e.InstanceId, e.ExpireAction, e.ExpireDateTime
+
+    class CountingIndex(MemoryExpirationIndex):
+        def WriteMany(self, upserts, deletes):
+            self.written = (sorted(e.InstanceId for e in upserts), sorted(deletes))
+            super().WriteMany(upserts, deletes)
+
+    index = CountingIndex()
+    for e in [entry('i-1', 10), entry('i-2', 20), entry('i-3', 30)]:
+        index.Upsert(e)
+
+    assert not index.IsPopulated()
+
+    index.Reconcile([Inst(entry('i-1', 10)), Inst(entry('i-2', 25)), Inst(entry('i-4', 40))])
+
+    assert index.written == (['i-2', 'i-4'], ['i-3'])
+    assert index.IsPopulated()
+    assert sorted(e.InstanceId for e in index.Entries()) == ['i-1', 'i-2', 'i-4']
+
+
+def test_dynamodb_queries_alias_reserved_key_names(now, entry):
+    client = boto3.client('dynamodb', region_name = 'us-east-1', aws_access_key_id = 'testing',
+                          aws_secret_access_key = 'testing')
+    index = DynamoDbExpirationIndex(client, 'Index', shard = '3', shard_count = 4)
+    item = {'InstanceId': {'S': 'i-1'}, 'Shard': {'S': '3'}, 'ExpireAt': {'S': '2024-02-03T18:53:48.000000Z'},
+            'ExpireAction': {'S': 'STOP'}}
+
+    def query(condition, names, values, **kwargs):
+        return dict(TableName = 'Index', IndexName = 'ExpireAtIndex', KeyConditionExpression = condition,
+                    ExpressionAttributeNames = names, ExpressionAttributeValues = values, **kwargs)
+
+    with Stubber(client) as stubber:
+        stubber.add_response('query', {'Items': [item]}, query(
+            '#shard = :shard AND #expire_at > :after', {'#shard': 'Shard', '#expire_at': 'ExpireAt'},
+            {':shard': {'S': '3'}, ':after': {'S': '2024-02-03T18:43:48.000000Z'}}, ScanIndexForward = True, Limit = 1,
+        ))
+        stubber.add_response('query', {'Items': [item]}, query(
+            '#shard = :shard AND #expire_at <= :at', {'#shard': 'Shard', '#expire_at': 'ExpireAt'},
+            {':shard': {'S': '3'}, ':at': {'S': '2024-02-03T18:43:48.000000Z'}}, ScanIndexForward = True,
+        ))
+        stubber.add_response('query', {'Items': [item]}, query(
+            '#shard = :shard', {'#shard': 'Shard'}, {':shard': {'S': '3'}},
+        ))
+
+        assert index.Next(now) == entry('i-1', 10)
+        assert list(index.Due(now)) == [entry('i-1', 10)]
+        assert list(index.Entries()) == [entry('i-1', 10)]
+
+        stubber.assert_no_pending_responses()
+
+
+def test_dynamodb_batch_write_raises_on_unprocessed_items(entry, monkeypatch):
+    client = boto3.client('dynamodb', region_name = 'us-east-1', aws_access_key_id = 'testing',
+                          aws_secret_access_key = 'testing')
+    index = DynamoDbExpirationIndex(client, 'Index')
+    unprocessed = {'Index': [{'DeleteRequest': {'Key': {'InstanceId': {'S': 'i-2'}}}}]}
+    monkeypatch.setattr('ExpirationIndex.time.sleep', lambda seconds: None)
+
+    with Stubber(client) as stubber:
+        for attempt in range(5):
+            stubber.add_response('batch_write_item', {'UnprocessedItems': unprocessed})
+
+        with pytest.raises(RuntimeError, match = 'unprocessed'):
+            index.WriteMany([entry('i-1', 10)], ['i-2'])
+
+        stubber.assert_no_pending_responses()
+
+
+def test_index_interface_is_abstract():
+    with pytest.raises(TypeError):
+        ExpirationIndex()
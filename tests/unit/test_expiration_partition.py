@@ -0,0 +1,24 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lambda', 'InstanceExpiration'))
+
+from ExpireAction import ExpireAction
+from ExpirationPartition import ExpirationPartition
+
+
+def test_soonest_first_terminate_wins_tie(now, entry):
+    partition = ExpirationPartition(now)
+
+    stream = [
+        entry('i-1', -5), entry('i-2', 10), entry('i-3', -5, ExpireAction.TERM), entry('i-4', -30),
+        entry('i-5', 3), entry('i-6', 3, ExpireAction.TERM), entry('i-7', 0),
+    ]
+
+    future = [e.InstanceId for e in partition.Future(stream)]
+
+    assert future == ['i-2', 'i-5', 'i-6']
+    assert partition.Next.InstanceId == 'i-6'
+    assert partition.ExpiredCount == 4
+    assert [e.InstanceId for e in partition.Expired()] == ['i-4', 'i-3', 'i-1', 'i-7']
+    assert partition.ExpiredCount == 0
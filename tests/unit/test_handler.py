@@ -0,0 +1,561 @@
+import os
+import sys
+import time
+import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmark'))
+
+from fleet_simulator import Fleet, Simulation, SimulatedError, NEXT_SCHEDULE_NAME, RATE_SCHEDULE_NAME
+
+Simulation.Environment()
+
+import Lambda
+from Ec2Instance import Ec2Instance
+from Trigger import Trigger
+from ExpireAction import ExpireAction
+from ExpirationIndex import ExpirationIndexEntry
+from ActionExecutor import TokenBucket
+
+
+def simulate(size, **kwargs):
+    fleet = Fleet(size, malformed = 0, **kwargs)
+    sim = Simulation(fleet)
+    sim.Install(Lambda)
+    return fleet, sim
+
+
+def expirations(fleet):
+    insts = [Ec2Instance(dict(i)) for i in fleet.Instances.values()]
+    return [i for i in insts if i.ExpireDateTime is not None]
+
+
+def test_backup_check_acts_on_expired_and_schedules_next():
+    fleet, sim = simulate(300, expired = 0.2)
+    now = datetime.datetime.now(datetime.UTC)
+    tagged = expirations(fleet)
+
+    expired = [i for i in tagged if i.ExpireDateTime <= now]
+    future = [i for i in tagged if i.ExpireDateTime > now]
+    to_term = {i.InstanceId for i in expired if i.ExpireAction.name == 'TERM'}
+    to_stop = {i.InstanceId for i in expired if i.ExpireAction.name == 'STOP' and i.State == 'running'}
+
+    assert sim.Invoke([sim.ScheduledEvent(RATE_SCHEDULE_NAME)]) == {'batchItemFailures': []}
+
+    assert {i for i, inst in fleet.Instances.items() if inst['State']['Name'] == 'terminated'} == to_term
+    assert {i.InstanceId for i in expired if fleet.Instances[i.InstanceId]['State']['Name'] == 'stopped'} >= to_stop
+    assert sim.Calls['events:PutEvents'] == -(-(len(to_term) + len(to_stop)) // 10)
+
+    assert len(sim.DynamoDb.Items) == len(future) + 1
+    soonest = min(future, key = lambda i: i.ExpireDateTime)
+    schedule = sim.Scheduler.Schedules[('default', NEXT_SCHEDULE_NAME)]
+    assert schedule['ScheduleExpression'] == 'at(' + soonest.ExpireDateTime.strftime(Lambda.SCHEDULE_AT_FMT) + ')'
+
+
+def test_sharded_backup_check_scans_each_instance_once(monkeypatch):
+    fleet, sim = simulate(300, expired = 0.2)
+    monkeypatch.setattr(Lambda, 'IX_SHARD_COUNT', 4)
+    now = datetime.datetime.now(datetime.UTC)
+    expired = {i.InstanceId for i in expirations(fleet) if i.ExpireDateTime <= now and i.ExpireAction.name == 'TERM'}
+    in_scope = [i.InstanceId for i in expirations(fleet) if i.State not in ('shutting-down', 'terminated')]
+    scanned = []
+    describe = sim.Ec2.DescribeInstances
+
+    def record(**kwargs):
+        rsp = describe(**kwargs)
+        if not any(f['Name'] == 'instance-id' and '*' not in f['Values'][0] for f in kwargs.get('Filters', [])):
+            scanned.extend(i['InstanceId'] for r in rsp['Reservations'] for i in r['Instances'])
+        return rsp
+
+    monkeypatch.setattr(sim.Ec2, 'DescribeInstances', record)
+
+    sim.Invoke([sim.ScheduledEvent(RATE_SCHEDULE_NAME)])
+    sim.Drain()
+
+    assert sorted(scanned) == sorted(in_scope)
+    assert {i for i, inst in fleet.Instances.items() if inst['State']['Name'] == 'terminated'} == expired
+
+
+def test_coalesced_retag_is_checked_incrementally():
+    fleet, sim = simulate(300, expired = 0)
+    sim.Invoke([sim.ScheduledEvent(RATE_SCHEDULE_NAME)])
+
+    running = [i.InstanceId for i in expirations(fleet) if fleet.Instances[i.InstanceId]['State']['Name'] == 'running']
+    fleet.ExpireNow(running[:5])
+    sim.Calls.clear()
+
+    sim.Invoke([Trigger.CoalescedBody('test', running[:5])])
+
+    assert all(fleet.Instances[i]['State']['Name'] == 'stopped' for i in running[:5])
+    assert sim.Calls['ec2:StopInstances'] == 1
+    assert sim.Calls['ec2:DescribeInstances'] == 2          # The check, then verification
+    assert not any(running[n] in sim.DynamoDb.Items for n in range(5))
+
+
+def test_checks_without_the_index_leave_it_unpopulated(monkeypatch):
+    fleet, sim = simulate(50, expired = 0)
+    sim.Invoke([sim.ScheduledEvent(RATE_SCHEDULE_NAME)])
+    instance_id = next(iter(fleet.Instances))
+
+    monkeypatch.setattr(Lambda, 'IX_INCREMENTAL_CHECKS', False)
+    fleet.ExpireAt([instance_id], datetime.datetime.now(datetime.UTC) + datetime.timedelta(hours = 2))
+    sim.Invoke([sim.ScheduledEvent(NEXT_SCHEDULE_NAME)])
+
+    monkeypatch.setattr(Lambda, 'IX_INCREMENTAL_CHECKS', True)
+    sim.Invoke([sim.ScheduledEvent(NEXT_SCHEDULE_NAME)])
+
+    assert instance_id in sim.DynamoDb.Items
+
+
+def test_shard_count_change_does_not_revive_old_shards(monkeypatch):
+    fleet, sim = simulate(50, expired = 0)
+
+    for shard_count in (4, 2):
+        monkeypatch.setattr(Lambda, 'IX_SHARD_COUNT', shard_count)
+        sim.Invoke([sim.ScheduledEvent(RATE_SCHEDULE_NAME)])
+        sim.Drain()
+
+    assert Lambda.ShardIndex('1').IsPopulated()
+    monkeypatch.setattr(Lambda, 'IX_SHARD_COUNT', 4)
+
+    assert not Lambda.ShardIndex('2').IsPopulated()
+    assert not Lambda.ShardIndex('3').IsPopulated()
+
+
+def retagged_at(fleet, sim, hours):
+    """
+    :return:    An EC2 instance id, its tags when retagged to expire in 'hours' and then in 'hours' * 2, and the index
+                item (populated by a backup check) after the second retag.
+    """
+
+    instance_id = next(iter(fleet.Instances))
+    now = datetime.datetime.now(datetime.UTC).replace(microsecond = 0)
+
+    first = fleet.ExpireAt([instance_id], now + datetime.timedelta(hours = hours))[instance_id]
+    second = fleet.ExpireAt([instance_id], now + datetime.timedelta(hours = hours * 2))[instance_id]
+
+    sim.Invoke([sim.ScheduledEvent(RATE_SCHEDULE_NAME)])
+    sim.Calls.clear()
+
+    return instance_id, first, second, dict(sim.DynamoDb.Items[instance_id])
+
+
+def minutes_from_now(minutes):
+    return datetime.datetime.now(datetime.UTC) + datetime.timedelta(minutes = minutes)
+
+
+@pytest.mark.parametrize('retag', ['first', 'none'])
+def test_newer_tag_change_is_applied_from_event(retag):
+    fleet, sim = simulate(50, expired = 0, tagged = 1)
+    instance_id, first, second, item = retagged_at(fleet, sim, 2)
+    tags = fleet.ExpireAt([instance_id], minutes_from_now(120)) if retag == 'first' else fleet.Untag([instance_id])
+
+    sim.Invoke([sim.TagChangeEvent(instance_id, tags[instance_id], at = minutes_from_now(1))])
+    applied = sim.DynamoDb.Items.get(instance_id)
+
+    assert sim.Calls['ec2:DescribeInstances'] == 0
+    assert applied != item
+
+    # Describing the EC2 instance agrees with the event
+    sim.Invoke([Trigger.CoalescedBody('test', [instance_id])])
+    described = sim.DynamoDb.Items.get(instance_id)
+
+    assert sim.Calls['ec2:DescribeInstances'] == 1
+    assert [i and (i['ExpireAt'], i['ExpireAction']) for i in (applied, described)] == \
+           [described and (described['ExpireAt'], described['ExpireAction'])] * 2
+
+
+@pytest.mark.parametrize('stale', ['first', 'none'])
+def test_stale_tag_change_is_described_rather_than_applied(stale):
+    fleet, sim = simulate(50, expired = 0, tagged = 1)
+    instance_id, first, second, item = retagged_at(fleet, sim, 2)
+
+    # Delivered out of order, after the index already reflects the second retag
+    tags = first if stale == 'first' else {'team': 'value'}
+    sim.Invoke([sim.TagChangeEvent(instance_id, tags, at = minutes_from_now(-1))])
+
+    assert sim.Calls['ec2:DescribeInstances'] == 1
+    assert sim.DynamoDb.Items[instance_id]['ExpireAt'] == item['ExpireAt']
+
+
+def test_latest_tag_change_is_kept_and_uncertain_order_is_described(now):
+    def event(instance_id, minutes, tags):
+        at = now + datetime.timedelta(minutes = minutes)
+        return Trigger({'body': Simulation.TagChangeEvent(instance_id, tags, at = at)})
+
+    tag_changes, tagged_at = Lambda.LatestTagChanges([
+        event('i-1', 2, {'a': 'new'}), event('i-1', 1, {'a': 'old'}),
+        event('i-2', 1, {'a': 'old'}), event('i-2', 2, {'a': 'new'}),
+        event('i-3', 1, {'a': 'old'}), event('i-3', 1, {'a': 'new'}),
+    ])
+
+    assert tag_changes == {'i-1': {'a': 'new'}, 'i-2': {'a': 'new'}, 'i-3': {'a': 'new'}}
+    assert tagged_at == {'i-1': now + datetime.timedelta(minutes = 2), 'i-2': now + datetime.timedelta(minutes = 2)}
+
+
+def test_tag_change_without_expiration_or_entry_is_resolved_from_event():
+    fleet, sim = simulate(50, expired = 0, tagged = 0)
+    sim.Invoke([sim.ScheduledEvent(RATE_SCHEDULE_NAME)])
+    instance_id = next(iter(fleet.Instances))
+    sim.Calls.clear()
+
+    sim.Invoke([sim.TagChangeEvent(instance_id, {'team:tag-0': 'value-0'})])
+
+    assert instance_id not in sim.DynamoDb.Items
+    assert sim.Calls['ec2:DescribeInstances'] == 0
+
+
+def test_expiration_lag_is_attributed_to_trigger():
+    fleet, sim = simulate(10, expired = 0)
+    instance_id = next(iter(fleet.Instances))
+
+    coalesced = Trigger({'messageId': 'm1', 'body': Trigger.CoalescedBody('test', ['i-1'], started_ids = ['i-2'])})
+    next_check = Trigger({'messageId': 'm2', 'body': sim.ScheduledEvent(NEXT_SCHEDULE_NAME)})
+    backup_check = Trigger({'messageId': 'm3', 'body': sim.ScheduledEvent(RATE_SCHEDULE_NAME)})
+    tag_change = Trigger({'messageId': 'm4', 'body': sim.TagChangeEvent(instance_id, {})})
+
+    assert Lambda.ActionCauses([coalesced, tag_change]) == {'i-1': 'Tag', 'i-2': 'Start', instance_id: 'Tag'}
+    assert Lambda.CheckCause([next_check, tag_change]) == 'NextSchedule'
+    assert Lambda.CheckCause([next_check, backup_check]) == 'RateSchedule'
+
+
+def test_restore_rebuilds_clients_and_clears_schedule_cache():
+    fleet, sim = simulate(50)
+    sim.Invoke([sim.ScheduledEvent(RATE_SCHEDULE_NAME)])
+    assert Lambda.NEXT_SCHEDULE_CACHE
+
+    session = Lambda.Clients.SESSION
+    before = {c: c.Client for c in Lambda.Clients.CLIENTS}
+
+    Lambda.Restore()
+
+    assert Lambda.Clients.SESSION is not session
+    assert not Lambda.NEXT_SCHEDULE_CACHE
+    assert all(c.Client is not client for c, client in before.items())
+
+
+@pytest.fixture
+def poisoned(monkeypatch):
+    """
+    Simulation in which describing the EC2 instance 'i-poison' fails, so any check of a trigger naming it fails.
+    """
+
+    fleet, sim = simulate(40, expired = 0, tagged = 1, stopped = 0)
+    sim.Invoke([sim.ScheduledEvent(RATE_SCHEDULE_NAME)])
+    describe = sim.Ec2.DescribeInstances
+
+    def describe_or_fail(Filters = (), **kwargs):
+        if any('i-poison' in f['Values'] for f in Filters if f['Name'] == 'instance-id'):
+            raise SimulatedError('UnauthorizedOperation', status = 403)
+        return describe(Filters = Filters, **kwargs)
+
+    monkeypatch.setattr(sim.Ec2, 'DescribeInstances', describe_or_fail)
+    return fleet, sim
+
+
+def test_failed_record_and_later_records_of_fifo_batch_are_redelivered(poisoned):
+    fleet, sim = poisoned
+    ids = sorted(fleet.Instances)
+    fleet.ExpireNow(ids[:4])
+
+    response = sim.Invoke([
+        Trigger.CoalescedBody('test', ids[0:2]),
+        Trigger.CoalescedBody('test', ['i-poison']),
+        Trigger.CoalescedBody('test', ids[2:4]),
+    ])
+
+    # Checked together, then one at a time up to the failure
+    assert response == {'batchItemFailures': [{'itemIdentifier': '1'}, {'itemIdentifier': '2'}]}
+    assert [fleet.Instances[i]['State']['Name'] for i in ids[:4]] == ['stopped', 'stopped', 'running', 'running']
+
+
+def test_failed_first_record_redelivers_whole_batch(poisoned):
+    fleet, sim = poisoned
+    ids = sorted(fleet.Instances)
+
+    response = sim.Invoke([Trigger.CoalescedBody('test', ['i-poison']), Trigger.CoalescedBody('test', ids[:2])])
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': '0'}, {'itemIdentifier': '1'}]}
+
+
+def test_failed_single_record_is_redelivered(poisoned):
+    fleet, sim = poisoned
+
+    assert sim.Invoke([Trigger.CoalescedBody('test', ['i-poison'])]) == {'batchItemFailures': [{'itemIdentifier': '0'}]}
+
+
+def in_seconds(seconds):
+    return datetime.datetime.now(datetime.UTC) + datetime.timedelta(seconds = seconds)
+
+
+def test_imminent_wait_only_within_window_and_time_budget(monkeypatch):
+    monkeypatch.setattr(Lambda, 'IX_IMMINENT_WAIT', 30)
+    monkeypatch.setattr(Lambda, 'INVOCATION_DEADLINE', time.monotonic() + 600)
+
+    def wait(seconds):
+        return Lambda.ImminentWait(ExpirationIndexEntry('i-1', ExpireAction.STOP, in_seconds(seconds)))
+
+    assert 9 < wait(10) <= 10
+    assert wait(-5) == 0
+    assert wait(45) is None
+
+    # Not without IMMINENT_WAIT_MARGIN left to act after the wait
+    monkeypatch.setattr(Lambda, 'INVOCATION_DEADLINE', time.monotonic() + Lambda.IMMINENT_WAIT_MARGIN + 5)
+    assert wait(10) is None
+    assert wait(2) is not None
+
+    monkeypatch.setattr(Lambda, 'INVOCATION_DEADLINE', None)
+    assert wait(10) is None
+
+    monkeypatch.setattr(Lambda, 'IX_IMMINENT_WAIT', 0)
+    monkeypatch.setattr(Lambda, 'INVOCATION_DEADLINE', time.monotonic() + 600)
+    assert wait(10) is None
+
+
+@pytest.fixture
+def waiting(monkeypatch):
+    """
+    Simulation with ImminentWait enabled, an expiration index populated with no expirations, and the waits of the
+    Lambda recorded (and still taken).
+    """
+
+    fleet, sim = simulate(20, tagged = 0, stopped = 0)
+    sim.Invoke([sim.ScheduledEvent(RATE_SCHEDULE_NAME)])
+    sim.Calls.clear()
+
+    waits = []
+    sleep = time.sleep
+
+    def record(seconds):
+        waits.append(seconds)
+        sleep(seconds)
+
+    monkeypatch.setattr(Lambda, 'IX_IMMINENT_WAIT', 30)
+    monkeypatch.setattr(Lambda.time, 'sleep', record)
+    return fleet, sim, waits
+
+
+def test_check_waits_for_expiration_within_window(waiting):
+    fleet, sim, waits = waiting
+    ids = sorted(fleet.Instances)
+    fleet.ExpireAt(ids[:1], in_seconds(2))
+    fleet.ExpireAt(ids[1:2], in_seconds(3600))
+
+    assert sim.Invoke([Trigger.CoalescedBody('test', ids[:2])]) == {'batchItemFailures': []}
+
+    assert len(waits) == 1 and 0 < waits[0] <= 2
+    assert fleet.Instances[ids[0]]['State']['Name'] == 'stopped'
+    assert fleet.Instances[ids[1]]['State']['Name'] == 'running'
+
+    # Then schedules the next expiration, past the window
+    expression = sim.Scheduler.Schedules[('default', NEXT_SCHEDULE_NAME)]['ScheduleExpression']
+    at = datetime.datetime.strptime(expression, 'at(' + Lambda.SCHEDULE_AT_FMT + ')').replace(tzinfo = datetime.UTC)
+    assert abs((at - in_seconds(3600)).total_seconds()) < 5
+
+
+def test_check_schedules_expiration_past_window(waiting):
+    fleet, sim, waits = waiting
+    ids = sorted(fleet.Instances)
+    fleet.ExpireAt(ids[:1], in_seconds(45))
+
+    sim.Invoke([Trigger.CoalescedBody('test', ids[:1])])
+
+    assert waits == []
+    assert fleet.Instances[ids[0]]['State']['Name'] == 'running'
+    assert sim.Calls['scheduler:UpdateSchedule'] == 1
+
+
+def test_check_does_not_wait_near_invocation_deadline(waiting):
+    fleet, sim, waits = waiting
+    ids = sorted(fleet.Instances)
+    fleet.ExpireAt(ids[:1], in_seconds(5))
+
+    sim.Invoke([Trigger.CoalescedBody('test', ids[:1])], remaining = Lambda.IMMINENT_WAIT_MARGIN + 2)
+
+    assert waits == []
+    assert fleet.Instances[ids[0]]['State']['Name'] == 'running'
+    assert sim.Calls['scheduler:UpdateSchedule'] == 1
+
+
+@pytest.fixture
+def retagged(monkeypatch):
+    """
+    Simulation with a populated expiration index, 25 running EC2 instances just retagged to expire, and passes of 10.
+    """
+
+    fleet, sim = simulate(30, expired = 0, tagged = 1, stopped = 0)
+    sim.Invoke([sim.ScheduledEvent(RATE_SCHEDULE_NAME)])
+    ids = sorted(fleet.Instances)[:25]
+    fleet.ExpireNow(ids)
+    sim.Calls.clear()
+
+    monkeypatch.setattr(Lambda, 'ACTION_PASS_SIZE', 10)
+    return fleet, sim, ids
+
+
+def due():
+    return {e.InstanceId for e in Lambda.ShardIndex(None).Due(datetime.datetime.now(datetime.UTC))}
+
+
+def stopped(fleet, ids):
+    return {i for i in ids if fleet.Instances[i]['State']['Name'] == 'stopped'}
+
+
+def test_instances_left_at_time_budget_are_handed_off(retagged):
+    fleet, sim, ids = retagged
+
+    assert sim.Invoke([Trigger.CoalescedBody('test', ids)], remaining = Lambda.HANDOFF_MARGIN - 1) == \
+        {'batchItemFailures': []}
+
+    # Even the first pass is handed off, to a continuation with a full time budget
+    assert stopped(fleet, ids) == set()
+    assert sim.Calls['sqs:SendMessage'] == 1
+    assert due() == set()
+
+    assert sim.Drain() == 1
+    assert stopped(fleet, ids) == set(ids)
+
+
+def test_passes_fit_the_time_budget_at_a_low_action_rate_share(monkeypatch):
+    fleet, sim = simulate(200, expired = 0, tagged = 1, stopped = 0, terminate = 0)
+    sim.Invoke([sim.ScheduledEvent(RATE_SCHEDULE_NAME)])
+    ids = sorted(fleet.Instances)
+    fleet.ExpireNow(ids)
+
+    # Simulated clock: waits for the rate limits advance it instead of taking real time
+    clock = [0.0]
+
+    def sleep(seconds):
+        clock[0] += seconds
+
+    monkeypatch.setattr(Lambda.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(Lambda.time, 'sleep', sleep)
+    monkeypatch.setattr(Lambda, 'IX_ACTION_RATE_SHARE', 0.01)
+    monkeypatch.setattr(Lambda, 'EC2_MUTATING_REQUESTS', TokenBucket(0.05, 2))
+    monkeypatch.setattr(Lambda, 'EC2_MUTATING_INSTANCES', TokenBucket(0.2, 10))
+
+    assert Lambda.ActionPassSize() == 9
+
+    assert sim.Invoke([Trigger.CoalescedBody('test', ids)]) == {'batchItemFailures': []}
+
+    # About 1000 seconds of stops at this share: the invocation stays within its 600 seconds, and hands off the rest
+    assert clock[0] < 600
+    assert 0 < len(stopped(fleet, ids)) < len(ids)
+    assert sim.Calls['sqs:SendMessage'] == 1
+
+
+def test_failed_hand_off_keeps_unhandled_instances_due(retagged, monkeypatch):
+    fleet, sim, ids = retagged
+
+    def send_message(**kwargs):
+        raise SimulatedError('AccessDenied', status = 403)
+
+    monkeypatch.setattr(sim.Sqs, 'SendMessage', send_message)
+
+    assert sim.Invoke([Trigger.CoalescedBody('test', ids)], remaining = Lambda.HANDOFF_MARGIN - 1) == \
+        {'batchItemFailures': [{'itemIdentifier': '0'}]}
+
+    assert stopped(fleet, ids) == set()
+    assert due() == set(ids)
+
+    # The next check, whatever its trigger, acts on them
+    monkeypatch.undo()
+    sim.Invoke([sim.ScheduledEvent(NEXT_SCHEDULE_NAME)])
+    assert stopped(fleet, ids) == set(ids)
+    assert due() == set()
+
+
+def test_failed_action_keeps_instance_due(retagged):
+    fleet, sim, ids = retagged
+    sim.Ec2.Failing = {ids[0]}
+
+    sim.Invoke([Trigger.CoalescedBody('test', ids)])
+
+    assert stopped(fleet, ids) == set(ids[1:])
+    assert due() == {ids[0]}
+
+    sim.Ec2.Failing = set()
+    sim.Invoke([sim.ScheduledEvent(NEXT_SCHEDULE_NAME)])
+    assert stopped(fleet, ids) == set(ids)
+    assert due() == set()
+
+
+@pytest.fixture
+def direct(monkeypatch):
+    monkeypatch.setattr(Lambda, 'IX_DIRECT_ACTIONS', True)
+    monkeypatch.setattr(Lambda, 'DIRECT_ACTIONS', {ExpireAction.STOP: 'stop-role', ExpireAction.TERM: 'term-role'})
+    monkeypatch.setattr(Lambda, 'DIRECT_ACTION_RECONCILE_WRITES', 20)
+
+
+def direct_schedules(sim):
+    return {n[len('Expire-'):]: s for (g, n), s in sim.Scheduler.Schedules.items() if n.startswith('Expire-')}
+
+
+def test_enabling_direct_actions_writes_schedules_in_continuations(direct):
+    fleet, sim = simulate(200, expired = 0, tagged = 1)
+    future = {i.InstanceId for i in expirations(fleet)}
+
+    assert sim.Invoke([sim.ScheduledEvent(RATE_SCHEDULE_NAME)]) == {'batchItemFailures': []}
+
+    assert len(direct_schedules(sim)) == 20
+    assert set(sim.DynamoDb.Items) >= future
+    assert [Trigger({'body': b}).IsContinuation for b in sim.Sqs.Groups['InstanceExpiration']] == [True]
+
+    sim.Drain()
+
+    assert set(direct_schedules(sim)) == future
+    assert {s['Target']['RoleArn'] for s in direct_schedules(sim).values()} <= {'stop-role', 'term-role'}
+
+
+@pytest.fixture
+def failing_schedule_write(direct, monkeypatch):
+    """
+    :return:    The simulation, an EC2 instance id, its index item and direct action schedule, and a set whose
+                truthiness makes schedule updates fail, after the EC2 instance was retagged to expire later.
+    """
+
+    fleet, sim = simulate(50, expired = 0, tagged = 1)
+    sim.Invoke([sim.ScheduledEvent(RATE_SCHEDULE_NAME)])
+    sim.Drain()
+    instance_id = next(iter(fleet.Instances))
+    item = dict(sim.DynamoDb.Items[instance_id])
+    schedule = direct_schedules(sim)[instance_id]
+    failing = {True}
+    update_schedule = sim.Scheduler.UpdateSchedule
+
+    def update(**kwargs):
+        if failing:
+            raise SimulatedError('InternalServerException', status = 500)
+        return update_schedule(**kwargs)
+
+    monkeypatch.setattr(sim.Scheduler, 'UpdateSchedule', update)
+    later = datetime.datetime.now(datetime.UTC) + datetime.timedelta(days = 30)
+    tags = fleet.ExpireAt([instance_id], later)[instance_id]
+
+    assert sim.Invoke([sim.TagChangeEvent(instance_id, tags)]) == {'batchItemFailures': []}
+
+    return sim, instance_id, item, schedule, failing
+
+
+def test_failed_schedule_write_is_handed_off_and_retried(failing_schedule_write):
+    sim, instance_id, item, schedule, failing = failing_schedule_write
+
+    assert sim.DynamoDb.Items[instance_id] == item
+    assert direct_schedules(sim)[instance_id] == schedule
+    retry = Trigger({'body': sim.Sqs.Groups['InstanceExpiration'][0]})
+    assert (retry.IsContinuation, retry.Retries, retry.InstanceIds) == (True, 1, [instance_id])
+
+    failing.clear()
+    sim.Drain()
+
+    assert sim.DynamoDb.Items[instance_id] != item
+    assert direct_schedules(sim)[instance_id] != schedule
+
+
+def test_failed_schedule_write_retries_are_bounded(failing_schedule_write):
+    sim, instance_id, item, schedule, failing = failing_schedule_write
+
+    assert sim.Drain() == Lambda.DIRECT_ACTION_MAX_RETRIES
+    assert sim.DynamoDb.Items[instance_id] == item
+    assert direct_schedules(sim)[instance_id] == schedule
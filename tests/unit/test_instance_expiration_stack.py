@@ -13,3 +13,96 @@ def test_sqs_queue_created():
 #     template.has_resource_properties("AWS::SQS::Queue", {
 #         "VisibilityTimeout": 300
 #     })
+
+
+def test_expiration_index_table_created():
+    app = core.App()
+    stack = Stack(app, "instance-expiration")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::DynamoDB::Table", {
+        "KeySchema": [{"AttributeName": "InstanceId", "KeyType": "HASH"}],
+        "GlobalSecondaryIndexes": [assertions.Match.object_like({
+            "IndexName": "ExpireAtIndex",
+            "KeySchema": [
+                {"AttributeName": "Shard", "KeyType": "HASH"},
+                {"AttributeName": "ExpireAt", "KeyType": "RANGE"},
+            ],
+        })],
+    })
+
+
+def test_sqs_event_source_reports_batch_item_failures():
+    app = core.App()
+    stack = Stack(app, "instance-expiration")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::Lambda::EventSourceMapping", {
+        "BatchSize": 10,
+        "FunctionResponseTypes": ["ReportBatchItemFailures"],
+    })
+
+
+def test_coalescer_is_conditional():
+    app = core.App()
+    stack = Stack(app, "instance-expiration")
+    template = assertions.Template.from_stack(stack)
+
+    coalescer = template.find_resources("AWS::Lambda::Function", {
+        "Properties": {"Handler": "Coalesce.handler"},
+    })
+
+    assert len(coalescer) == 1
+    assert all(r["Condition"] == "CondCoalescingEnabled" for r in coalescer.values())
+
+
+def test_direct_action_roles_are_conditional_and_scoped_to_their_action():
+    app = core.App()
+    stack = Stack(app, "instance-expiration")
+    template = assertions.Template.from_stack(stack)
+
+    roles = template.find_resources("AWS::IAM::Role", {
+        "Condition": "CondDirectActionsEnabled",
+    })
+
+    assert len(roles) == 2
+
+    policies = template.find_resources("AWS::IAM::Policy", {
+        "Condition": "CondDirectActionsEnabled",
+    })
+    actions = {
+        role["Ref"]: {statement["Action"] for statement in policy["Properties"]["PolicyDocument"]["Statement"]}
+        for policy in policies.values() if "Roles" in policy["Properties"]
+        for role in policy["Properties"]["Roles"] if role["Ref"] in roles
+    }
+
+    assert sorted(map(sorted, actions.values())) == [["ec2:StopInstances"], ["ec2:TerminateInstances"]]
+
+
+def test_snap_start_alias_is_conditional():
+    app = core.App()
+    stack = Stack(app, "instance-expiration")
+    template = assertions.Template.from_stack(stack)
+
+    aliases = template.find_resources("AWS::Lambda::Alias")
+    assert len(aliases) == 1
+    assert all(r["Condition"] == "CondSnapStartEnabled" for r in aliases.values())
+
+    template.has_resource_properties("AWS::Lambda::EventSourceMapping", {
+        "BatchSize": 10,
+        "FunctionName": {"Fn::If": ["CondSnapStartEnabled", {"Ref": list(aliases)[0]}, assertions.Match.any_value()]},
+    })
+
+
+def test_tracing_is_conditional():
+    app = core.App()
+    stack = Stack(app, "instance-expiration")
+    template = assertions.Template.from_stack(stack)
+
+    template.has_resource_properties("AWS::Lambda::Function", {
+        "Handler": "Lambda.handler",
+        "TracingConfig": {"Fn::If": ["CondTracingEnabled", {"Mode": "Active"}, {"Ref": "AWS::NoValue"}]},
+    })
+
+    policies = template.find_resources("AWS::IAM::Policy", {"Condition": "CondTracingEnabled"})
+    assert len(policies) == 1
@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lambda', 'InstanceExpiration'))
+
+from Metrics import MetricsRecorder, MAX_VALUES
+
+
+def flush(metrics):
+    records = []
+    metrics.Flush(write = lambda line: records.append(json.loads(line)))
+    return records
+
+
+def test_counts_are_written_every_invocation():
+    metrics = MetricsRecorder('Test', counts = ['StopActions', 'InstancesDue'])
+    metrics.Count('StopActions')
+    metrics.Count('StopActions', 2)
+
+    [record] = flush(metrics)
+
+    directive = record['_aws']['CloudWatchMetrics'][0]
+    assert directive['Namespace'] == 'Test'
+    assert directive['Dimensions'] == [[]]
+    assert {m['Name']: m['Unit'] for m in directive['Metrics']} == {'StopActions': 'Count', 'InstancesDue': 'Count'}
+    assert (record['StopActions'], record['InstancesDue']) == (3, 0)
+
+    # Reset by the flush
+    [record] = flush(metrics)
+    assert record['StopActions'] == 0
+
+
+def test_values_are_kept_individually_per_dimensions():
+    metrics = MetricsRecorder('Test')
+    metrics.Value('ExpirationLag', 1.5, Action = 'STOP')
+    metrics.Value('ExpirationLag', 2.5, Action = 'STOP')
+    metrics.Value('ExpirationLag', 9.0, Action = 'TERM')
+
+    records = {r.get('Action'): r for r in flush(metrics) if 'ExpirationLag' in r}
+
+    assert records['STOP']['ExpirationLag'] == [1.5, 2.5]
+    assert records['TERM']['ExpirationLag'] == 9.0
+    assert records['STOP']['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [[], ['Action']]
+
+
+def test_values_are_rolled_up_by_each_dimension():
+    metrics = MetricsRecorder('Test')
+    metrics.Value('ExpirationLag', 1.5, Action = 'STOP', Trigger = 'Tag')
+
+    [record] = [r for r in flush(metrics) if 'ExpirationLag' in r]
+
+    assert record['_aws']['CloudWatchMetrics'][0]['Dimensions'] == [[], ['Action'], ['Trigger'], ['Action', 'Trigger']]
+    assert (record['Action'], record['Trigger']) == ('STOP', 'Tag')
+
+
+def test_many_values_are_split_across_records():
+    metrics = MetricsRecorder('Test')
+    for n in range(MAX_VALUES * 2 + 1):
+        metrics.Value('ExpirationLag', n)
+
+    records = flush(metrics)
+
+    assert [len(r['ExpirationLag']) if isinstance(r['ExpirationLag'], list) else 1 for r in records] == [100, 100, 1]
+
+
+def test_timer_and_disabled():
+    metrics = MetricsRecorder('Test')
+    with metrics.Timer('ScanDuration'):
+        pass
+    [record] = flush(metrics)
+    assert record['_aws']['CloudWatchMetrics'][0]['Metrics'] == [{'Name': 'ScanDuration', 'Unit': 'Milliseconds'}]
+
+    disabled = MetricsRecorder('Test', enabled = False, counts = ['StopActions'])
+    disabled.Count('StopActions')
+    assert flush(disabled) == []
@@ -0,0 +1,50 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lambda', 'InstanceExpiration'))
+
+from Sharding import ShardOf, Shards, ShardFilter
+from Trigger import Trigger
+from TriggerKind import TriggerKind
+
+
+def test_shard_of_is_stable_and_in_range():
+    ids = ['i-%017x' % n for n in range(1000)]
+    shards = [ShardOf(i, 4) for i in ids]
+
+    assert shards == [ShardOf(i, 4) for i in ids]
+    assert set(shards) == set(Shards(4)) == {'0', '1', '2', '3'}
+    assert {ShardOf(i, 1) for i in ids} == {'0'}
+
+
+def test_coalesced_trigger_round_trip():
+    body = Trigger.CoalescedBody('source', ['i-1'], {'i-2': {'expiration:stop-after-duration': '1d'}}, '3', True)
+    t = Trigger({'messageId': 'm1', 'body': body})
+
+    assert t.Kind == TriggerKind.COALESCED
+    assert (t.MessageId, t.Shard, t.IsFullCheck) == ('m1', '3', True)
+    assert t.InstanceIds == ['i-1', 'i-2']
+    assert list(t.TagChanges) == ['i-2']
+    assert not t.IsInstanceScoped
+
+
+def test_coalesced_trigger_keeps_started_instances_and_continuation():
+    body = Trigger.CoalescedBody('source', ['i-1'], {'i-3': {}}, started_ids = ['i-2'], continuation = True)
+    t = Trigger({'messageId': 'm1', 'body': body})
+
+    assert t.InstanceIds == ['i-1', 'i-2', 'i-3']
+    assert t.StartedInstanceIds == {'i-2'}
+    assert t.IsContinuation
+    assert not Trigger({'messageId': 'm2', 'body': Trigger.CoalescedBody('source', ['i-1'])}).IsContinuation
+
+
+def test_shard_filter_selects_the_shard_by_last_digit():
+    ids = ['i-%017x' % n for n in range(64)]
+
+    for count in (2, 3, 16):
+        for shard in Shards(count):
+            suffixes = ShardFilter(shard, count)['Values']
+            assert [i for i in ids if any(i.endswith(v[1:]) for v in suffixes)] == \
+                   [i for i in ids if ShardOf(i, count) == shard]
+
+    assert ShardFilter('0', 2) == {'Name': 'instance-id', 'Values': ['*0', '*2', '*4', '*6', '*8', '*a', '*c', '*e']}
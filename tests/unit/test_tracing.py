@@ -0,0 +1,80 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'lambda', 'InstanceExpiration'))
+
+import pytest
+
+from Tracing import Tracer, FileExporter, ParseTraceHeader, NO_SPAN
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def Export(self, span):
+        self.spans.append(span)
+
+
+def test_spans_nest_and_count_calls():
+    calls = [0]
+    exporter = ListExporter()
+    tracer = Tracer(exporter, calls = lambda: calls[0])
+    tracer.Begin('Root=1-5759e988-bd862e3fe1be46a994272793;Parent=53995c3f42cd8ad8;Sampled=1')
+
+    with tracer.Span('Scan', shard = '0') as scan:
+        with tracer.Span('Describe') as describe:
+            calls[0] += 2
+        scan.SetAttribute('expired', 3)
+
+    describe, scan = exporter.spans
+    assert (describe.Name, scan.Name) == ('Describe', 'Scan')
+    assert describe.ParentId == scan.Id
+    assert scan.ParentId == '53995c3f42cd8ad8'
+    assert scan.Attributes == {'shard': '0', 'expired': 3, 'api_calls': 2}
+
+    doc = scan.ToXRay()
+    assert (doc['type'], doc['trace_id'], doc['parent_id']) == ('subsegment', '1-5759e988-bd862e3fe1be46a994272793',
+                                                                '53995c3f42cd8ad8')
+    assert doc['start_time'] <= doc['end_time']
+
+
+def test_failed_span_is_marked():
+    exporter = ListExporter()
+    tracer = Tracer(exporter)
+
+    with pytest.raises(ValueError):
+        with tracer.Span('Act'):
+            raise ValueError()
+
+    assert exporter.spans[0].Error
+    assert exporter.spans[0].ToXRay()['fault']
+
+
+def test_disabled_or_unsampled_exports_nothing():
+    assert ParseTraceHeader(None)[1:] == (None, True)
+
+    with Tracer().Span('Scan') as span:
+        assert span is NO_SPAN
+
+    exporter = ListExporter()
+    tracer = Tracer(exporter)
+    tracer.Begin('Root=1-5759e988-bd862e3fe1be46a994272793;Sampled=0')
+    with tracer.Span('Scan'):
+        pass
+    assert exporter.spans == []
+
+
+def test_file_exporter_writes_open_telemetry_records(tmp_path):
+    path = tmp_path / 'spans.jsonl'
+    tracer = Tracer(FileExporter(str(path)))
+
+    with tracer.Span('Verify', instances = 5):
+        pass
+
+    [record] = [json.loads(line) for line in path.read_text().splitlines()]
+    assert record['name'] == 'Verify'
+    assert len(record['context']['trace_id']) == 2 + 32
+    assert record['parent_id'] is None
+    assert record['attributes'] == {'instances': 5}